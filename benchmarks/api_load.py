@@ -0,0 +1,198 @@
+"""Replays a mix of API requests at a fixed concurrency and reports latency percentiles and throughput per route.
+
+Without --url, a synthetic archive is generated and served by the local API server in the same process. Run from the
+repository root:
+
+    PYTHONPATH=. python benchmarks/api_load.py
+    PYTHONPATH=. python benchmarks/api_load.py --url http://127.0.0.1:8080 --metadata metadata.db
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+import aiohttp
+import simplejson as json
+from aiohttp import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "knotsrepus-api-lambda"))
+
+import api_controller  # noqa: E402
+import local_server  # noqa: E402
+from src.common import search_index, statistics  # noqa: E402
+from src.common.comment_index import write_comment_index  # noqa: E402
+from src.common.filesystem import LocalFileSystem  # noqa: E402
+from src.common.metadata import SQLiteMetadataService, create_metadata  # noqa: E402
+
+AUTHORS = [f"author{i}" for i in range(50)]
+FLAIRS = ["DD", "Discussion", "Shitpost", "News", "Data", None]
+WORDS = ["hodl", "drs", "computershare", "shares", "ape", "market", "short", "squeeze", "moass", "vote"]
+
+# Each request template is weighted by how often it is requested, and is named after its route in the results.
+REQUEST_MIX = [
+    (30, "/submission/{id}", lambda ids: (f"/submission/{random.choice(ids)}", {})),
+    (15, "/submission", lambda ids: ("/submission", {"sort": random.choice(["created_utc", "score"]),
+                                                     "sort_order": "desc", "count": "25"})),
+    (10, "/submission?author", lambda ids: ("/submission", {"author": random.choice(AUTHORS), "count": "25"})),
+    (15, "/submission/{id}/comments", lambda ids: (f"/submission/{random.choice(ids)}/comments",
+                                                   {"sort": "score", "sort_order": "desc", "limit": "50"})),
+    (10, "/submission/batch", lambda ids: ("/submission/batch", {"ids": ",".join(random.sample(ids, 25))})),
+    (10, "/search", lambda ids: ("/search", {"q": " ".join(random.sample(WORDS, 2))})),
+    (5, "/stats/summary", lambda ids: ("/stats/summary", {})),
+    (5, "/stats/authors", lambda ids: ("/stats/authors", {"count": "10"})),
+]
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def generate_archive(root, submission_count, comment_count):
+    filesystem = LocalFileSystem(root)
+    metadata_service = SQLiteMetadataService(os.path.join(root, "metadata.db"))
+    index_writer = search_index.SearchIndexWriter(filesystem)
+    statistics_writer = statistics.StatisticsWriter(filesystem)
+
+    items = []
+    for i in range(submission_count):
+        submission_id = f"s{i:05x}"
+        post = {
+            "id": submission_id,
+            "author": random.choice(AUTHORS),
+            "title": " ".join(random.choices(WORDS, k=8)),
+            "selftext": " ".join(random.choices(WORDS, k=200)),
+            "created_utc": 1630450800 + i * 60,
+            "score": random.randint(0, 5000),
+            "link_flair_text": random.choice(FLAIRS),
+            "subreddit": "Superstonk",
+        }
+        comments = [
+            {
+                "id": f"{submission_id}c{j}",
+                "author": random.choice(AUTHORS),
+                "body": " ".join(random.choices(WORDS, k=30)),
+                "created_utc": post["created_utc"] + j,
+                "score": random.randint(-10, 500),
+            }
+            for j in range(random.randint(0, comment_count * 2))
+        ]
+
+        await filesystem.write(f"{submission_id}/post.json", json.dumps(post))
+        await filesystem.write(f"{submission_id}/comments.json", json.dumps(comments))
+        await write_comment_index(filesystem, submission_id, comments)
+
+        metadata = create_metadata(submission_id, post)
+        items.append(metadata)
+        index_writer.add(submission_id, post["created_utc"], post["title"])
+        statistics_writer.update(None, metadata)
+
+    await metadata_service.put_many(items)
+    await index_writer.flush()
+    await statistics_writer.flush()
+    await statistics.compact_statistics(filesystem)
+
+    return [item["submission_id"] for item in items]
+
+
+async def start_local_server(root):
+    api = api_controller.ApiController(LocalFileSystem(root),
+                                       SQLiteMetadataService(os.path.join(root, "metadata.db")))
+
+    runner = web.AppRunner(local_server.create_app(api), access_log=None)
+    await runner.setup()
+
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+
+    port = runner.addresses[0][1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+async def generate_load(url, submission_ids, concurrency, request_count):
+    weights = [weight for weight, _, _ in REQUEST_MIX]
+    results = {name: [] for _, name, _ in REQUEST_MIX}
+    errors = {name: 0 for _, name, _ in REQUEST_MIX}
+    remaining = request_count
+
+    async def worker(session):
+        nonlocal remaining
+
+        while remaining > 0:
+            remaining -= 1
+
+            _, name, make_request = random.choices(REQUEST_MIX, weights)[0]
+            path, params = make_request(submission_ids)
+
+            started = time.perf_counter()
+            async with session.get(url + path, params=params, headers={"Accept-Encoding": "gzip"}) as response:
+                await response.read()
+
+            results[name].append((time.perf_counter() - started) * 1000)
+            if response.status >= 400:
+                errors[name] += 1
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return results, errors, elapsed
+
+
+async def run(args):
+    random.seed(args.seed)
+    runner = None
+
+    with tempfile.TemporaryDirectory() as root:
+        if args.url is None:
+            print(f"Generating an archive of {args.submissions} submissions...")
+            submission_ids = await generate_archive(root, args.submissions, args.comments)
+            runner, url = await start_local_server(root)
+        else:
+            url = args.url
+            submission_ids = [
+                item["submission_id"]
+                for item in await SQLiteMetadataService(args.metadata).list(limit=100)
+            ]
+
+        results, errors, elapsed = await generate_load(url, submission_ids, args.concurrency, args.requests)
+
+        if runner is not None:
+            await runner.cleanup()
+
+    total = sum(len(latencies) for latencies in results.values())
+    print(f"{total} requests at a concurrency of {args.concurrency} in {elapsed:.2f} s, {total / elapsed:.0f} req/s")
+    print(f"{'route':28s} {'count':>6s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s} {'req/s':>8s} {'errors':>6s}")
+
+    for name, latencies in results.items():
+        if len(latencies) == 0:
+            continue
+
+        latencies.sort()
+        print(f"{name:28s} {len(latencies):6d} {percentile(latencies, 0.5):8.2f} {percentile(latencies, 0.95):8.2f} "
+              f"{percentile(latencies, 0.99):8.2f} {len(latencies) / elapsed:8.0f} {errors[name]:6d}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="API to load, instead of serving a synthetic archive locally")
+    parser.add_argument("--metadata", help="SQLite metadata store to sample submission ids from, with --url")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--submissions", type=int, default=500)
+    parser.add_argument("--comments", type=int, default=200, help="average comments per generated submission")
+    parser.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args()
+    if args.url is not None and args.metadata is None:
+        parser.error("--metadata is required with --url")
+
+    return args
+
+
+if __name__ == "__main__":
+    asyncio.get_event_loop().run_until_complete(run(parse_args()))
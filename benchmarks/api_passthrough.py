@@ -0,0 +1,86 @@
+"""Compares sending stored comments as they are with parsing and serializing them again, on a 50k-comment thread.
+
+Run from the repository root:
+
+    PYTHONPATH=. python benchmarks/api_passthrough.py
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "knotsrepus-api-lambda"))
+
+import api_controller  # noqa: E402
+import main  # noqa: E402
+import rest  # noqa: E402
+from src.common.filesystem import LocalFileSystem  # noqa: E402
+from src.common.metadata import SQLiteMetadataService  # noqa: E402
+
+COMMENT_COUNT = 50000
+ITERATIONS = 5
+
+
+def make_comments():
+    return [
+        {
+            "id": f"c{i:06d}",
+            "author": f"author{i % 997}",
+            "body": "Buy, hold, and drs. " * (1 + i % 8),
+            "created_utc": 1630450800 + i,
+            "parent_id": f"t1_c{i // 2:06d}" if i > 0 else "t3_pnkm3r",
+            "score": i % 50,
+            "link_id": "t3_pnkm3r",
+        }
+        for i in range(COMMENT_COUNT)
+    ]
+
+
+class ReserializingController(api_controller.ApiController):
+    # Parses the stored JSON and serializes it again, as the API used to.
+    async def get_comments(self, submission_id, **kwargs):
+        data, etag = await self.filesystem.read_with_etag(f"{submission_id}/comments.json")
+        return rest.ok(json.loads(data), headers={"ETag": etag})
+
+
+def measure(api):
+    loop = asyncio.get_event_loop()
+    latencies = []
+    peaks = []
+
+    for _ in range(ITERATIONS):
+        tracemalloc.start()
+        started = time.perf_counter()
+
+        response = loop.run_until_complete(api.get_comments("pnkm3r"))
+        main.format_response(*response)
+
+        latencies.append((time.perf_counter() - started) * 1000)
+        peaks.append(tracemalloc.get_traced_memory()[1] / 1024 / 1024)
+        tracemalloc.stop()
+
+    return min(latencies), max(peaks)
+
+
+def run():
+    with tempfile.TemporaryDirectory() as root:
+        os.makedirs(os.path.join(root, "pnkm3r"))
+        with open(os.path.join(root, "pnkm3r", "comments.json"), "w") as file:
+            json.dump(make_comments(), file, ensure_ascii=True, indent=4)
+
+        size = os.path.getsize(os.path.join(root, "pnkm3r", "comments.json")) / 1024 / 1024
+
+        filesystem = LocalFileSystem(root)
+        reserialized = measure(ReserializingController(filesystem, SQLiteMetadataService()))
+        passed_through = measure(api_controller.ApiController(filesystem, SQLiteMetadataService()))
+
+    print(f"{COMMENT_COUNT} comments, {size:.1f} MiB stored")
+    print(f"parse and serialize: {reserialized[0]:7.1f} ms, {reserialized[1]:6.1f} MiB peak")
+    print(f"pass-through:        {passed_through[0]:7.1f} ms, {passed_through[1]:6.1f} MiB peak")
+
+
+if __name__ == "__main__":
+    run()
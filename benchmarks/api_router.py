@@ -0,0 +1,80 @@
+"""Compares the API router with the regex matcher that it replaced.
+
+The old matcher compiled a regex for every route whenever a path wasn't an exact match, then tried each in turn. Run
+from the repository root:
+
+    PYTHONPATH=. python benchmarks/api_router.py
+"""
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "knotsrepus-api-lambda"))
+
+import api_controller  # noqa: E402,F401
+import rest  # noqa: E402
+
+ITERATIONS = 20000
+
+PATHS = [
+    "/submission",
+    "/stats/authors/VoxUmbra",
+    "/submission/pnkm3r",
+    "/submission/pnkm3r/media/image.png",
+]
+
+
+def legacy_match_route(routes, path):
+    if path in routes:
+        return routes[path], {}
+
+    def make_pattern(route):
+        return "^" + re.sub(r"{(\w+)}", r"(?P<\1>[^/]+)", route) + "$"
+
+    for key, value in routes.items():
+        match = re.match(make_pattern(key), path)
+
+        if match is None:
+            continue
+
+        return value, match.groupdict()
+
+    return None, None
+
+
+def get_routes():
+    # The routes in the order the old matcher would have tried them, which was the order they were declared in.
+    return {
+        route.path: route.fn
+        for route in (rest.match_route(path)[0] for path in [
+            "/submission",
+            "/search",
+            "/stats/summary",
+            "/stats/daily",
+            "/stats/authors",
+            "/stats/authors/a",
+            "/stats/scores",
+            "/submission/a",
+            "/submission/a/comments",
+            "/submission/a/media",
+            "/submission/a/media/b",
+        ])
+    }
+
+
+def main():
+    routes = get_routes()
+
+    print(f"{ITERATIONS} matches per path")
+    for path in PATHS:
+        assert legacy_match_route(routes, path)[0] is rest.match_route(path)[0].fn
+
+        legacy = timeit.timeit(lambda: legacy_match_route(routes, path), number=ITERATIONS)
+        tree = timeit.timeit(lambda: rest.match_route(path), number=ITERATIONS)
+
+        print(f"{path:40s} regex: {legacy / ITERATIONS * 1e6:6.2f} us, radix tree: {tree / ITERATIONS * 1e6:6.2f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Measures the latency of warm API Lambda invocations against a local stand-in for S3.
+
+Compares creating a session, filesystem and controller for every invocation, as the API Lambda used to, with reusing
+them and their clients across invocations. Run from the repository root:
+
+    PYTHONPATH=. python benchmarks/api_warm_path.py
+"""
+import asyncio
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+import aioboto3
+from aiohttp import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "knotsrepus-api-lambda"))
+
+import api_controller  # noqa: E402
+import main  # noqa: E402
+from src.common.filesystem import S3FileSystem  # noqa: E402
+from src.common.metadata import StubMetadataService  # noqa: E402
+
+INVOCATIONS = 200
+PORT = 8765
+
+POST = json.dumps({"id": "pnkm3r", "title": "A submission", "author": "VoxUmbra"}).encode("utf-8")
+
+
+async def get_object(request):
+    return web.Response(body=POST, content_type="application/json")
+
+
+def start_stand_in():
+    loop = asyncio.new_event_loop()
+    app = web.Application()
+    app.router.add_get("/{tail:.*}", get_object)
+    runner = web.AppRunner(app)
+
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", PORT).start())
+
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+
+def get_api_controller_per_invocation(context):
+    # Creates everything again for each invocation, as the API Lambda used to.
+    filesystem = S3FileSystem(os.environ["ARCHIVE_DATA_BUCKET"], aioboto3.Session())
+    return api_controller.ApiController(filesystem, StubMetadataService())
+
+
+def get_api_controller_reused(context):
+    if main.controller is None:
+        filesystem = S3FileSystem(os.environ["ARCHIVE_DATA_BUCKET"], main.get_session())
+        main.controller = api_controller.ApiController(filesystem, StubMetadataService())
+
+    return main.controller
+
+
+def measure(get_api_controller):
+    main.get_api_controller = get_api_controller
+    event = {"path": "/submission/pnkm3r", "queryStringParameters": None}
+
+    # The first invocation stands in for the cold start, and isn't counted.
+    assert main.handler(event, None)["statusCode"] == 200
+
+    latencies = []
+    for _ in range(INVOCATIONS):
+        started = time.perf_counter()
+        main.handler(event, None)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.95)]
+
+
+def run():
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    os.environ["AWS_ENDPOINT_URL_S3"] = f"http://127.0.0.1:{PORT}"
+    os.environ["ARCHIVE_DATA_BUCKET"] = "archive"
+
+    start_stand_in()
+
+    per_invocation = measure(get_api_controller_per_invocation)
+    reused = measure(get_api_controller_reused)
+    asyncio.get_event_loop().run_until_complete(main.get_session().close())
+
+    print(f"{INVOCATIONS} warm invocations of /submission/{{id}}")
+    print(f"per invocation: p50 {per_invocation[0]:6.2f} ms, p95 {per_invocation[1]:6.2f} ms")
+    print(f"reused:         p50 {reused[0]:6.2f} ms, p95 {reused[1]:6.2f} ms")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,118 @@
+"""Measures metadata generation write throughput against a local stand-in for DynamoDB.
+
+Compares writing each item and its checkpoint with a request of their own, as the metadata generator used to, with
+batching items through put_many and coalescing checkpoints with a Checkpointer. Each request to the stand-in takes
+LATENCY_MS, which stands in for the round trip to DynamoDB. Writing per item is slow enough that only the first
+PER_ITEM_COUNT items are written that way. Run from the repository root:
+
+    PYTHONPATH=. python benchmarks/metadata_batch_writes.py
+"""
+import asyncio
+import collections
+import json
+import os
+import threading
+import time
+
+import aioboto3
+from aiohttp import web
+
+from src.common.archiver_config import DynamoDBConfigSource
+from src.common.checkpoint import Checkpointer
+from src.common.metadata import DynamoDBMetadataService, create_metadata
+
+ITEM_COUNT = 2000
+PER_ITEM_COUNT = 200
+BATCH_SIZE = 100
+LATENCY_MS = 5
+PORT = 8766
+
+requests = collections.Counter()
+
+
+async def handle(request):
+    operation = request.headers["X-Amz-Target"].split(".")[-1]
+    requests[operation] += 1
+
+    await request.read()
+    await asyncio.sleep(LATENCY_MS / 1000)
+
+    body = {"UnprocessedItems": {}} if operation == "BatchWriteItem" else {}
+    return web.Response(body=json.dumps(body), content_type="application/x-amz-json-1.0")
+
+
+def start_stand_in():
+    loop = asyncio.new_event_loop()
+    app = web.Application()
+    app.router.add_post("/", handle)
+    runner = web.AppRunner(app, access_log=None)
+
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", PORT).start())
+
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+
+def make_items():
+    return [
+        create_metadata(f"p{i:05x}", {
+            "created_utc": 1630450800 + i,
+            "author": f"author{i % 97}",
+            "title": "A submission",
+            "score": i % 500,
+            "subreddit": "Superstonk",
+        })
+        for i in range(ITEM_COUNT)
+    ]
+
+
+async def write_per_item(metadata_service, config_source, items):
+    # Every item and every checkpoint is written with a request of its own, as the metadata generator used to.
+    for item in items:
+        await metadata_service.put(item["submission_id"], item)
+        await config_source.put_config(last_generated_metadata=item["submission_id"])
+
+
+async def write_batched(metadata_service, config_source, items):
+    checkpointer = Checkpointer(config_source, every_items=1000, every_seconds=30)
+
+    for i in range(0, len(items), BATCH_SIZE):
+        batch = items[i:i + BATCH_SIZE]
+        await metadata_service.put_many(batch)
+        await checkpointer.update(len(batch), last_generated_metadata=batch[-1]["submission_id"])
+
+    await checkpointer.flush()
+
+
+def measure(write, count):
+    session = aioboto3.Session()
+    metadata_service = DynamoDBMetadataService(session, "metadata")
+    config_source = DynamoDBConfigSource(session, "config")
+
+    requests.clear()
+    started = time.perf_counter()
+    asyncio.new_event_loop().run_until_complete(write(metadata_service, config_source, make_items()[:count]))
+    elapsed = time.perf_counter() - started
+
+    return count / elapsed, sum(requests.values())
+
+
+def run():
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    os.environ["AWS_ENDPOINT_URL_DYNAMODB"] = f"http://127.0.0.1:{PORT}"
+
+    start_stand_in()
+
+    per_item = measure(write_per_item, PER_ITEM_COUNT)
+    batched = measure(write_batched, ITEM_COUNT)
+
+    print(f"{LATENCY_MS} ms per request")
+    print(f"per item: {PER_ITEM_COUNT:5d} items, {per_item[0]:6.0f} items/s, {per_item[1]:5d} requests")
+    print(f"batched:  {ITEM_COUNT:5d} items, {batched[0]:6.0f} items/s, {batched[1]:5d} requests "
+          f"({batched[0] / per_item[0]:.0f}x)")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,78 @@
+"""Measures submission-finder discovery throughput against a stand-in for SNS.
+
+Each publish call takes a fixed latency, as a round trip to SNS would, so the results show how far discovery is bound by
+publishing. Run from the repository root:
+
+    PYTHONPATH=. python benchmarks/submission_finder_publish.py
+"""
+import asyncio
+import importlib.util
+import os
+import time
+
+from src.common import pushshift
+from src.common.archiver_config import MemoryConfigSource
+from src.common.messaging import RecordingMessagingService
+
+PAGE_COUNT = 20
+PAGE_SIZE = 100
+PUBLISH_LATENCY = 0.02
+PUSHSHIFT_LATENCY = 0.05
+
+
+def load_submission_finder():
+    path = os.path.join(os.path.dirname(__file__), "..", "src", "submission-finder", "main.py")
+    spec = importlib.util.spec_from_file_location("submission_finder", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class SerialMessagingService(RecordingMessagingService):
+    # Publishes one message per call, one call at a time, as submission-finder used to.
+    async def send_messages(self, messages):
+        for message in messages:
+            await self.send_message(message)
+
+
+async def fake_request(endpoint, subreddit=None, after=0, **kwargs):
+    await asyncio.sleep(PUSHSHIFT_LATENCY)
+
+    page = after // PAGE_SIZE
+    if page >= PAGE_COUNT:
+        return []
+
+    return [
+        {"id": f"s{created_utc:06d}", "created_utc": created_utc}
+        for created_utc in range(after + 1, after + PAGE_SIZE + 1)
+    ]
+
+
+def measure(submission_finder, messaging_service):
+    started = time.monotonic()
+    asyncio.get_event_loop().run_until_complete(submission_finder.main(MemoryConfigSource(), messaging_service))
+    elapsed = time.monotonic() - started
+
+    assert len(messaging_service.messages) == PAGE_COUNT * PAGE_SIZE
+
+    return elapsed, len(messaging_service.calls)
+
+
+def main():
+    pushshift.request = fake_request
+    submission_finder = load_submission_finder()
+
+    serial_elapsed, serial_calls = measure(submission_finder, SerialMessagingService(PUBLISH_LATENCY))
+    batched_elapsed, batched_calls = measure(submission_finder, RecordingMessagingService(PUBLISH_LATENCY))
+
+    submission_count = PAGE_COUNT * PAGE_SIZE
+    print(f"{submission_count} submissions, {PUBLISH_LATENCY * 1000:.0f} ms per publish call, "
+          f"{PUSHSHIFT_LATENCY * 1000:.0f} ms per Pushshift page")
+    print(f"serial:  {serial_calls:5d} calls, {serial_elapsed:6.2f} s, {submission_count / serial_elapsed:8.0f} "
+          f"submissions/s")
+    print(f"batched: {batched_calls:5d} calls, {batched_elapsed:6.2f} s, {submission_count / batched_elapsed:8.0f} "
+          f"submissions/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,19 +8,33 @@ from aws_cdk import (
     aws_dynamodb as dynamodb,
     aws_ec2 as ec2,
     aws_ecs as ecs,
+    aws_events as events,
+    aws_events_targets as targets,
     aws_lambda as lambda_,
+    aws_lambda_event_sources as event_sources,
     aws_route53 as route53,
     aws_s3 as s3,
+    aws_secretsmanager as secretsmanager,
     aws_sns as sns,
     aws_sns_subscriptions as subscriptions,
+    aws_sqs as sqs,
     core
 )
 
+# The indexes of listings by author and post type are added to the existing metadata table in stages, each deployed in
+# turn: 1 adds the chronological index, 2 adds the score index, and 3 has the API query them, once a metadata rebuild
+# has backfilled every item. The stage is set by the `metadata_index_stage` context value in cdk.json.
+DEFAULT_METADATA_INDEX_STAGE = 1
+
 
 class KnotsrepusArchiverStack(core.Stack):
     def __init__(self, scope: core.Construct, construct_id: str, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
+        self.metadata_index_stage = int(
+            self.node.try_get_context("metadata_index_stage") or DEFAULT_METADATA_INDEX_STAGE
+        )
+
         us_cert, eu_cert = self.get_certificates()
 
         archive_data_bucket = s3.Bucket(self, "ArchiveData")
@@ -50,6 +64,12 @@ class KnotsrepusArchiverStack(core.Stack):
             display_name="Topic indicating that archival of a submission has been requested."
         )
 
+        submission_archived_topic = sns.Topic(
+            self,
+            "SubmissionArchived",
+            display_name="Topic indicating that a submission has been archived."
+        )
+
         archive_submission_lambda = lambda_.Function(
             self,
             "ArchiveSubmission",
@@ -58,7 +78,8 @@ class KnotsrepusArchiverStack(core.Stack):
             timeout=core.Duration.minutes(1),
             code=KnotsrepusArchiverStack.get_lambda_asset("./archive-submission-lambda"),
             environment={
-                "ARCHIVE_DATA_BUCKET": archive_data_bucket.bucket_name
+                "ARCHIVE_DATA_BUCKET": archive_data_bucket.bucket_name,
+                "SUBMISSION_ARCHIVED_TOPIC_ARN": submission_archived_topic.topic_arn,
             }
         )
 
@@ -90,13 +111,24 @@ class KnotsrepusArchiverStack(core.Stack):
         archive_data_bucket.grant_put(archive_submission_lambda.role)
         archive_data_bucket.grant_put(archive_comments_lambda.role)
         archive_data_bucket.grant_put(archive_media_lambda.role)
+        # The media archiver reads the existing manifest so that re-archiving updates it in place.
+        archive_data_bucket.grant_read(archive_media_lambda.role)
 
         archival_requested_topic.add_subscription(subscriptions.LambdaSubscription(archive_submission_lambda))
         archival_requested_topic.add_subscription(subscriptions.LambdaSubscription(archive_comments_lambda))
         archival_requested_topic.add_subscription(subscriptions.LambdaSubscription(archive_media_lambda))
 
+        submission_archived_topic.grant_publish(archive_submission_lambda.role)
+
+        self.create_metadata_updater(archive_data_bucket, config_table, metadata_table, submission_archived_topic)
+
+        self.create_metadata_refresh(archive_data_bucket, config_table, metadata_table)
+
+        self.create_metadata_compaction(archive_data_bucket)
+
         knotsrepus_api_backend_lambda, knotsrepus_api_gateway = self.create_knotsrepus_api(
             archive_data_bucket,
+            config_table,
             metadata_table,
             eu_cert
         )
@@ -104,7 +136,9 @@ class KnotsrepusArchiverStack(core.Stack):
         cluster = self.create_cluster()
 
         submission_finder_task_definition = self.create_submission_finder_task_definition(archival_requested_topic,
-                                                                                          config_table)
+                                                                                          archive_data_bucket,
+                                                                                          config_table,
+                                                                                          metadata_table)
 
         submission_finder_service = ecs.FargateService(
             self,
@@ -118,22 +152,146 @@ class KnotsrepusArchiverStack(core.Stack):
             assign_public_ip=True
         )
 
-        metadata_generator_task_definition = self.create_metadata_generator_task_definition(archive_data_bucket,
-                                                                                            config_table,
-                                                                                            metadata_table)
+        # Metadata generation is split across several workers, each of which owns a disjoint subset of the keyspace
+        # partitions. The worker count can be changed freely, as progress is checkpointed per partition.
+        # New submissions are picked up by the metadata updater as they are archived, so the generator services are
+        # only scaled up to rebuild the metadata from a listing of the whole archive.
+        metadata_generator_worker_count = 2
+
+        for worker_index in range(metadata_generator_worker_count):
+            metadata_generator_task_definition = self.create_metadata_generator_task_definition(
+                archive_data_bucket,
+                config_table,
+                metadata_table,
+                worker_index,
+                metadata_generator_worker_count
+            )
+
+            ecs.FargateService(
+                self,
+                f"MetadataGeneratorService{worker_index}",
+                cluster=cluster,
+                task_definition=metadata_generator_task_definition,
+                desired_count=0,
+                capacity_provider_strategies=[
+                    ecs.CapacityProviderStrategy(capacity_provider="FARGATE", weight=1)
+                ],
+                vpc_subnets=ec2.SubnetSelection(subnet_type=ec2.SubnetType.ISOLATED)
+            )
 
-        metadata_generator_service = ecs.FargateService(
+    def create_metadata_updater(self, archive_data_bucket: s3.Bucket, config_table: dynamodb.Table,
+                                metadata_table: dynamodb.Table, submission_archived_topic: sns.Topic):
+        # Submissions that still fail to update after several attempts are kept aside, rather than being retried forever
+        # or dropped, so that they can be redriven once whatever failed is fixed.
+        submission_archived_dead_letter_queue = sqs.Queue(
             self,
-            "MetadataGeneratorService",
-            cluster=cluster,
-            task_definition=metadata_generator_task_definition,
-            desired_count=1,
-            capacity_provider_strategies=[
-                ecs.CapacityProviderStrategy(capacity_provider="FARGATE", weight=1)
-            ],
-            vpc_subnets=ec2.SubnetSelection(subnet_type=ec2.SubnetType.ISOLATED)
+            "SubmissionArchivedDeadLetterQueue",
+            retention_period=core.Duration.days(14)
+        )
+
+        submission_archived_queue = sqs.Queue(
+            self,
+            "SubmissionArchivedQueue",
+            # At least six times the updater's timeout, so that messages aren't received again while the updater is
+            # still retrying a throttled batch.
+            visibility_timeout=core.Duration.minutes(6),
+            dead_letter_queue=sqs.DeadLetterQueue(max_receive_count=5, queue=submission_archived_dead_letter_queue)
+        )
+
+        submission_archived_topic.add_subscription(
+            subscriptions.SqsSubscription(submission_archived_queue, raw_message_delivery=True)
+        )
+
+        metadata_updater_lambda = lambda_.Function(
+            self,
+            "MetadataUpdater",
+            runtime=lambda_.Runtime.PYTHON_3_8,
+            handler="main.handler",
+            # The queue's visibility timeout must be kept at least six times as long.
+            timeout=core.Duration.minutes(1),
+            code=KnotsrepusArchiverStack.get_lambda_asset("./metadata-updater-lambda"),
+            environment={
+                "ARCHIVE_DATA_BUCKET": archive_data_bucket.bucket_name,
+                "CONFIG_TABLE_NAME": config_table.table_name,
+                "METADATA_TABLE_NAME": metadata_table.table_name,
+            }
+        )
+
+        metadata_updater_lambda.add_event_source(
+            event_sources.SqsEventSource(submission_archived_queue, batch_size=10)
+        )
+
+        archive_data_bucket.grant_read_write(metadata_updater_lambda.role)
+        config_table.grant_read_write_data(metadata_updater_lambda.role)
+        metadata_table.grant_read_write_data(metadata_updater_lambda.role)
+
+        return metadata_updater_lambda
+
+    def create_metadata_refresh(self, archive_data_bucket: s3.Bucket, config_table: dynamodb.Table,
+                                metadata_table: dynamodb.Table):
+        metadata_refresh_lambda = lambda_.Function(
+            self,
+            "MetadataRefresh",
+            runtime=lambda_.Runtime.PYTHON_3_8,
+            handler="main.handler",
+            timeout=core.Duration.minutes(5),
+            # Overlapping runs would refresh the same submissions, so the refresh must never run concurrently with itself.
+            reserved_concurrent_executions=1,
+            code=KnotsrepusArchiverStack.get_lambda_asset("./metadata-refresh-lambda"),
+            environment={
+                "ARCHIVE_DATA_BUCKET": archive_data_bucket.bucket_name,
+                "CONFIG_TABLE_NAME": config_table.table_name,
+                "METADATA_TABLE_NAME": metadata_table.table_name,
+                # The maximum number of Pushshift requests made per run, each of which refreshes up to 100 submissions.
+                "REFRESH_REQUEST_BUDGET": "30",
+            }
         )
 
+        # Which submissions are refreshed depends on the time of each run, so the schedule has to match the run
+        # interval that the refresh expects.
+        events.Rule(
+            self,
+            "MetadataRefreshSchedule",
+            schedule=events.Schedule.rate(core.Duration.hours(1)),
+            targets=[targets.LambdaFunction(metadata_refresh_lambda)]
+        )
+
+        archive_data_bucket.grant_read_write(metadata_refresh_lambda.role)
+        config_table.grant_read_write_data(metadata_refresh_lambda.role)
+        metadata_table.grant_read_write_data(metadata_refresh_lambda.role)
+
+        return metadata_refresh_lambda
+
+    def create_metadata_compaction(self, archive_data_bucket: s3.Bucket):
+        metadata_compaction_lambda = lambda_.Function(
+            self,
+            "MetadataCompaction",
+            runtime=lambda_.Runtime.PYTHON_3_8,
+            handler="main.handler",
+            timeout=core.Duration.minutes(5),
+            memory_size=1024,
+            # Statistics are compacted by reading and rewriting the base statistics, so the compaction must never run
+            # concurrently with itself. Search index runs written by the updater are compacted along with them.
+            reserved_concurrent_executions=1,
+            code=KnotsrepusArchiverStack.get_lambda_asset("./metadata-compaction-lambda"),
+            environment={
+                "ARCHIVE_DATA_BUCKET": archive_data_bucket.bucket_name,
+            }
+        )
+
+        # Statistics served by the API lag behind the metadata by up to one interval, and searches read the runs written
+        # by the updater individually until then.
+        events.Rule(
+            self,
+            "MetadataCompactionSchedule",
+            schedule=events.Schedule.rate(core.Duration.minutes(5)),
+            targets=[targets.LambdaFunction(metadata_compaction_lambda)]
+        )
+
+        archive_data_bucket.grant_read_write(metadata_compaction_lambda.role)
+
+        return metadata_compaction_lambda
+
     def get_certificates(self):
         hosted_zone = route53.PublicHostedZone.from_lookup(
             self,
@@ -225,6 +383,23 @@ class KnotsrepusArchiverStack(core.Stack):
             projection_type=dynamodb.ProjectionType.ALL
         )
 
+        # DynamoDB only creates one global secondary index per table update, so the indexes of author and post type
+        # listings are added to the existing table in stages, with a deploy for each.
+        if self.metadata_index_stage >= 1:
+            metadata_table.add_global_secondary_index(
+                index_name="ArchiveMetadataByAuthorPostTypeChronological",
+                partition_key=dynamodb.Attribute(name="author_post_type", type=dynamodb.AttributeType.STRING),
+                sort_key=dynamodb.Attribute(name="created_utc", type=dynamodb.AttributeType.NUMBER),
+                projection_type=dynamodb.ProjectionType.ALL
+            )
+        if self.metadata_index_stage >= 2:
+            metadata_table.add_global_secondary_index(
+                index_name="ArchiveMetadataByAuthorPostTypeScore",
+                partition_key=dynamodb.Attribute(name="author_post_type", type=dynamodb.AttributeType.STRING),
+                sort_key=dynamodb.Attribute(name="score", type=dynamodb.AttributeType.NUMBER),
+                projection_type=dynamodb.ProjectionType.ALL
+            )
+
         metadata_table.auto_scale_global_secondary_index_read_capacity(
             index_name="ArchiveMetadataByDummyChronological",
             min_capacity=5,
@@ -285,10 +460,39 @@ class KnotsrepusArchiverStack(core.Stack):
             min_capacity=5,
             max_capacity=1000,
         ).scale_on_utilization(target_utilization_percent=70)
+        if self.metadata_index_stage >= 1:
+            metadata_table.auto_scale_global_secondary_index_read_capacity(
+                index_name="ArchiveMetadataByAuthorPostTypeChronological",
+                min_capacity=5,
+                max_capacity=1000,
+            ).scale_on_utilization(target_utilization_percent=70)
+            metadata_table.auto_scale_global_secondary_index_write_capacity(
+                index_name="ArchiveMetadataByAuthorPostTypeChronological",
+                min_capacity=5,
+                max_capacity=1000,
+            ).scale_on_utilization(target_utilization_percent=70)
+        if self.metadata_index_stage >= 2:
+            metadata_table.auto_scale_global_secondary_index_read_capacity(
+                index_name="ArchiveMetadataByAuthorPostTypeScore",
+                min_capacity=5,
+                max_capacity=1000,
+            ).scale_on_utilization(target_utilization_percent=70)
+            metadata_table.auto_scale_global_secondary_index_write_capacity(
+                index_name="ArchiveMetadataByAuthorPostTypeScore",
+                min_capacity=5,
+                max_capacity=1000,
+            ).scale_on_utilization(target_utilization_percent=70)
 
         return metadata_table
 
-    def create_knotsrepus_api(self, archive_data_bucket: s3.Bucket, metadata_table: dynamodb.Table, certificate: certificatemanager.Certificate):
+    def create_knotsrepus_api(self, archive_data_bucket: s3.Bucket, config_table: dynamodb.Table, metadata_table: dynamodb.Table, certificate: certificatemanager.Certificate):
+        # Used to sign pagination cursors, which must be readable by every instance of the API.
+        cursor_secret = secretsmanager.Secret(
+            self,
+            "CursorSecret",
+            generate_secret_string=secretsmanager.SecretStringGenerator(exclude_punctuation=True, password_length=64)
+        )
+
         knotsrepus_api_backend_lambda = lambda_.Function(
             self,
             "KnotsrepusApiBackend",
@@ -298,10 +502,20 @@ class KnotsrepusArchiverStack(core.Stack):
             environment={
                 "ARCHIVE_DATA_BUCKET": archive_data_bucket.bucket_name,
                 "METADATA_TABLE_NAME": metadata_table.table_name,
+                "CURSOR_SECRET_ARN": cursor_secret.secret_arn,
+                # Listings by author and post type filter an author's listing until every item has been backfilled
+                # with the attribute that their own indexes are keyed on.
+                "AUTHOR_POST_TYPE_INDEXES": "true" if self.metadata_index_stage >= 3 else "false",
+                # Query results are cached until whatever writes metadata changes the cache epoch in the config table,
+                # which is checked every few seconds, and are only kept for so long in case the epoch can't be read.
+                "CONFIG_TABLE_NAME": config_table.table_name,
+                "QUERY_CACHE_TTL": "300",
             }
         )
 
         archive_data_bucket.grant_read(knotsrepus_api_backend_lambda.role)
+        cursor_secret.grant_read(knotsrepus_api_backend_lambda.role)
+        config_table.grant_read_data(knotsrepus_api_backend_lambda.role)
         metadata_table.grant_read_data(knotsrepus_api_backend_lambda.role)
 
         domain_name = apigateway.DomainNameOptions(
@@ -382,7 +596,8 @@ class KnotsrepusArchiverStack(core.Stack):
 
         return cluster
 
-    def create_submission_finder_task_definition(self, archival_requested_topic, config_table):
+    def create_submission_finder_task_definition(self, archival_requested_topic, archive_data_bucket, config_table,
+                                                 metadata_table):
         submission_finder_task_definition = ecs.FargateTaskDefinition(
             self,
             "SubmissionFinderDefinition",
@@ -397,20 +612,29 @@ class KnotsrepusArchiverStack(core.Stack):
             ),
             environment={
                 "CONFIG_TABLE_NAME": config_table.table_name,
-                "ARCHIVAL_REQUESTED_TOPIC_ARN": archival_requested_topic.topic_arn
+                "ARCHIVAL_REQUESTED_TOPIC_ARN": archival_requested_topic.topic_arn,
+                "ARCHIVE_DATA_BUCKET": archive_data_bucket.bucket_name,
+                "METADATA_TABLE_NAME": metadata_table.table_name,
+                "SUBMISSION_FINDER_MODE": "stream",
             },
-            logging=ecs.LogDriver.aws_logs(stream_prefix=core.Aws.STACK_NAME)
+            logging=ecs.LogDriver.aws_logs(stream_prefix=core.Aws.STACK_NAME),
+            # Allows time to save progress after SIGTERM.
+            stop_timeout=core.Duration.seconds(60)
         )
 
         config_table.grant_read_write_data(submission_finder_task_definition.task_role)
         archival_requested_topic.grant_publish(submission_finder_task_definition.task_role)
+        # The filter of archived submissions is kept in the archive, and rebuilt from the metadata table.
+        archive_data_bucket.grant_read_write(submission_finder_task_definition.task_role, "_system/*")
+        metadata_table.grant_read_data(submission_finder_task_definition.task_role)
 
         return submission_finder_task_definition
 
-    def create_metadata_generator_task_definition(self, archive_data_bucket, config_table, metadata_table):
+    def create_metadata_generator_task_definition(self, archive_data_bucket, config_table, metadata_table,
+                                                  worker_index, worker_count):
         metadata_generator_task_definition = ecs.FargateTaskDefinition(
             self,
-            "MetadataGeneratorDefinition",
+            f"MetadataGeneratorDefinition{worker_index}",
             memory_limit_mib=512,
             cpu=256
         )
@@ -423,14 +647,17 @@ class KnotsrepusArchiverStack(core.Stack):
             environment={
                 "CONFIG_TABLE_NAME": config_table.table_name,
                 "METADATA_TABLE_NAME": metadata_table.table_name,
-                "ARCHIVE_DATA_BUCKET": archive_data_bucket.bucket_name
+                "ARCHIVE_DATA_BUCKET": archive_data_bucket.bucket_name,
+                "METADATA_WORKER_INDEX": str(worker_index),
+                "METADATA_WORKER_COUNT": str(worker_count),
             },
             logging=ecs.LogDriver.aws_logs(stream_prefix=core.Aws.STACK_NAME)
         )
 
         config_table.grant_read_write_data(metadata_generator_task_definition.task_role)
         metadata_table.grant_read_write_data(metadata_generator_task_definition.task_role)
-        archive_data_bucket.grant_read(metadata_generator_task_definition.task_role)
+        # The generator reads submissions and writes the search index segments back into the archive.
+        archive_data_bucket.grant_read_write(metadata_generator_task_definition.task_role)
 
         return metadata_generator_task_definition
 
@@ -4,6 +4,7 @@ import os
 from datetime import datetime
 
 from src.common import log_utils, pushshift
+from src.common.comment_index import write_comment_index
 from src.common.filesystem import S3FileSystem, StubFileSystem
 from src.common.lambda_context import local_lambda_invocation
 
@@ -32,6 +33,10 @@ async def handle(submission_id, filesystem, logger):
     data = json.dumps(comments, ensure_ascii=True, indent=4)
     await filesystem.write(f"{submission_id}/comments.json", data)
 
+    # The whole thread is still stored as one file for clients that want all of it, and the index lets the API serve
+    # pages of it without reading the whole thread.
+    await write_comment_index(filesystem, submission_id, comments)
+
     return {
         "statusCode": 200,
         "body": json.dumps({
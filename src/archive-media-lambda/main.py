@@ -6,6 +6,7 @@ from datetime import datetime
 import aiohttp as aiohttp
 
 from src.common import log_utils, http_utils, pushshift
+from src.common.manifest import describe_file, update_manifest
 from src.common.filesystem import S3FileSystem, StubFileSystem
 from src.common.lambda_context import local_lambda_invocation
 
@@ -35,6 +36,12 @@ async def handle(submission_id, filesystem, logger):
         for name, data in media:
             await filesystem.write_raw(f"{submission_id}/{name}", data)
 
+        # The manifest is written even when there is no media, so that the API can tell a submission without media
+        # apart from one archived before manifests existed.
+        archived_utc = int(datetime.utcnow().timestamp())
+        await update_manifest(filesystem, submission_id,
+                              [describe_file(name, data, archived_utc) for name, data in media])
+
         return {
             "statusCode": 200,
             "body": json.dumps({
@@ -3,9 +3,12 @@ import json
 import os
 from datetime import datetime
 
+import aioboto3
+
 from src.common import log_utils, pushshift
 from src.common.filesystem import S3FileSystem, StubFileSystem
 from src.common.lambda_context import local_lambda_invocation
+from src.common.messaging import SNSMessagingService, StubMessagingService
 
 
 def handler(event, context):
@@ -14,13 +17,15 @@ def handler(event, context):
 
     if context is local_lambda_invocation:
         filesystem = StubFileSystem()
+        messaging_service = StubMessagingService()
     else:
         filesystem = S3FileSystem(os.environ.get("ARCHIVE_DATA_BUCKET"))
+        messaging_service = SNSMessagingService(aioboto3.Session(), os.environ.get("SUBMISSION_ARCHIVED_TOPIC_ARN"))
 
-    return asyncio.get_event_loop().run_until_complete(handle(submission_id, logger, filesystem))
+    return asyncio.get_event_loop().run_until_complete(handle(submission_id, logger, filesystem, messaging_service))
 
 
-async def handle(submission_id, logger, filesystem):
+async def handle(submission_id, logger, filesystem, messaging_service):
     submission = (await pushshift.request("submission/search", ids=submission_id))[0]
 
     logger.info(f"Archiving {submission_id}...")
@@ -30,6 +35,9 @@ async def handle(submission_id, logger, filesystem):
     data = json.dumps(submission, ensure_ascii=True, indent=4)
     await filesystem.write(f"{submission_id}/post.json", data)
 
+    # Lets the metadata updater pick up the submission straight away, rather than waiting for a listing of the archive.
+    await messaging_service.send_message(submission_id)
+
     return {
         "statusCode": 200,
         "body": json.dumps({
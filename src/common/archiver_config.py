@@ -1,3 +1,4 @@
+import time
 from abc import ABC, abstractmethod
 from datetime import datetime
 
@@ -16,6 +17,10 @@ class ArchiverConfigSource(ABC):
     async def put_config(self, **kwargs):
         pass
 
+    async def compact(self, keys, keep: int):
+        # Sources that keep a history of values can discard all but the latest `keep` versions of the given keys.
+        pass
+
 
 class StubConfigSource(ArchiverConfigSource):
     def __init__(self):
@@ -31,6 +36,17 @@ class StubConfigSource(ArchiverConfigSource):
         self.logger.info(f"Stubbed: put_config {kwargs}")
 
 
+class MemoryConfigSource(ArchiverConfigSource):
+    def __init__(self, **config):
+        self.config = config
+
+    async def get_config(self, key: str):
+        return self.config.get(key)
+
+    async def put_config(self, **kwargs):
+        self.config.update(kwargs)
+
+
 class DynamoDBConfigSource(ArchiverConfigSource):
     def __init__(self, session: aioboto3.Session, table_name: str):
         self.session = session
@@ -59,3 +75,99 @@ class DynamoDBConfigSource(ArchiverConfigSource):
                             "value": value,
                         }
                     )
+
+    async def compact(self, keys, keep: int):
+        async with self.session.resource("dynamodb") as dynamodb:
+            table = await dynamodb.Table(self.table_name)
+
+            async with table.batch_writer() as batch:
+                for key in keys:
+                    kwargs = {
+                        "KeyConditionExpression": Key("key").eq(key),
+                        "ScanIndexForward": False,
+                    }
+                    seen = 0
+
+                    while True:
+                        response = await table.query(**kwargs)
+
+                        for item in response["Items"]:
+                            seen += 1
+                            if seen > keep:
+                                await batch.delete_item(Key={"key": item["key"], "version": item["version"]})
+
+                        if "LastEvaluatedKey" not in response:
+                            break
+
+                        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+class CachedConfigSource(ArchiverConfigSource):
+    """Serves config from memory and coalesces writes to another config source.
+
+    Values read are cached for `ttl` seconds. Values written are held in memory and written in one go once
+    `flush_interval` seconds have passed since the last write, so only the latest value of each key is ever persisted.
+    `close` must be called at shutdown to persist any remaining values; anything not yet flushed is lost if the process
+    dies, so callers must be able to repeat work done since the last flush. Keys in `uncached_keys` are always read from
+    the other config source, for values that other processes change and that must be seen as soon as they do.
+    """
+
+    def __init__(self, config_source: ArchiverConfigSource, ttl=30, flush_interval=30, keep_versions=5,
+                 uncached_keys=(), clock=time.monotonic):
+        self.logger = log_utils.get_logger(__name__)
+        self.config_source = config_source
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.keep_versions = keep_versions
+        self.uncached_keys = set(uncached_keys)
+        self.clock = clock
+
+        self.cache = {}
+        self.pending = {}
+        self.written_keys = set()
+        self.last_flushed = clock()
+
+    async def get_config(self, key: str):
+        if key in self.pending:
+            return self.pending[key]
+
+        if key in self.uncached_keys:
+            return await self.config_source.get_config(key)
+
+        entry = self.cache.get(key)
+        if entry is not None and entry[0] > self.clock():
+            return entry[1]
+
+        value = await self.config_source.get_config(key)
+        self.cache[key] = (self.clock() + self.ttl, value)
+
+        return value
+
+    async def put_config(self, **kwargs):
+        self.pending.update(kwargs)
+
+        if self.clock() - self.last_flushed >= self.flush_interval:
+            await self.flush()
+
+    async def flush(self):
+        if len(self.pending) > 0:
+            pending = self.pending
+            self.pending = {}
+
+            await self.config_source.put_config(**pending)
+
+            expires = self.clock() + self.ttl
+            self.cache.update({key: (expires, value) for key, value in pending.items()})
+            self.written_keys.update(pending.keys())
+
+            self.logger.debug(f"Config saved: {pending}")
+
+        self.last_flushed = self.clock()
+
+    async def close(self):
+        await self.flush()
+
+        # Every flush adds a version of each key written, which only needs to be kept for a short history.
+        if len(self.written_keys) > 0:
+            await self.config_source.compact(self.written_keys, self.keep_versions)
+            self.written_keys.clear()
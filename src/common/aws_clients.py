@@ -0,0 +1,128 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import aioboto3
+import aiohttp
+from botocore.exceptions import ConnectionError as BotocoreConnectionError, HTTPClientError
+
+from src.common import log_utils
+
+# Errors after which a client's connections can't be trusted, so the client is created again for the next call.
+CONNECTION_ERRORS = (BotocoreConnectionError, HTTPClientError, aiohttp.ClientConnectionError)
+
+
+class ClientEntry:
+    def __init__(self, loop, context_manager, value):
+        self.loop = loop
+        self.context_manager = context_manager
+        self.value = value
+
+        # Calls still being made with the client, which is only closed once they have all finished.
+        self.in_flight = 0
+        self.is_stale = False
+
+
+class PersistentSession:
+    """Hands out aioboto3 clients and resources that stay open between calls, in place of an `aioboto3.Session`.
+
+    Creating a client resolves credentials and endpoints and opens a new connection pool, which costs more than many of
+    the calls made with it. Clients are created when first used and then reused by every later call made on the same
+    event loop. A client is created again if the event loop it was created on is no longer the running one, or if a
+    call made with it failed to connect; calls still being made with a client that failed carry on with it, and it is
+    closed once the last of them has finished.
+    """
+
+    def __init__(self, session: aioboto3.Session = None, **client_kwargs):
+        self.logger = log_utils.get_logger(__name__)
+        self.session = session or aioboto3.Session()
+        self.client_kwargs = client_kwargs
+
+        self.entries = {}
+        self.locks = {}
+
+    def client(self, service_name: str):
+        return self.get(("client", service_name))
+
+    def resource(self, service_name: str):
+        return self.get(("resource", service_name))
+
+    @asynccontextmanager
+    async def get(self, key):
+        entry = await self.open(key)
+        entry.in_flight += 1
+
+        try:
+            yield entry.value
+        except CONNECTION_ERRORS:
+            if not entry.is_stale:
+                self.logger.warning(f"Connection to {key[1]} failed, it will be reopened for the next call.")
+                self.mark_stale(key, entry)
+
+            raise
+        finally:
+            entry.in_flight -= 1
+
+            if entry.is_stale and entry.in_flight == 0:
+                await self.close_entry(key, entry)
+
+    async def open(self, key):
+        loop = asyncio.get_running_loop()
+
+        entry = self.entries.get(key)
+        if entry is not None and entry.loop is loop:
+            return entry
+
+        lock = self.locks.get(key)
+        if lock is None or lock[0] is not loop:
+            lock = (loop, asyncio.Lock())
+            self.locks[key] = lock
+
+        # Calls made while a client is being created wait for it rather than each creating their own.
+        async with lock[1]:
+            entry = self.entries.get(key)
+            if entry is not None and entry.loop is loop:
+                return entry
+
+            if entry is not None:
+                # Clients can't be closed from a different event loop than the one they were opened on.
+                self.logger.info(f"Reopening {key[1]} {key[0]} for a new event loop.")
+
+            kind, service_name = key
+            context_manager = getattr(self.session, kind)(service_name, **self.client_kwargs)
+            value = await context_manager.__aenter__()
+
+            entry = ClientEntry(loop, context_manager, value)
+            self.entries[key] = entry
+
+            return entry
+
+    def mark_stale(self, key, entry: ClientEntry):
+        # The next call creates a new client, while calls already using this one are left to finish.
+        entry.is_stale = True
+
+        if self.entries.get(key) is entry:
+            del self.entries[key]
+
+    async def close_entry(self, key, entry: ClientEntry):
+        if entry.loop is not asyncio.get_running_loop():
+            return
+
+        try:
+            await entry.context_manager.__aexit__(None, None, None)
+        except Exception as e:
+            self.logger.warning(f"Closing {key[1]} {key[0]} failed: {e}")
+
+    async def discard(self, key):
+        entry = self.entries.get(key)
+
+        if entry is None:
+            return
+
+        self.mark_stale(key, entry)
+
+        if entry.in_flight == 0:
+            await self.close_entry(key, entry)
+
+    async def close(self):
+        for key in list(self.entries.keys()):
+            await self.discard(key)
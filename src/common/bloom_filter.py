@@ -0,0 +1,202 @@
+import hashlib
+import json
+import math
+import struct
+import time
+
+from src.common import log_utils
+from src.common.filesystem import FileSystem
+from src.common.metadata import MetadataService
+
+HEADER_FORMAT = "<4sQdQIQ"
+MAGIC = b"BLM1"
+
+ARCHIVED_SUBMISSIONS_PATH = "_system/archived_submissions.bloom"
+UNARCHIVED_SUBMISSIONS_PATH = "_system/unarchived_submissions.json"
+
+DEFAULT_CAPACITY = 2000000
+DEFAULT_FALSE_POSITIVE_RATE = 0.001
+
+SAVE_EVERY_SECONDS = 60
+
+# How many times a published submission is checked for having been archived before it is given up on. It is then left
+# out of the filter, and published again whenever it is found again.
+MAX_ARCHIVAL_CHECKS = 10
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, false_positive_rate: float, bits: bytearray = None, count=0):
+        self.capacity = capacity
+        self.false_positive_rate = false_positive_rate
+
+        # The optimal size and number of hashes for the expected number of items and the acceptable false positive rate.
+        self.bit_count = max(8, math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.bit_count / capacity * math.log(2)))
+
+        self.bits = bits if bits is not None else bytearray((self.bit_count + 7) // 8)
+        self.count = count
+
+    def get_positions(self, item: str):
+        # Double hashing derives as many positions as are needed from a single digest.
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        first, second = struct.unpack("<QQ", digest)
+
+        return [(first + i * second) % self.bit_count for i in range(self.hash_count)]
+
+    def add(self, item: str):
+        for position in self.get_positions(item):
+            self.bits[position // 8] |= 1 << (position % 8)
+
+        self.count += 1
+
+    def __contains__(self, item: str):
+        return all(self.bits[position // 8] & (1 << (position % 8)) for position in self.get_positions(item))
+
+    def to_bytes(self):
+        header = struct.pack(HEADER_FORMAT, MAGIC, self.capacity, self.false_positive_rate, self.count,
+                             self.hash_count, self.bit_count)
+        return header + bytes(self.bits)
+
+    @staticmethod
+    def from_bytes(data: bytes):
+        header_size = struct.calcsize(HEADER_FORMAT)
+        magic, capacity, false_positive_rate, count, hash_count, bit_count = struct.unpack(HEADER_FORMAT,
+                                                                                          data[:header_size])
+
+        if magic != MAGIC:
+            raise ValueError("The data is not a Bloom filter.")
+
+        bloom_filter = BloomFilter(capacity, false_positive_rate, bytearray(data[header_size:]), count)
+
+        if bloom_filter.hash_count != hash_count or bloom_filter.bit_count != bit_count:
+            raise ValueError("The Bloom filter was created with a different layout.")
+
+        return bloom_filter
+
+
+class ArchivedSubmissionFilter:
+    """A Bloom filter of the ids of submissions that have been archived, persisted in the archive.
+
+    The filter never gives false negatives, so a submission that it doesn't contain has definitely not been archived.
+    It can give false positives at roughly the configured rate, which would cause a new submission to be skipped; the
+    filter can be bypassed, and rebuilt with a lower rate, if that is a problem.
+
+    Published submissions are only added once their metadata shows that they have been archived, so that a submission
+    that failed to archive is published again the next time it is found, rather than being skipped from then on. The
+    submissions still waiting to be archived are saved along with the filter, and checked again on the next run.
+    """
+
+    def __init__(self, filesystem: FileSystem, capacity=DEFAULT_CAPACITY,
+                 false_positive_rate=DEFAULT_FALSE_POSITIVE_RATE):
+        self.logger = log_utils.get_logger(__name__)
+        self.filesystem = filesystem
+        self.capacity = capacity
+        self.false_positive_rate = false_positive_rate
+
+        self.bloom_filter = BloomFilter(capacity, false_positive_rate)
+        self.is_dirty = False
+        self.last_saved = time.monotonic()
+
+        # The number of times each published submission has been checked for having been archived.
+        self.unarchived = {}
+        self.is_unarchived_dirty = False
+
+    async def load_unarchived(self):
+        # Submissions waiting to be archived are kept whether or not the filter is rebuilt, as a rebuilt filter doesn't
+        # have them yet either.
+        data = await self.filesystem.read(UNARCHIVED_SUBMISSIONS_PATH)
+        self.unarchived = json.loads(data) if data is not None else {}
+
+    async def load(self):
+        # Returns whether a filter with the configured settings was loaded; otherwise, the filter needs rebuilding.
+        data = await self.filesystem.read(ARCHIVED_SUBMISSIONS_PATH)
+
+        if data is None:
+            return False
+
+        bloom_filter = BloomFilter.from_bytes(data)
+
+        if (bloom_filter.capacity, bloom_filter.false_positive_rate) != (self.capacity, self.false_positive_rate):
+            self.logger.info("The archived submission filter was built with different settings.")
+            return False
+
+        self.bloom_filter = bloom_filter
+
+        if bloom_filter.count > bloom_filter.capacity:
+            self.logger.warning(f"The archived submission filter holds {bloom_filter.count} ids, more than its "
+                                f"capacity of {bloom_filter.capacity}; its false positive rate is now higher than "
+                                f"configured. Rebuild it with a larger capacity.")
+
+        return True
+
+    async def save(self):
+        if self.is_dirty:
+            await self.filesystem.write(ARCHIVED_SUBMISSIONS_PATH, self.bloom_filter.to_bytes())
+            self.is_dirty = False
+
+        if self.is_unarchived_dirty:
+            await self.filesystem.write(UNARCHIVED_SUBMISSIONS_PATH, json.dumps(self.unarchived))
+            self.is_unarchived_dirty = False
+
+        self.last_saved = time.monotonic()
+
+    async def rebuild(self, metadata_service: MetadataService):
+        self.logger.info("Rebuilding the archived submission filter from the metadata store...")
+
+        self.bloom_filter = BloomFilter(self.capacity, self.false_positive_rate)
+        after_id = None
+
+        while True:
+            items = await metadata_service.list(after_id=after_id)
+
+            if len(items) == 0:
+                break
+
+            for item in items:
+                self.bloom_filter.add(item["submission_id"])
+
+            after_id = items[-1]["submission_id"]
+
+        self.is_dirty = True
+        await self.save()
+
+        self.logger.info(f"Archived submission filter rebuilt with {self.bloom_filter.count} ids.")
+
+    def contains(self, submission_id: str):
+        return submission_id in self.bloom_filter
+
+    def add_published(self, submission_ids):
+        for submission_id in submission_ids:
+            self.unarchived.setdefault(submission_id, 0)
+
+        self.is_unarchived_dirty = True
+
+    async def add_archived(self, metadata_service: MetadataService):
+        # Adds the published submissions that have been archived since, and keeps checking the rest until they are
+        # given up on.
+        if len(self.unarchived) == 0:
+            return
+
+        items = await metadata_service.get_many(list(self.unarchived.keys()), fields=["submission_id"])
+        archived = [item["submission_id"] for item in items]
+
+        for submission_id in archived:
+            self.unarchived.pop(submission_id, None)
+
+        for submission_id in list(self.unarchived.keys()):
+            self.unarchived[submission_id] += 1
+
+            if self.unarchived[submission_id] >= MAX_ARCHIVAL_CHECKS:
+                del self.unarchived[submission_id]
+
+        self.is_unarchived_dirty = True
+        await self.add(archived)
+
+    async def add(self, submission_ids):
+        for submission_id in submission_ids:
+            if submission_id not in self.bloom_filter:
+                self.bloom_filter.add(submission_id)
+                self.is_dirty = True
+
+        if time.monotonic() - self.last_saved >= SAVE_EVERY_SECONDS:
+            await self.save()
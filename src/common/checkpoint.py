@@ -0,0 +1,60 @@
+import time
+
+from src.common import log_utils
+from src.common.archiver_config import ArchiverConfigSource
+
+
+class Checkpointer:
+    """Coalesces progress updates into periodic config writes.
+
+    Progress is only persisted once every `every_items` items or `every_seconds` seconds, whichever comes first, so
+    callers must only report progress for work that has already been made durable. After a crash, work resumes from the
+    last persisted checkpoint and anything processed since then is repeated.
+    """
+
+    def __init__(self, config_source: ArchiverConfigSource, every_items=1000, every_seconds=30, before_flush=None,
+                 is_current=None):
+        self.logger = log_utils.get_logger(__name__)
+        self.config_source = config_source
+        self.every_items = every_items
+        self.every_seconds = every_seconds
+
+        # Called before a checkpoint is persisted, to make durable any state that the checkpoint depends on.
+        self.before_flush = before_flush
+
+        # Called before anything is persisted, to check that the progress being saved hasn't been reset since it was
+        # read. Once it has, nothing more is persisted, and callers should stop.
+        self.is_current = is_current
+        self.is_stale = False
+
+        self.values = {}
+        self.pending_items = 0
+        self.last_flushed = time.monotonic()
+
+    async def update(self, count=1, **values):
+        self.values.update(values)
+        self.pending_items += count
+
+        if self.pending_items >= self.every_items or time.monotonic() - self.last_flushed >= self.every_seconds:
+            await self.flush()
+
+    async def flush(self):
+        if not self.is_stale and self.is_current is not None and not await self.is_current():
+            self.logger.warning(f"Progress was reset since it was read, dropping the checkpoint: {self.values}")
+            self.is_stale = True
+
+        if self.is_stale:
+            self.values = {}
+            self.pending_items = 0
+            return
+
+        if self.before_flush is not None:
+            await self.before_flush()
+
+        if len(self.values) > 0:
+            await self.config_source.put_config(**self.values)
+            self.logger.info(f"Checkpoint saved after {self.pending_items} items: {self.values}")
+
+        self.values = {}
+        self.pending_items = 0
+        self.last_flushed = time.monotonic()
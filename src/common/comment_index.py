@@ -0,0 +1,163 @@
+import asyncio
+import bisect
+import hashlib
+import json
+import struct
+
+from src.common.filesystem import FileSystem
+
+# Comments are also stored as one JSON object per line, along with an index of where each line starts for every order
+# they can be listed in. A page of comments can then be read with a range read of the index and a few range reads of the
+# comments, however large the thread is.
+#
+# The lines and indexes of each version of a thread are written under a prefix named after their content, and a pointer
+# to that prefix is written once all of them have been. Readers follow the pointer, so they never read the index of one
+# version against the lines of another.
+SORTS = ["created_utc", "score"]
+SORT_ORDERS = ["asc", "desc"]
+
+# The offset and length of each line.
+ENTRY_FORMAT = "<QI"
+ENTRY_SIZE = struct.calcsize(ENTRY_FORMAT)
+
+# Lines closer together than this are read in one request, as another request costs more than the unneeded bytes.
+MAX_GAP = 64 * 1024
+
+# Pages that aren't in chronological order are scattered across the thread, where lines within the gap of each other
+# would otherwise add up to reading most of it in one request. Requests are capped at this many bytes instead, and the
+# rest of the page is read with more requests made at the same time.
+MAX_RUN_SIZE = 256 * 1024
+
+
+def get_version_path(submission_id: str):
+    return f"{submission_id}/comments/version"
+
+
+def get_comments_path(submission_id: str, version: str):
+    return f"{submission_id}/comments/{version}/comments.ndjson"
+
+
+def get_index_path(submission_id: str, version: str, sort: str, sort_order: str):
+    return f"{submission_id}/comments/{version}/{sort}-{sort_order}.idx"
+
+
+async def read_version(filesystem: FileSystem, submission_id: str):
+    # Returns the version of the submission's comments that is being served, or None if they have no index.
+    version = await filesystem.read(get_version_path(submission_id))
+
+    if version is None:
+        return None
+
+    return version.decode("utf-8")
+
+
+def get_sort_key(sort: str):
+    if sort == "created_utc":
+        return lambda comment: (comment.get("created_utc") or 0, comment.get("id") or "")
+
+    return lambda comment: (comment.get("score") or 0, comment.get("created_utc") or 0, comment.get("id") or "")
+
+
+def sort_comments(comments, sort: str, sort_order: str):
+    return sorted(comments, key=get_sort_key(sort), reverse=sort_order == "desc")
+
+
+async def write_comment_index(filesystem: FileSystem, submission_id: str, comments):
+    # Lines are written in chronological order, so that chronological pages are contiguous.
+    comments = sort_comments(comments, "created_utc", "asc")
+
+    lines = []
+    entries = {}
+    offset = 0
+    for comment in comments:
+        line = json.dumps(comment, ensure_ascii=True, separators=(",", ":")).encode("utf-8") + b"\n"
+        lines.append(line)
+        entries[id(comment)] = (offset, len(line) - 1)
+        offset += len(line)
+
+    data = b"".join(lines)
+
+    # The indexes are derived from the lines alone, so the lines identify the whole version.
+    version = hashlib.sha256(data).hexdigest()[:16]
+    previous = await read_version(filesystem, submission_id)
+
+    if previous == version:
+        return
+
+    writes = [filesystem.write(get_comments_path(submission_id, version), data)]
+
+    for sort in SORTS:
+        for sort_order in SORT_ORDERS:
+            index = b"".join(
+                struct.pack(ENTRY_FORMAT, *entries[id(comment)])
+                for comment in sort_comments(comments, sort, sort_order)
+            )
+            writes.append(filesystem.write(get_index_path(submission_id, version, sort, sort_order), index))
+
+    await asyncio.gather(*writes)
+
+    # The new version is only served once every file of it has been written.
+    await filesystem.write(get_version_path(submission_id), version)
+
+    if previous is not None:
+        # Readers still on the previous version fail to read it from here on, and fall back to the whole thread.
+        await asyncio.gather(
+            filesystem.delete(get_comments_path(submission_id, previous)),
+            *(filesystem.delete(get_index_path(submission_id, previous, sort, sort_order))
+              for sort in SORTS for sort_order in SORT_ORDERS)
+        )
+
+
+async def read_comment_count(filesystem: FileSystem, submission_id: str):
+    """Returns the number of comments on a submission, or None if the submission's comments have no index."""
+
+    version = await read_version(filesystem, submission_id)
+
+    if version is None:
+        return None
+
+    # Every index has an entry of a fixed size per comment, so the count is known from its size alone.
+    size = await filesystem.get_size(get_index_path(submission_id, version, SORTS[0], SORT_ORDERS[0]))
+
+    return size // ENTRY_SIZE if size is not None else None
+
+
+async def read_comment_page(filesystem: FileSystem, submission_id: str, sort: str, sort_order: str, offset: int,
+                            limit: int):
+    """Returns the encoded comments of a page, in order, or None if the submission's comments have no index."""
+
+    version = await read_version(filesystem, submission_id)
+
+    if version is None:
+        return None
+
+    index = await filesystem.read_range(get_index_path(submission_id, version, sort, sort_order), offset * ENTRY_SIZE,
+                                        (offset + limit) * ENTRY_SIZE)
+
+    if index is None:
+        return None
+
+    entries = [struct.unpack_from(ENTRY_FORMAT, index, i) for i in range(0, len(index), ENTRY_SIZE)]
+
+    # Lines that are close together are read with a single request, and every request is made at once.
+    runs = []
+    for start, length in sorted(entries):
+        if len(runs) > 0 and start - runs[-1][1] <= MAX_GAP and start + length - runs[-1][0] <= MAX_RUN_SIZE:
+            runs[-1][1] = max(runs[-1][1], start + length)
+        else:
+            runs.append([start, start + length])
+
+    path = get_comments_path(submission_id, version)
+    data = await asyncio.gather(*(filesystem.read_range(path, start, end) for start, end in runs))
+
+    if any(run_data is None for run_data in data):
+        return None
+
+    run_starts = [start for start, _ in runs]
+    lines = []
+    for start, length in entries:
+        run = bisect.bisect_right(run_starts, start) - 1
+        position = start - run_starts[run]
+        lines.append(data[run][position:position + length])
+
+    return lines
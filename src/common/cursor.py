@@ -0,0 +1,44 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+from decimal import Decimal
+
+SIGNATURE_LENGTH = 16
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def to_json_value(value):
+    # Numbers read from DynamoDB are Decimals, which json can't serialise directly.
+    if isinstance(value, Decimal):
+        return int(value) if value % 1 == 0 else float(value)
+
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def encode_cursor(value, secret: bytes):
+    # Cursors are signed so that clients can't forge a start key for a different index or partition; they are not
+    # encrypted, and their contents are not meant to be secret.
+    payload = json.dumps(value, separators=(",", ":"), sort_keys=True, default=to_json_value).encode("utf-8")
+    signature = hmac.new(secret, payload, hashlib.sha256).digest()[:SIGNATURE_LENGTH]
+
+    return base64.urlsafe_b64encode(signature + payload).rstrip(b"=").decode("ascii")
+
+
+def decode_cursor(cursor: str, secret: bytes):
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+    except (binascii.Error, ValueError):
+        raise InvalidCursor("The cursor is not valid.")
+
+    signature, payload = data[:SIGNATURE_LENGTH], data[SIGNATURE_LENGTH:]
+    expected_signature = hmac.new(secret, payload, hashlib.sha256).digest()[:SIGNATURE_LENGTH]
+
+    if not hmac.compare_digest(signature, expected_signature):
+        raise InvalidCursor("The cursor is not valid.")
+
+    return json.loads(payload, parse_float=Decimal)
@@ -1,12 +1,24 @@
+import bisect
+import hashlib
 import json
 import os.path
+import uuid
 from abc import ABC, abstractmethod
 
 import aioboto3
+import aiofiles
+from botocore.exceptions import ClientError
 
 from src.common import log_utils
 
 
+def make_etag(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+
+    return f'"{hashlib.sha256(data).hexdigest()[:32]}"'
+
+
 class FileSystem(ABC):
     @abstractmethod
     async def mkdir(self, path):
@@ -20,6 +32,10 @@ class FileSystem(ABC):
     async def write_raw(self, path, data):
         pass
 
+    @abstractmethod
+    async def delete(self, path):
+        pass
+
     # noinspection PyUnreachableCode
     @abstractmethod
     async def list_dirs(self, **kwargs):
@@ -36,6 +52,33 @@ class FileSystem(ABC):
     async def read(self, path):
         pass
 
+    async def read_with_etag(self, path):
+        # Returns the data along with a strong entity tag for it, or (None, None) if there is no such file.
+        data = await self.read(path)
+
+        if data is None:
+            return None, None
+
+        return data, make_etag(data)
+
+    async def get_etag(self, path):
+        _, etag = await self.read_with_etag(path)
+        return etag
+
+    async def get_size(self, path):
+        # Returns the size of the file in bytes, or None if there is no such file.
+        data = await self.read(path)
+        return len(data) if data is not None else None
+
+    async def read_range(self, path, start: int, end: int):
+        # Returns the bytes from start up to, but not including, end, or None if there is no such file.
+        data = await self.read(path)
+
+        if data is None:
+            return None
+
+        return data[start:end]
+
 
 class StubFileSystem(FileSystem):
     def __init__(self):
@@ -50,28 +93,65 @@ class StubFileSystem(FileSystem):
     async def write_raw(self, path, data):
         self.logger.info(f"Stubbed: write_raw {len(data)} bytes to {path}")
 
-    async def list_dirs(self, **kwargs):
+    async def delete(self, path):
+        self.logger.info(f"Stubbed: delete {path}")
+
+    async def list_dirs(self, Prefix="", **kwargs):
         for dir in ["testid", "testic", "testib", "testia", "testi9"]:
-            yield f"{dir}/"
+            if dir.startswith(Prefix):
+                yield f"{dir}/"
 
     async def list_files(self, path, **kwargs):
         for file in ["foo.png", "bar.png"]:
             yield f"{path}/{file}"
 
     async def read(self, path):
+        # Nothing has been derived from the stubbed archive, such as a search index, statistics or comment indexes.
+        if path.startswith("_") or "/comments/" in path:
+            return None
+
+        if path.endswith("comments.json"):
+            return json.dumps([
+                {
+                    "id": f"testcomment{i}",
+                    "author": "VoxUmbra",
+                    "body": path,
+                    "created_utc": 1630450800 + i,
+                    "score": i,
+                }
+                for i in range(3)
+            ])
+
+        if path.endswith("manifest.json"):
+            return json.dumps({
+                "submission_id": path.split("/", 1)[0],
+                "files": [
+                    {
+                        "name": file,
+                        "size": 1024,
+                        "content_type": "image/png",
+                        "sha256": "",
+                        "archived_utc": 1630460000,
+                    }
+                    for file in ["bar.png", "foo.png"]
+                ],
+                "last_updated": 1630460000,
+            })
+
         return json.dumps({
             "link_flair_text": "DD",
             "created_utc": 1630450800,
             "author": "VoxUmbra",
             "title": path,
             "score": 1,
+            "subreddit": "Superstonk",
         })
 
 
 class S3FileSystem(FileSystem):
-    def __init__(self, bucket_name):
+    def __init__(self, bucket_name, session=None):
         self.bucket_name = bucket_name
-        self.session = aioboto3.Session()
+        self.session = session or aioboto3.Session()
 
     async def mkdir(self, path):
         # Not required as folders aren't distinct objects in S3.
@@ -85,11 +165,17 @@ class S3FileSystem(FileSystem):
     async def write_raw(self, path, data):
         await self.write(path, data)
 
+    async def delete(self, path):
+        # Deleting an object that doesn't exist succeeds, so deletes can be repeated.
+        async with self.session.client("s3") as s3:
+            await s3.delete_object(Bucket=self.bucket_name, Key=str(path))
+
     async def list_dirs(self, **kwargs):
         async with self.session.client("s3") as s3:
             paginator = s3.get_paginator("list_objects_v2")
             async for result in paginator.paginate(Bucket=self.bucket_name, Delimiter="/", **kwargs):
-                for prefix in result["CommonPrefixes"]:
+                # Listings of a prefix that nothing has been archived under have no common prefixes at all.
+                for prefix in result.get("CommonPrefixes", []):
                     yield prefix["Prefix"]
 
     async def list_files(self, path, **kwargs):
@@ -99,13 +185,176 @@ class S3FileSystem(FileSystem):
         async with self.session.client("s3") as s3:
             paginator = s3.get_paginator("list_objects_v2")
             async for result in paginator.paginate(Bucket=self.bucket_name, Delimiter="/", Prefix=f"{path}/", **kwargs):
-                for contents in result["Contents"]:
+                # Listings of a prefix with nothing under it have no contents at all.
+                for contents in result.get("Contents", []):
                     if contents["Key"].endswith(".json") is False:
                         yield contents["Key"]
 
     async def read(self, path):
         async with self.session.client("s3") as s3:
-            response = await s3.get_object(Bucket=self.bucket_name, Key=path)
+            try:
+                response = await s3.get_object(Bucket=self.bucket_name, Key=path)
+            except s3.exceptions.NoSuchKey:
+                return None
+
             body = response["Body"]
 
             return await body.read()
+
+    async def read_with_etag(self, path):
+        async with self.session.client("s3") as s3:
+            try:
+                response = await s3.get_object(Bucket=self.bucket_name, Key=path)
+            except s3.exceptions.NoSuchKey:
+                return None, None
+
+            return await response["Body"].read(), response["ETag"]
+
+    async def read_range(self, path, start: int, end: int):
+        if end <= start:
+            return b""
+
+        async with self.session.client("s3") as s3:
+            try:
+                response = await s3.get_object(Bucket=self.bucket_name, Key=path, Range=f"bytes={start}-{end - 1}")
+            except s3.exceptions.NoSuchKey:
+                return None
+            except ClientError as e:
+                # Ranges that start past the end of the object are rejected rather than being empty.
+                if e.response["Error"]["Code"] == "InvalidRange":
+                    return b""
+                raise
+
+            return await response["Body"].read()
+
+    async def get_etag(self, path):
+        # S3 already keeps an entity tag for every object, so it can be checked without reading the object.
+        async with self.session.client("s3") as s3:
+            try:
+                response = await s3.head_object(Bucket=self.bucket_name, Key=path)
+            except ClientError as e:
+                if e.response["Error"]["Code"] in ["404", "NoSuchKey"]:
+                    return None
+                raise
+
+            return response["ETag"]
+
+    async def get_size(self, path):
+        async with self.session.client("s3") as s3:
+            try:
+                response = await s3.head_object(Bucket=self.bucket_name, Key=path)
+            except ClientError as e:
+                if e.response["Error"]["Code"] in ["404", "NoSuchKey"]:
+                    return None
+                raise
+
+            return response["ContentLength"]
+
+
+class LocalFileSystem(FileSystem):
+    """Stores the archive in a local directory, laid out in the same way as the S3 bucket."""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.listing = None
+
+    def resolve(self, path):
+        full_path = os.path.normpath(os.path.join(self.root, str(path)))
+
+        if os.path.commonpath([self.root, full_path]) != self.root:
+            raise ValueError(f"Path '{path}' is outside of the archive root.")
+
+        return full_path
+
+    async def mkdir(self, path):
+        os.makedirs(self.resolve(path), exist_ok=True)
+
+    async def write(self, path, data):
+        full_path = self.resolve(path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+
+        # Writes replace the file in one step, as puts to S3 do, so that concurrent readers never see part of a file.
+        temp_path = f"{full_path}.{uuid.uuid4().hex}.tmp"
+
+        async with aiofiles.open(temp_path, "wb" if isinstance(data, bytes) else "w") as file:
+            await file.write(data)
+
+        os.replace(temp_path, full_path)
+
+    async def write_raw(self, path, data):
+        await self.write(path, data)
+
+    async def delete(self, path):
+        try:
+            os.remove(self.resolve(path))
+        except FileNotFoundError:
+            pass
+
+    def list_root(self):
+        # Listing one prefix at a time would otherwise read and sort the whole root for every prefix. Adding or removing
+        # an entry updates the modification time of the root, which invalidates the cached listing.
+        modified = os.stat(self.root).st_mtime_ns
+
+        if self.listing is None or self.listing[0] != modified:
+            self.listing = modified, sorted(os.listdir(self.root))
+
+        return self.listing[1]
+
+    async def list_dirs(self, StartAfter="", Prefix="", **kwargs):
+        names = self.list_root()
+
+        # Names sharing a prefix are contiguous once sorted, so listing a prefix doesn't need to visit every name.
+        for name in names[bisect.bisect_left(names, Prefix):]:
+            if not name.startswith(Prefix):
+                break
+
+            # Mirror S3, where StartAfter is compared against the common prefix including its delimiter.
+            prefix = f"{name}/"
+
+            if prefix > StartAfter and os.path.isdir(os.path.join(self.root, name)):
+                yield prefix
+
+    async def list_files(self, path, **kwargs):
+        if path.endswith("/"):
+            path = path[:-1]
+
+        full_path = self.resolve(path)
+        if not os.path.isdir(full_path):
+            return
+
+        for name in sorted(os.listdir(full_path)):
+            # Files still being written are left out, as they don't exist yet as far as S3 would be concerned.
+            if name.endswith((".json", ".tmp")) is False and os.path.isfile(os.path.join(full_path, name)):
+                yield f"{path}/{name}"
+
+    async def read(self, path):
+        full_path = self.resolve(path)
+
+        if not os.path.isfile(full_path):
+            return None
+
+        # Files can be deleted by another writer between checking for them and opening them.
+        try:
+            async with aiofiles.open(full_path, "rb") as file:
+                return await file.read()
+        except FileNotFoundError:
+            return None
+
+    async def get_size(self, path):
+        try:
+            return os.path.getsize(self.resolve(path))
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+    async def read_range(self, path, start: int, end: int):
+        full_path = self.resolve(path)
+
+        if not os.path.isfile(full_path):
+            return None
+
+        try:
+            async with aiofiles.open(full_path, "rb") as file:
+                await file.seek(start)
+                return await file.read(max(0, end - start))
+        except FileNotFoundError:
+            return None
@@ -0,0 +1,56 @@
+import hashlib
+import json
+import mimetypes
+from datetime import datetime
+
+from src.common.filesystem import FileSystem
+
+MANIFEST_NAME = "manifest.json"
+
+
+def get_manifest_path(submission_id: str):
+    return f"{submission_id}/{MANIFEST_NAME}"
+
+
+def describe_file(name: str, data: bytes, archived_utc: int = None):
+    content_type, _ = mimetypes.guess_type(name)
+
+    if archived_utc is None:
+        archived_utc = int(datetime.utcnow().timestamp())
+
+    return {
+        "name": name,
+        "size": len(data),
+        "content_type": content_type or "application/octet-stream",
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "archived_utc": archived_utc,
+    }
+
+
+async def read_manifest(filesystem: FileSystem, submission_id: str):
+    data = await filesystem.read(get_manifest_path(submission_id))
+
+    if data is None:
+        return None
+
+    return json.loads(data)
+
+
+async def update_manifest(filesystem: FileSystem, submission_id: str, entries):
+    manifest = await read_manifest(filesystem, submission_id) or {
+        "submission_id": submission_id,
+        "files": [],
+    }
+
+    # Entries are keyed by name so that re-archiving a submission replaces the existing entries rather than
+    # duplicating them.
+    files = {file["name"]: file for file in manifest["files"]}
+    for entry in entries:
+        files[entry["name"]] = entry
+
+    manifest["files"] = sorted(files.values(), key=lambda file: file["name"])
+    manifest["last_updated"] = int(datetime.utcnow().timestamp())
+
+    await filesystem.write(get_manifest_path(submission_id), json.dumps(manifest, ensure_ascii=True, indent=4))
+
+    return manifest
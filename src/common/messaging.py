@@ -1,15 +1,44 @@
+import asyncio
 from abc import ABC, abstractmethod
 
 import aioboto3
 
 from src.common import log_utils
 
+# SNS accepts at most 10 messages per PublishBatch call.
+PUBLISH_BATCH_SIZE = 10
+
+MAX_CONCURRENT_PUBLISHES = 10
+MAX_PUBLISH_ATTEMPTS = 5
+
+
+class PublishFailed(Exception):
+    pass
+
+
+async def publish_in_batches(messages, publish_batch):
+    # Batches are published concurrently, as each call costs a full round trip however small it is.
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_PUBLISHES)
+
+    async def publish(batch):
+        async with semaphore:
+            await publish_batch(batch)
+
+    messages = list(messages)
+    await asyncio.gather(*(
+        publish(messages[i:i + PUBLISH_BATCH_SIZE]) for i in range(0, len(messages), PUBLISH_BATCH_SIZE)
+    ))
+
 
 class MessagingService(ABC):
     @abstractmethod
     async def send_message(self, message: str):
         pass
 
+    @abstractmethod
+    async def send_messages(self, messages):
+        pass
+
 
 class StubMessagingService(MessagingService):
     def __init__(self):
@@ -18,9 +47,37 @@ class StubMessagingService(MessagingService):
     async def send_message(self, message: str):
         self.logger.info(f"Stubbed: send_message {message}")
 
+    async def send_messages(self, messages):
+        self.logger.info(f"Stubbed: send_messages {len(messages)} messages")
+
+
+class RecordingMessagingService(MessagingService):
+    """Records messages rather than sending them, with each publish call taking `latency` seconds like a round trip to
+    SNS would. Useful for measuring how publishing affects throughput without needing AWS.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = []
+
+    @property
+    def messages(self):
+        return [message for call in self.calls for message in call]
+
+    async def send_message(self, message: str):
+        await self.publish_batch([message])
+
+    async def send_messages(self, messages):
+        await publish_in_batches(messages, self.publish_batch)
+
+    async def publish_batch(self, messages):
+        await asyncio.sleep(self.latency)
+        self.calls.append(list(messages))
+
 
 class SNSMessagingService(MessagingService):
     def __init__(self, session: aioboto3.Session, topic_arn: str):
+        self.logger = log_utils.get_logger(__name__)
         self.session = session
         self.topic_arn = topic_arn
 
@@ -30,3 +87,35 @@ class SNSMessagingService(MessagingService):
                 TopicArn=self.topic_arn,
                 Message=message
             )
+
+    async def send_messages(self, messages):
+        async with self.session.client("sns") as sns:
+            await publish_in_batches(messages, lambda batch: self.publish_batch(sns, batch))
+
+    async def publish_batch(self, sns, messages):
+        entries = {str(i): message for i, message in enumerate(messages)}
+
+        for attempt in range(MAX_PUBLISH_ATTEMPTS):
+            if attempt > 0:
+                await asyncio.sleep(0.1 * 2 ** attempt)
+
+            response = await sns.publish_batch(
+                TopicArn=self.topic_arn,
+                PublishBatchRequestEntries=[{"Id": id, "Message": message} for id, message in entries.items()]
+            )
+
+            failed = response.get("Failed", [])
+
+            # Entries rejected because of the request itself will never succeed, so there is no point retrying them.
+            sender_faults = [failure for failure in failed if failure["SenderFault"]]
+            if len(sender_faults) > 0:
+                raise PublishFailed(f"Messages were rejected: {sender_faults}")
+
+            # Only the entries that failed are sent again, so that the others aren't published twice.
+            entries = {failure["Id"]: entries[failure["Id"]] for failure in failed}
+            if len(entries) == 0:
+                return
+
+            self.logger.warning(f"Publishing {len(entries)} messages failed, retrying.")
+
+        raise PublishFailed(f"{len(entries)} messages could not be published after {MAX_PUBLISH_ATTEMPTS} attempts.")
@@ -1,10 +1,158 @@
+import asyncio
+import collections
+import hashlib
+import json
+import math
+import os
+import sqlite3
 from abc import ABC, abstractmethod
+from datetime import datetime
+from decimal import Decimal
 from typing import Union
 
 import aioboto3
-from boto3.dynamodb.conditions import ConditionBase, AttributeBase
+from boto3.dynamodb.conditions import ConditionBase, AttributeBase, ConditionExpressionBuilder, Key
 
 from src.common import log_utils
+from src.common.cursor import encode_cursor, decode_cursor, InvalidCursor
+from src.common.partitioning import get_partition
+
+DUMMY_SHARD_COUNT = 8
+
+# BatchGetItem reads at most 100 items per request.
+BATCH_GET_SIZE = 100
+
+# Every item used to share the single "dummy" partition in the indexes used for unfiltered listings, which made it a hot
+# partition for both writes and reads. Items are now spread across several shards and listings are merged from all of
+# them. The original partition is kept as a shard of its own, so that items written before sharding are still listed
+# until the metadata is rebuilt.
+DUMMY_SHARDS = ["dummy"] + [f"dummy#{shard}" for shard in range(DUMMY_SHARD_COUNT)]
+
+
+def get_dummy_shard(submission_id: str):
+    return f"dummy#{get_partition(submission_id, DUMMY_SHARD_COUNT)}"
+
+
+# The attributes of an item that are meaningful outside of the metadata store. The rest only exist to be indexed.
+PUBLIC_FIELDS = ["submission_id", "created_utc", "author", "title", "score", "post_type", "subreddit", "last_updated"]
+
+
+def derive_post_type(flair_text: str):
+    flair_keywords = {
+        "dd": "dd",
+        "discussion": "discussion",
+        "opinion": "discussion",
+        "shitpost": "shitpost",
+        "meme": "shitpost",
+        "social media": "social_media",
+        "data": "data",
+        "hodl": "fluff",
+        "fluff": "fluff",
+        "news": "news",
+        "daily": "daily",
+    }
+
+    if flair_text is None:
+        return "unknown"
+
+    flair_text = flair_text.lower()
+
+    for keyword, post_type in flair_keywords.items():
+        if keyword in flair_text:
+            return post_type
+
+    return "unknown"
+
+
+def create_metadata(submission_id: str, data: dict):
+    link_flair_text = data.get("link_flair_text")
+    post_type = derive_post_type(link_flair_text)
+
+    return {
+        "submission_id": submission_id,
+        "created_utc": data["created_utc"],
+        "author": data["author"],
+        "title": data["title"],
+        "score": data["score"],
+        "post_type": post_type,
+        # Allows listing an author's submissions of a given type from an index, rather than filtering all of them.
+        "author_post_type": f"{data['author']}#{post_type}",
+        "subreddit": data["subreddit"],
+        "last_updated": int(datetime.utcnow().timestamp()),
+
+        # All metadata items need to have a column that can be used as a partition key in a secondary index, to enable
+        # queries that order by score or creation time in reverse order without resorting to an expensive table scan.
+        # The value is one of a few shards rather than a constant, so that writes aren't all sent to one partition.
+        "dummy": get_dummy_shard(submission_id),
+    }
+
+
+def project(item: dict, fields):
+    if fields is None:
+        return item
+
+    return {field: item[field] for field in fields if field in item}
+
+
+def with_partition_key(key_condition: ConditionBase, key_name: str, value):
+    expression = key_condition.get_expression()
+    operator = expression["operator"]
+    values = expression["values"]
+
+    if operator == "AND":
+        return with_partition_key(values[0], key_name, value) & with_partition_key(values[1], key_name, value)
+
+    if operator == "=" and isinstance(values[0], AttributeBase) and values[0].name == key_name:
+        return Key(key_name).eq(value)
+
+    return key_condition
+
+
+def validate_query(key_condition, filter_condition, sort, sort_order):
+    if not isinstance(key_condition, ConditionBase):
+        raise Exception("The key condition must be a boto3 condition object.")
+
+    if filter_condition is not None and not isinstance(filter_condition, ConditionBase):
+        raise Exception("The filter condition must be None or a boto3 condition object.")
+
+    if sort not in [None, "created_utc", "score"]:
+        raise Exception("The sort attribute must be None, 'created_utc', or 'score'.")
+
+    if sort_order not in ["asc", "desc"]:
+        raise Exception("The sort order must be either 'asc' or 'desc'.")
+
+
+def describe_query(index_name: str, key_condition: ConditionBase, filter_condition, sort_order: str):
+    # A start key only makes sense for the query it was read with: replayed against another partition, key range, order
+    # or filter it would skip or repeat items, so cursors are bound to a digest of the whole query.
+    builder = ConditionExpressionBuilder()
+    query = [index_name, sort_order]
+
+    for condition, is_key_condition in [(key_condition, True), (filter_condition, False)]:
+        if condition is not None:
+            expression = builder.build_expression(condition, is_key_condition=is_key_condition)
+            query.append([expression.condition_expression, expression.attribute_name_placeholders,
+                          expression.attribute_value_placeholders])
+
+    digest = hashlib.sha256(json.dumps(query, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+    return {"index": index_name, "query": digest}
+
+
+def make_cursor(start_key, query: dict, secret: bytes):
+    if start_key is None:
+        return None
+
+    return encode_cursor({**query, "key": start_key}, secret)
+
+
+def read_cursor(cursor: str, query: dict, secret: bytes):
+    value = decode_cursor(cursor, secret)
+
+    if any(value.get(name) != query_value for name, query_value in query.items()):
+        raise InvalidCursor("The cursor was not issued for this query.")
+
+    return value["key"]
 
 
 class MetadataService(ABC):
@@ -21,7 +169,27 @@ class MetadataService(ABC):
         pass
 
     @abstractmethod
-    async def query(self, key_condition, filter_condition=None, after_id=None, limit=100, sort=None, sort_order="asc"):
+    async def put_many(self, items):
+        pass
+
+    # Returns the items of those submissions that have metadata, in no particular order. If fields is given, items only
+    # have those attributes. Stores that can read many items in one request override this, which reads them one by one.
+    async def get_many(self, submission_ids, fields=None):
+        items = []
+
+        for submission_id in dict.fromkeys(submission_ids):
+            item = await self.get(submission_id)
+
+            if item is not None:
+                items.append(project(item, fields))
+
+        return items
+
+    # Returns a page of items along with an opaque cursor for the next page, or None if there are no more items. If
+    # fields is given, items only have those attributes.
+    @abstractmethod
+    async def query(self, key_condition, filter_condition=None, after_id=None, limit=100, sort=None, sort_order="asc",
+                    cursor=None, fields=None):
         pass
 
 
@@ -33,12 +201,21 @@ class DynamoDBMetadataService(MetadataService):
         ("post_type", "created_utc"): "ArchiveMetadataByPostTypeChronological",
         ("post_type", "score"): "ArchiveMetadataByPostTypeScore",
         ("dummy", "score"): "ArchiveMetadataByDummyScore",
+        ("author_post_type", "created_utc"): "ArchiveMetadataByAuthorPostTypeChronological",
+        ("author_post_type", "score"): "ArchiveMetadataByAuthorPostTypeScore",
     }
 
-    def __init__(self, session: aioboto3.Session, table_name: str):
+    def __init__(self, session: aioboto3.Session, table_name: str, cursor_secret: bytes = None, read_budget=1000):
         self.session = session
         self.table_name = table_name
 
+        # The maximum number of items a single filtered query may evaluate while trying to fill a page.
+        self.read_budget = read_budget
+
+        # Cursors can only be read by instances sharing the same secret, so one must be provided wherever cursors are
+        # handed out by more than one instance.
+        self.cursor_secret = cursor_secret or os.urandom(32)
+
     async def list(self, after_id=None, limit=100):
         limit = min(limit, 100)
 
@@ -66,6 +243,39 @@ class DynamoDBMetadataService(MetadataService):
 
             return response.get("Item")
 
+    async def get_many(self, submission_ids, fields=None):
+        submission_ids = list(dict.fromkeys(submission_ids))
+        items = []
+
+        async with self.session.resource("dynamodb") as dynamodb:
+            for start in range(0, len(submission_ids), BATCH_GET_SIZE):
+                chunk = submission_ids[start:start + BATCH_GET_SIZE]
+                request = {"Keys": [{"submission_id": submission_id} for submission_id in chunk]}
+
+                if fields is not None:
+                    attributes = sorted({*fields, "submission_id"})
+                    request["ProjectionExpression"] = ", ".join(f"#p{i}" for i in range(len(attributes)))
+                    request["ExpressionAttributeNames"] = {
+                        f"#p{i}": attribute for i, attribute in enumerate(attributes)
+                    }
+
+                request_items = {self.table_name: request}
+                attempt = 0
+
+                # Keys that couldn't be read within the table's throughput are returned to be requested again, after
+                # backing off.
+                while len(request_items) > 0:
+                    if attempt > 0:
+                        await asyncio.sleep(min(0.05 * 2 ** attempt, 2))
+
+                    response = await dynamodb.batch_get_item(RequestItems=request_items)
+                    items.extend(project(item, fields) for item in response["Responses"].get(self.table_name, []))
+
+                    request_items = response.get("UnprocessedKeys") or {}
+                    attempt += 1
+
+        return items
+
     async def put(self, submission_id: str, metadata: dict):
         async with self.session.resource("dynamodb") as dynamodb:
             table = await dynamodb.Table(self.table_name)
@@ -77,23 +287,25 @@ class DynamoDBMetadataService(MetadataService):
                 }
             )
 
-    async def query(self, key_condition, filter_condition=None, after_id=None, limit=100, sort=None, sort_order="asc"):
-        if not isinstance(key_condition, ConditionBase):
-            raise Exception("The key condition must be a boto3 condition object.")
-
-        if filter_condition is not None and not isinstance(filter_condition, ConditionBase):
-            raise Exception("The filter condition must be None or a boto3 condition object.")
+    async def put_many(self, items):
+        async with self.session.resource("dynamodb") as dynamodb:
+            table = await dynamodb.Table(self.table_name)
 
-        if sort not in [None, "created_utc", "score"]:
-            raise Exception("The sort attribute must be None, 'created_utc', or 'score'.")
+            # The batch writer groups puts into BatchWriteItem requests of up to 25 items and resubmits any unprocessed
+            # items, so the caller only pays one round trip per 25 items rather than one per item.
+            async with table.batch_writer(overwrite_by_pkeys=["submission_id"]) as batch:
+                for item in items:
+                    await batch.put_item(Item=item)
 
-        if sort_order not in ["asc", "desc"]:
-            raise Exception("The sort order must be either 'asc' or 'desc'.")
+    async def query(self, key_condition, filter_condition=None, after_id=None, limit=100, sort=None, sort_order="asc",
+                    cursor=None, fields=None):
+        validate_query(key_condition, filter_condition, sort, sort_order)
 
         limit = min(limit, 100)
 
         key_name = DynamoDBMetadataService.get_key_name(key_condition)
         index_name = DynamoDBMetadataService.index_for_key_and_sort[(key_name, sort)]
+        query = describe_query(index_name, key_condition, filter_condition, sort_order)
 
         async with self.session.resource("dynamodb") as dynamodb:
             table = await dynamodb.Table(self.table_name)
@@ -102,26 +314,177 @@ class DynamoDBMetadataService(MetadataService):
                 "IndexName": index_name,
                 "KeyConditionExpression": key_condition,
                 "ScanIndexForward": sort_order == "asc",
-                "Limit": limit,
             }
 
             if filter_condition is not None:
                 kwargs["FilterExpression"] = filter_condition
 
-            if after_id is not None:
-                start_key = {
-                    "submission_id": after_id,
-                }
+            if fields is not None:
+                # The attributes used to page and merge results are always read, and only trimmed once that's done.
+                attributes = sorted({*fields, "submission_id", key_name, *([sort] if sort is not None else [])})
+                kwargs["ProjectionExpression"] = ", ".join(f"#p{i}" for i in range(len(attributes)))
+                kwargs["ExpressionAttributeNames"] = {f"#p{i}": attribute for i, attribute in enumerate(attributes)}
+
+            if key_name == "dummy":
+                items, next_cursor = await self.query_shards(table, kwargs, query, after_id, limit, key_name, sort,
+                                                             cursor)
+                return [project(item, fields) for item in items], next_cursor
+
+            if cursor is not None:
+                start_key = read_cursor(cursor, query, self.cursor_secret)
+            elif after_id is not None:
+                # Paging from an item id is kept for compatibility, but costs an extra read to look up the index keys.
                 item = (await table.get_item(Key={"submission_id": after_id})).get("Item")
-                start_key[key_name] = item.get(key_name)
-                if sort is not None:
-                    start_key[sort] = item.get(sort)
+                start_key = DynamoDBMetadataService.get_index_key(item, key_name, sort)
+            else:
+                start_key = None
+
+            items, start_key = await self.query_index(table, kwargs, start_key, limit, key_name, sort)
+
+            return [project(item, fields) for item in items], make_cursor(start_key, query, self.cursor_secret)
+
+    async def query_index(self, table, kwargs: dict, start_key, limit: int, key_name: str, sort: str, read_budget=None):
+        read_budget = read_budget or self.read_budget
+
+        kwargs = dict(kwargs)
+        if start_key is not None:
+            kwargs["ExclusiveStartKey"] = start_key
 
-                kwargs["ExclusiveStartKey"] = start_key
+        items = []
+        scanned_count = 0
+
+        # DynamoDB applies the limit before filtering, so a filtered query can return a short or even empty page while
+        # matching items remain. Keep reading until the page is full or the read budget is spent, and hand back the key
+        # to resume from wherever reading stopped.
+        while True:
+            if "FilterExpression" not in kwargs:
+                kwargs["Limit"] = limit - len(items)
+            else:
+                kwargs["Limit"] = read_budget - scanned_count
 
             response = await table.query(**kwargs)
+            scanned_count += response["ScannedCount"]
+            start_key = response.get("LastEvaluatedKey")
+
+            remaining = limit - len(items)
+            if len(response["Items"]) > remaining:
+                # The page filled part way through the response, so resume from the last item returned.
+                items.extend(response["Items"][:remaining])
+                start_key = DynamoDBMetadataService.get_index_key(items[-1], key_name, sort)
+                break
+
+            items.extend(response["Items"])
+
+            if start_key is None or len(items) == limit or scanned_count >= read_budget:
+                break
+
+            kwargs["ExclusiveStartKey"] = start_key
+
+        return items, start_key
+
+    async def query_shards(self, table, kwargs: dict, query: dict, after_id, limit: int, key_name: str, sort: str,
+                           cursor=None):
+        descending = not kwargs["ScanIndexForward"]
+
+        # Maps each shard that may still have items to the key to resume reading it from; exhausted shards are dropped.
+        if cursor is not None:
+            shards = read_cursor(cursor, query, self.cursor_secret)["shards"]
+        elif after_id is not None:
+            # Start keys don't have to belong to an existing item, so every shard can resume from the item's position.
+            item = (await table.get_item(Key={"submission_id": after_id})).get("Item")
+            index_key = DynamoDBMetadataService.get_index_key(item, key_name, sort)
+            shards = {shard: {**index_key, key_name: shard} for shard in DUMMY_SHARDS}
+        else:
+            shards = {shard: None for shard in DUMMY_SHARDS}
+
+        # Items are spread evenly across shards, so each shard is first read for its share of the page, and then only
+        # read again if it runs out before the page is full. The read budget is shared out between the shards in the
+        # same way.
+        read_size = math.ceil(limit / len(shards)) + 1
+        read_budget = math.ceil(self.read_budget / len(shards))
+
+        buffers = {shard: collections.deque() for shard in shards}
+        next_keys = dict(shards)
+        resume_keys = dict(shards)
+        out_of_budget = set()
+
+        async def read_shards(shards_to_read):
+            results = await asyncio.gather(*(
+                self.query_index(
+                    table,
+                    {
+                        **kwargs,
+                        "KeyConditionExpression": with_partition_key(kwargs["KeyConditionExpression"], key_name, shard),
+                    },
+                    next_keys[shard],
+                    read_size,
+                    key_name,
+                    sort,
+                    read_budget
+                )
+                for shard in shards_to_read
+            ))
+
+            for shard, (items, start_key) in zip(shards_to_read, results):
+                buffers[shard].extend(items)
+                next_keys[shard] = start_key
+
+                if len(items) < read_size and start_key is not None:
+                    out_of_budget.add(shard)
+
+        def get_position(shard):
+            item = buffers[shard][0]
+            return item[sort], item["submission_id"]
+
+        await read_shards(list(shards.keys()))
+
+        page = []
+        while len(page) < limit:
+            drained = [shard for shard, buffer in buffers.items() if len(buffer) == 0 and next_keys[shard] is not None]
+
+            # A shard that spent its read budget may still hold items that sort before those left in other shards, so
+            # nothing past the point it reached can be returned yet.
+            if any(shard in out_of_budget for shard in drained):
+                break
+
+            if len(drained) > 0:
+                await read_shards(drained)
+                continue
+
+            candidates = [shard for shard, buffer in buffers.items() if len(buffer) > 0]
+            if len(candidates) == 0:
+                break
+
+            shard = (max if descending else min)(candidates, key=get_position)
+            item = buffers[shard].popleft()
+
+            page.append(item)
+            resume_keys[shard] = DynamoDBMetadataService.get_index_key(item, key_name, sort)
+
+        next_shards = {}
+        for shard, buffer in buffers.items():
+            if len(buffer) > 0:
+                # Items were read past the end of the page, so the shard resumes from the last item taken from it.
+                next_shards[shard] = resume_keys[shard]
+            elif next_keys[shard] is not None:
+                next_shards[shard] = next_keys[shard]
+
+        if len(next_shards) == 0:
+            return page, None
+
+        return page, make_cursor({"shards": next_shards}, query, self.cursor_secret)
 
-            return response["Items"]
+    @staticmethod
+    def get_index_key(item: dict, key_name: str, sort: str):
+        index_key = {
+            "submission_id": item["submission_id"],
+            key_name: item[key_name],
+        }
+
+        if sort is not None:
+            index_key[sort] = item[sort]
+
+        return index_key
 
     @staticmethod
     def get_key_name(key_condition: Union[ConditionBase, AttributeBase]):
@@ -157,5 +520,231 @@ class StubMetadataService(MetadataService):
     async def put(self, submission_id: str, metadata):
         self.logger.info(f"Stubbed: put {submission_id} {metadata}")
 
-    async def query(self, key_condition, filter_condition=None, after_id=None, limit=100, sort=None, sort_order="asc"):
-        return await self.list()
+    async def put_many(self, items):
+        self.logger.info(f"Stubbed: put_many {len(items)} items")
+
+    async def query(self, key_condition, filter_condition=None, after_id=None, limit=100, sort=None, sort_order="asc",
+                    cursor=None, fields=None):
+        return [project(item, fields) for item in await self.list()], None
+
+
+class SQLiteMetadataService(MetadataService):
+    """Embedded metadata store answering the same queries as the DynamoDB table and its secondary indexes.
+
+    Useful as a local or edge query engine, and as a baseline for query benchmarks without needing AWS.
+
+    Filters are applied before the limit, so a page is only short when no more items match. DynamoDB evaluates at most
+    its read budget of items per filtered query, and so may return a short or empty page while matching items remain;
+    callers must keep paging until no cursor is returned, whichever store they use.
+    """
+
+    # Attributes used by the secondary indexes are stored in their own columns so that they can be indexed, the full
+    # item is kept as JSON.
+    columns = ["submission_id", "author", "post_type", "author_post_type", "dummy", "created_utc", "score"]
+
+    operators = {
+        "=": "=",
+        "<>": "<>",
+        "<": "<",
+        "<=": "<=",
+        ">": ">",
+        ">=": ">=",
+    }
+
+    def __init__(self, path=":memory:", cursor_secret: bytes = None):
+        self.connection = sqlite3.connect(path)
+        self.cursor_secret = cursor_secret or os.urandom(32)
+
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS metadata ("
+            "submission_id TEXT PRIMARY KEY, "
+            "author TEXT, "
+            "post_type TEXT, "
+            "author_post_type TEXT, "
+            "dummy TEXT, "
+            "created_utc NUMERIC, "
+            "score NUMERIC, "
+            "data TEXT NOT NULL)"
+        )
+
+        for (key_name, sort), index_name in DynamoDBMetadataService.index_for_key_and_sort.items():
+            self.connection.execute(
+                f"CREATE INDEX IF NOT EXISTS {index_name} ON metadata ({key_name}, {sort}, submission_id)"
+            )
+
+        self.connection.commit()
+
+    async def list(self, after_id=None, limit=100):
+        limit = min(limit, 100)
+
+        rows = self.connection.execute(
+            "SELECT data FROM metadata WHERE submission_id > ? ORDER BY submission_id LIMIT ?",
+            (after_id or "", limit)
+        )
+
+        return [json.loads(data) for data, in rows]
+
+    async def get(self, submission_id: str):
+        row = self.connection.execute("SELECT data FROM metadata WHERE submission_id = ?", (submission_id,)).fetchone()
+
+        return json.loads(row[0]) if row is not None else None
+
+    async def get_many(self, submission_ids, fields=None):
+        submission_ids = list(dict.fromkeys(submission_ids))
+        items = []
+
+        # SQLite limits how many parameters a statement can have.
+        for i in range(0, len(submission_ids), 500):
+            chunk = submission_ids[i:i + 500]
+            rows = self.connection.execute(
+                f"SELECT data FROM metadata WHERE submission_id IN ({', '.join('?' for _ in chunk)})", chunk
+            )
+            items.extend(project(json.loads(data), fields) for data, in rows)
+
+        return items
+
+    async def put(self, submission_id: str, metadata):
+        await self.put_many([{"submission_id": submission_id, **metadata}])
+
+    async def put_many(self, items):
+        # All rows are inserted in a single transaction, which is what makes bulk loading the whole archive fast.
+        with self.connection:
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO metadata ({', '.join(self.columns)}, data) "
+                f"VALUES ({', '.join('?' for _ in self.columns)}, ?)",
+                [
+                    (*(self.to_sql_value(self.get_column_value(item, column)) for column in self.columns),
+                     json.dumps(item, default=SQLiteMetadataService.to_sql_value))
+                    for item in items
+                ]
+            )
+
+    @staticmethod
+    def get_column_value(item: dict, column: str):
+        # A single table has no hot partitions to spread writes across, so the shards of the constant partition key are
+        # all stored as the one value that queries use.
+        if column == "dummy" and item.get(column) is not None:
+            return item[column].split("#")[0]
+
+        return item.get(column)
+
+    async def query(self, key_condition, filter_condition=None, after_id=None, limit=100, sort=None, sort_order="asc",
+                    cursor=None, fields=None):
+        validate_query(key_condition, filter_condition, sort, sort_order)
+
+        limit = min(limit, 100)
+
+        key_name = DynamoDBMetadataService.get_key_name(key_condition)
+        index_name = DynamoDBMetadataService.index_for_key_and_sort[(key_name, sort)]
+        query = describe_query(index_name, key_condition, filter_condition, sort_order)
+
+        params = []
+        clauses = [self.to_sql(key_condition, params)]
+
+        if filter_condition is not None:
+            clauses.append(self.to_sql(filter_condition, params))
+
+        # Items with equal sort keys are ordered by their id, so that paging from an item is always well defined.
+        order_columns = [sort, "submission_id"] if sort is not None else ["submission_id"]
+        direction = "ASC" if sort_order == "asc" else "DESC"
+
+        if cursor is not None:
+            start_key = read_cursor(cursor, query, self.cursor_secret)
+        elif after_id is not None:
+            start_key = self.connection.execute(
+                f"SELECT {', '.join(order_columns)} FROM metadata WHERE submission_id = ?",
+                (after_id,)
+            ).fetchone()
+        else:
+            start_key = None
+
+        if start_key is not None:
+            comparison = ">" if sort_order == "asc" else "<"
+            clauses.append(f"({', '.join(order_columns)}) {comparison} ({', '.join('?' for _ in start_key)})")
+            params.extend(SQLiteMetadataService.to_sql_value(value) for value in start_key)
+
+        # Unlike DynamoDB, the filter is part of the WHERE clause and so is applied before the LIMIT.
+        rows = self.connection.execute(
+            f"SELECT data FROM metadata INDEXED BY {index_name} WHERE {' AND '.join(clauses)} "
+            f"ORDER BY {', '.join(f'{column} {direction}' for column in order_columns)} LIMIT ?",
+            (*params, limit)
+        )
+
+        items = [json.loads(data) for data, in rows]
+
+        next_cursor = None
+        if len(items) == limit:
+            next_cursor = make_cursor([items[-1][column] for column in order_columns], query, self.cursor_secret)
+
+        return [project(item, fields) for item in items], next_cursor
+
+    def to_sql(self, condition: ConditionBase, params: list):
+        expression = condition.get_expression()
+        operator = expression["operator"]
+        values = expression["values"]
+
+        if operator in ["AND", "OR"]:
+            return f"({self.to_sql(values[0], params)} {operator} {self.to_sql(values[1], params)})"
+
+        if operator == "NOT":
+            return f"(NOT {self.to_sql(values[0], params)})"
+
+        if operator == "attribute_exists":
+            return f"(json_type(data, {self.to_json_path(values[0])}) IS NOT NULL)"
+
+        if operator == "attribute_not_exists":
+            return f"(json_type(data, {self.to_json_path(values[0])}) IS NULL)"
+
+        operand = self.to_sql_operand(values[0], params)
+
+        if operator in self.operators:
+            return f"({operand} {self.operators[operator]} {self.to_sql_operand(values[1], params)})"
+
+        if operator == "BETWEEN":
+            lower = self.to_sql_operand(values[1], params)
+            upper = self.to_sql_operand(values[2], params)
+            return f"({operand} BETWEEN {lower} AND {upper})"
+
+        if operator == "IN":
+            return f"({operand} IN ({', '.join(self.to_sql_operand(value, params) for value in values[1])}))"
+
+        if operator == "begins_with":
+            length = self.to_sql_operand(len(values[1]), params)
+            return f"(substr({operand}, 1, {length}) = {self.to_sql_operand(values[1], params)})"
+
+        if operator == "contains":
+            return f"(instr({operand}, {self.to_sql_operand(values[1], params)}) > 0)"
+
+        raise Exception(f"The condition operator '{operator}' is not supported.")
+
+    def to_sql_operand(self, value, params: list):
+        if isinstance(value, ConditionBase):
+            expression = value.get_expression()
+            if expression["operator"] == "size":
+                return f"length({self.to_sql_operand(expression['values'][0], params)})"
+
+            raise Exception(f"The condition operator '{expression['operator']}' cannot be used as an operand.")
+
+        if isinstance(value, AttributeBase):
+            if value.name in self.columns:
+                return value.name
+
+            return f"json_extract(data, {self.to_json_path(value)})"
+
+        params.append(SQLiteMetadataService.to_sql_value(value))
+        return "?"
+
+    @staticmethod
+    def to_json_path(attribute: AttributeBase):
+        escaped_name = attribute.name.replace('"', '\\"')
+        return "'$.\"" + escaped_name.replace("'", "''") + "\"'"
+
+    @staticmethod
+    def to_sql_value(value):
+        # Numbers read from DynamoDB are Decimals, which neither sqlite3 nor json can store directly.
+        if isinstance(value, Decimal):
+            return int(value) if value % 1 == 0 else float(value)
+
+        return value
@@ -0,0 +1,130 @@
+import time
+from collections import OrderedDict
+
+from boto3.dynamodb.conditions import ConditionBase, AttributeBase
+
+from src.common import log_utils
+from src.common.archiver_config import ArchiverConfigSource
+from src.common.metadata import MetadataService
+
+CACHE_EPOCH_KEY = "metadata_cache_epoch"
+
+
+def get_cache_epoch():
+    return int(time.time() * 1000)
+
+
+async def invalidate_query_caches(config_source: ArchiverConfigSource):
+    # Caches live in other processes, so they are invalidated by changing a shared value that they all poll. Only the
+    # latest epoch is ever read, and every batch of updates writes a new one, so older versions are discarded straight
+    # away rather than piling up.
+    await config_source.put_config(**{CACHE_EPOCH_KEY: get_cache_epoch()})
+    await config_source.compact([CACHE_EPOCH_KEY], keep=1)
+
+
+def normalize(value):
+    # Condition objects don't compare by value, so they are reduced to tuples that can be hashed and compared.
+    if isinstance(value, ConditionBase):
+        expression = value.get_expression()
+        return expression["operator"], tuple(normalize(operand) for operand in expression["values"])
+
+    if isinstance(value, AttributeBase):
+        return "attribute", value.name
+
+    if isinstance(value, (list, tuple)):
+        return tuple(normalize(item) for item in value)
+
+    return value
+
+
+def copy_result(result):
+    # Callers are free to change the items they are given, which must not change what later callers are given.
+    items, cursor = result
+    return [dict(item) for item in items], cursor
+
+
+class CachingMetadataService(MetadataService):
+    """Caches query results from another metadata service.
+
+    Results are kept for at most `ttl` seconds and the least recently used are evicted beyond `max_entries`. Writes made
+    through this service clear the cache. Writes made elsewhere, such as by the metadata generator, are picked up when
+    the cache epoch in `config_source` changes, which is checked at most once every `epoch_check_interval` seconds. Every
+    writer changes the epoch, so the epoch is what keeps results fresh, and the ttl only needs to be long enough for the
+    cache to be worth having; it must be longer than `epoch_check_interval` for the epoch to make any difference.
+    """
+
+    def __init__(self, metadata_service: MetadataService, ttl=300, max_entries=1000,
+                 config_source: ArchiverConfigSource = None, epoch_check_interval=10, clock=time.monotonic):
+        self.logger = log_utils.get_logger(__name__)
+        self.metadata_service = metadata_service
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.config_source = config_source
+        self.epoch_check_interval = epoch_check_interval
+        self.clock = clock
+
+        self.entries = OrderedDict()
+        self.epoch = None
+        self.next_epoch_check = 0
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self):
+        self.entries.clear()
+
+    async def list(self, after_id=None, limit=100):
+        return await self.metadata_service.list(after_id, limit)
+
+    async def get(self, submission_id: str):
+        return await self.metadata_service.get(submission_id)
+
+    async def put(self, submission_id: str, metadata):
+        await self.metadata_service.put(submission_id, metadata)
+        self.invalidate()
+
+    async def put_many(self, items):
+        await self.metadata_service.put_many(items)
+        self.invalidate()
+
+    async def query(self, key_condition, filter_condition=None, after_id=None, limit=100, sort=None, sort_order="asc",
+                    cursor=None, fields=None):
+        await self.check_epoch()
+
+        key = (normalize(key_condition), normalize(filter_condition), after_id, limit, sort, sort_order, cursor,
+               normalize(fields))
+        now = self.clock()
+
+        entry = self.entries.get(key)
+        if entry is not None:
+            expires, result = entry
+
+            if expires > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return copy_result(result)
+
+            del self.entries[key]
+
+        self.misses += 1
+        result = await self.metadata_service.query(key_condition, filter_condition, after_id, limit, sort, sort_order,
+                                                   cursor, fields)
+
+        self.entries[key] = (now + self.ttl, copy_result(result))
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+        return result
+
+    async def check_epoch(self):
+        if self.config_source is None or self.clock() < self.next_epoch_check:
+            return
+
+        self.next_epoch_check = self.clock() + self.epoch_check_interval
+
+        epoch = await self.config_source.get_config(CACHE_EPOCH_KEY)
+        if epoch != self.epoch:
+            if self.epoch is not None:
+                self.logger.info(f"Metadata cache epoch changed from {self.epoch} to {epoch}, clearing cache.")
+
+            self.epoch = epoch
+            self.invalidate()
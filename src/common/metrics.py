@@ -0,0 +1,38 @@
+import json
+import sys
+import time
+
+NAMESPACE = "KnotsRepusArchiver"
+
+# CloudWatch accepts at most 100 values for a metric in a single log event.
+MAX_VALUES_PER_EVENT = 100
+
+
+def put_metric(name: str, values, unit="None", dimensions: dict = None, stream=None):
+    """Writes metric values as a log event in the CloudWatch embedded metric format.
+
+    Log events in this format are turned into metrics by CloudWatch Logs, so no API calls are needed to record them;
+    anything else reading the log just sees a line of JSON.
+    """
+
+    dimensions = dimensions or {}
+    stream = stream or sys.stdout
+    values = list(values)
+
+    for i in range(0, len(values), MAX_VALUES_PER_EVENT):
+        event = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": NAMESPACE,
+                        "Dimensions": [list(dimensions.keys())],
+                        "Metrics": [{"Name": name, "Unit": unit}],
+                    }
+                ],
+            },
+            name: values[i:i + MAX_VALUES_PER_EVENT],
+            **dimensions,
+        }
+
+        print(json.dumps(event), file=stream, flush=True)
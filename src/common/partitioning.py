@@ -0,0 +1,47 @@
+import zlib
+from itertools import product
+
+# The keyspace is split into a fixed number of partitions, and each worker takes a subset of them. Checkpoints are kept
+# per partition rather than per worker, so changing the number of workers only changes which worker owns a partition
+# and never invalidates progress that has already been made.
+PARTITION_COUNT = 16
+
+ID_ALPHABET = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+# Partitions of the metadata generator are made up of whole id prefixes, so that each worker only lists the prefixes it
+# owns rather than the whole archive.
+LISTING_PREFIX_LENGTH = 2
+
+
+def get_partition(submission_id: str, partition_count=PARTITION_COUNT):
+    # Reddit ids are sequential, so their prefixes are heavily skewed; a stable hash spreads them evenly.
+    return zlib.crc32(submission_id.encode("utf-8")) % partition_count
+
+
+def get_listing_partition(submission_id: str):
+    # Consecutive ids share a prefix, so each prefix is only a small slice of the archive and hashing prefixes still
+    # spreads submissions evenly across partitions.
+    return get_partition(submission_id[:LISTING_PREFIX_LENGTH])
+
+
+def get_listing_prefixes(partitions):
+    return [
+        prefix
+        for prefix in ("".join(characters) for characters in product(ID_ALPHABET, repeat=LISTING_PREFIX_LENGTH))
+        if get_partition(prefix) in partitions
+    ]
+
+
+def get_id_order(submission_id: str):
+    # Ids are base 36 numbers, so a longer id always comes after a shorter one whatever their characters.
+    return len(submission_id), submission_id
+
+
+def get_worker_partitions(worker_index: int, worker_count: int, partition_count=PARTITION_COUNT):
+    if worker_count < 1 or worker_count > partition_count:
+        raise ValueError(f"The worker count must be between 1 and {partition_count}.")
+
+    if worker_index < 0 or worker_index >= worker_count:
+        raise ValueError(f"The worker index must be between 0 and {worker_count - 1}.")
+
+    return [partition for partition in range(partition_count) if partition % worker_count == worker_index]
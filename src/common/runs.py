@@ -0,0 +1,19 @@
+import threading
+import time
+import uuid
+
+last_timestamp = 0
+lock = threading.Lock()
+
+
+def make_run_id():
+    # Derived data is written as immutable runs named by this id, which sorts in the order the runs were written and
+    # is unique across concurrent writers, so that no two writers ever write the same object. Runs written by the same
+    # process within a millisecond of each other are given consecutive timestamps, so that they still sort in order.
+    global last_timestamp
+
+    with lock:
+        last_timestamp = max(int(time.time() * 1000), last_timestamp + 1)
+        timestamp = last_timestamp
+
+    return f"{timestamp:013d}-{uuid.uuid4().hex[:8]}"
@@ -0,0 +1,344 @@
+import asyncio
+import re
+import struct
+import zlib
+from collections import defaultdict
+
+from src.common.filesystem import FileSystem
+from src.common.runs import make_run_id
+
+TERM_SHARD_COUNT = 32
+
+# Each flush of a writer adds a run to every term shard it has postings for, and never updates an existing run, so that
+# concurrent writers never update the same object. Queries read the runs of a term shard and merge them, and runs are
+# compacted into fewer, larger runs as they pile up.
+RUNS_PER_TIER = 4
+
+# The length of a run's directory.
+HEADER_FORMAT = "<I"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# How much of a run is read up front when looking up a term, in the hope that it holds the directory and the postings.
+RUN_PREFETCH_SIZE = 16 * 1024
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "from", "has", "have", "i", "if", "in", "is", "it",
+    "its", "of", "on", "or", "so", "that", "the", "this", "to", "was", "we", "with", "you",
+}
+
+
+def tokenize(*texts):
+    terms = []
+
+    for text in texts:
+        if text is None:
+            continue
+
+        for term in TOKEN_PATTERN.findall(text.lower()):
+            term = term.replace("'", "")
+            if term not in STOP_WORDS and term not in terms:
+                terms.append(term)
+
+    return terms
+
+
+def get_term_shard(term: str):
+    return zlib.crc32(term.encode("utf-8")) % TERM_SHARD_COUNT
+
+
+def get_shard_path(term_shard: int):
+    return f"_search/{term_shard:02d}"
+
+
+def get_run_path(term_shard: int, run_id: str, posting_count: int):
+    # The number of postings is part of the name, so that runs can be sized up for compaction from a listing alone.
+    return f"{get_shard_path(term_shard)}/{run_id}-{posting_count}.idx"
+
+
+def get_run_posting_count(path: str):
+    return int(path[:-len(".idx")].rsplit("-", 1)[1])
+
+
+def get_run_tier(posting_count: int):
+    # Runs are grouped into tiers of similar size, each holding RUNS_PER_TIER times as many postings as the last.
+    tier = 0
+    while posting_count >= RUNS_PER_TIER:
+        posting_count //= RUNS_PER_TIER
+        tier += 1
+
+    return tier
+
+
+def write_varint(buffer: bytearray, value: int):
+    while value >= 0x80:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+
+    buffer.append(value)
+
+
+def read_varint(data: bytes, offset: int):
+    value = 0
+    shift = 0
+
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+
+        if byte < 0x80:
+            return value, offset
+
+        shift += 7
+
+
+def encode_postings(postings: dict):
+    # Postings are sorted by creation time, which is stored as a delta from the previous posting so that most of them
+    # fit in one or two bytes.
+    buffer = bytearray()
+    previous = 0
+
+    for submission_id, created_utc in sorted(postings.items(), key=lambda posting: (posting[1], posting[0])):
+        write_varint(buffer, created_utc - previous)
+        previous = created_utc
+
+        encoded_id = submission_id.encode("utf-8")
+        write_varint(buffer, len(encoded_id))
+        buffer.extend(encoded_id)
+
+    return bytes(buffer)
+
+
+def decode_postings(data: bytes):
+    postings = {}
+    offset = 0
+    created_utc = 0
+
+    while offset < len(data):
+        delta, offset = read_varint(data, offset)
+        created_utc += delta
+
+        length, offset = read_varint(data, offset)
+        postings[data[offset:offset + length].decode("utf-8")] = created_utc
+        offset += length
+
+    return postings
+
+
+def encode_run(terms: dict):
+    # A run starts with the length of its directory, then the directory of where each term's postings are stored,
+    # followed by the postings of each term compressed on their own. Looking up a term only needs the directory and the
+    # postings of that term to be read.
+    directory = bytearray()
+    blocks = bytearray()
+
+    for term, postings in sorted(terms.items()):
+        block = zlib.compress(encode_postings(postings))
+
+        encoded_term = term.encode("utf-8")
+        write_varint(directory, len(encoded_term))
+        directory.extend(encoded_term)
+        write_varint(directory, len(blocks))
+        write_varint(directory, len(block))
+
+        blocks.extend(block)
+
+    directory = zlib.compress(bytes(directory))
+
+    return struct.pack(HEADER_FORMAT, len(directory)) + directory + bytes(blocks)
+
+
+def decode_directory(data: bytes):
+    data = zlib.decompress(data)
+    directory = {}
+    offset = 0
+
+    while offset < len(data):
+        length, offset = read_varint(data, offset)
+        term = data[offset:offset + length].decode("utf-8")
+        offset += length
+
+        block_offset, offset = read_varint(data, offset)
+        block_length, offset = read_varint(data, offset)
+        directory[term] = (block_offset, block_length)
+
+    return directory
+
+
+def decode_run(data: bytes):
+    directory_length, = struct.unpack_from(HEADER_FORMAT, data)
+    blocks_offset = HEADER_SIZE + directory_length
+
+    return {
+        term: decode_postings(zlib.decompress(data[blocks_offset + offset:blocks_offset + offset + length]))
+        for term, (offset, length) in decode_directory(data[HEADER_SIZE:blocks_offset]).items()
+    }
+
+
+async def read_run_postings(filesystem: FileSystem, path: str, term: str):
+    """Returns the postings of a term in a run, or None if the run doesn't exist."""
+
+    # The directory is usually small enough for it, and often the postings, to be read with the first request.
+    data = await filesystem.read_range(path, 0, RUN_PREFETCH_SIZE)
+    if data is None:
+        return None
+
+    directory_length, = struct.unpack_from(HEADER_FORMAT, data)
+    blocks_offset = HEADER_SIZE + directory_length
+
+    if len(data) < blocks_offset:
+        rest = await filesystem.read_range(path, len(data), blocks_offset)
+        if rest is None:
+            return None
+
+        data += rest
+
+    entry = decode_directory(data[HEADER_SIZE:blocks_offset]).get(term)
+    if entry is None:
+        return {}
+
+    start = blocks_offset + entry[0]
+    end = start + entry[1]
+
+    if end <= len(data):
+        block = data[start:end]
+    else:
+        block = await filesystem.read_range(path, start, end)
+        if block is None:
+            return None
+
+    return decode_postings(zlib.decompress(block))
+
+
+async def list_runs(filesystem: FileSystem, term_shard: int):
+    return sorted([path async for path in filesystem.list_files(get_shard_path(term_shard)) if path.endswith(".idx")])
+
+
+async def compact_shard(filesystem: FileSystem, term_shard: int):
+    """Merges the runs of each tier of a term shard that has filled up into a single run of the next tier.
+
+    Every posting is only merged again once the runs of its tier add up to the size of the next one, so building an
+    index of any size rewrites each posting a logarithmic number of times, and a shard holds a few runs per tier.
+    """
+
+    tiers = defaultdict(list)
+    for path in await list_runs(filesystem, term_shard):
+        tiers[get_run_tier(get_run_posting_count(path))].append(path)
+
+    while True:
+        full_tiers = [tier for tier, paths in tiers.items() if len(paths) >= RUNS_PER_TIER]
+        if len(full_tiers) == 0:
+            break
+
+        paths = tiers.pop(min(full_tiers))
+        path = await merge_runs(filesystem, term_shard, paths)
+
+        if path is not None:
+            tiers[get_run_tier(get_run_posting_count(path))].append(path)
+
+
+async def compact_search_index(filesystem: FileSystem):
+    await asyncio.gather(*(compact_shard(filesystem, term_shard) for term_shard in range(TERM_SHARD_COUNT)))
+
+
+async def merge_runs(filesystem: FileSystem, term_shard: int, paths):
+    runs = await asyncio.gather(*(filesystem.read(path) for path in paths))
+
+    # A submission is always indexed with its creation time, so merging the same posting from several runs makes no
+    # difference. A run that no longer exists was merged by a concurrent compaction, and its postings are already in
+    # the run that replaced it.
+    merged = defaultdict(dict)
+    read_paths = []
+    for path, data in zip(paths, runs):
+        if data is None:
+            continue
+
+        for term, postings in decode_run(data).items():
+            merged[term].update(postings)
+
+        read_paths.append(path)
+
+    if len(read_paths) == 0:
+        return None
+
+    posting_count = sum(len(postings) for postings in merged.values())
+    path = get_run_path(term_shard, make_run_id(), posting_count)
+
+    # The merged run must exist before the runs it replaces are deleted, so that no postings are ever missing.
+    await filesystem.write(path, encode_run(merged))
+    await asyncio.gather(*(filesystem.delete(path) for path in read_paths))
+
+    return path
+
+
+class SearchIndexWriter:
+    def __init__(self, filesystem: FileSystem, compact=True):
+        self.filesystem = filesystem
+        self.pending = defaultdict(lambda: defaultdict(dict))
+
+        # Whether to compact the shards written to after each flush, rather than leaving it to a compaction job.
+        self.compact = compact
+
+    def add(self, submission_id: str, created_utc: int, *texts):
+        for term in tokenize(*texts):
+            self.pending[get_term_shard(term)][term][submission_id] = int(created_utc)
+
+    async def flush(self):
+        pending = self.pending
+        self.pending = defaultdict(lambda: defaultdict(dict))
+
+        # Postings are buffered and written as a new run of each term shard, rather than being merged into what is
+        # already there, so a flush costs the same however large the index has grown.
+        await asyncio.gather(*(self.write_run(term_shard, terms) for term_shard, terms in pending.items()))
+
+        if self.compact:
+            await asyncio.gather(*(compact_shard(self.filesystem, term_shard) for term_shard in pending.keys()))
+
+    async def write_run(self, term_shard: int, terms: dict):
+        posting_count = sum(len(postings) for postings in terms.values())
+        await self.filesystem.write(get_run_path(term_shard, make_run_id(), posting_count), encode_run(terms))
+
+
+class SearchIndex:
+    def __init__(self, filesystem: FileSystem):
+        self.filesystem = filesystem
+
+    async def search(self, query: str, limit=100):
+        terms = tokenize(query)
+
+        if len(terms) == 0:
+            return []
+
+        postings = await asyncio.gather(*(self.get_postings(term) for term in terms))
+
+        # Intersect starting from the rarest term, so that the candidate set is as small as possible from the outset.
+        postings = sorted(postings, key=len)
+        matches = postings[0]
+
+        for other in postings[1:]:
+            matches = {submission_id: created_utc for submission_id, created_utc in matches.items()
+                       if submission_id in other}
+
+        results = sorted(matches.items(), key=lambda match: (match[1], match[0]), reverse=True)[:limit]
+
+        return [{"submission_id": submission_id, "created_utc": created_utc} for submission_id, created_utc in results]
+
+    async def get_postings(self, term: str):
+        term_shard = get_term_shard(term)
+
+        # A run can be merged away by a compaction between listing the runs and reading them, in which case its
+        # postings are in a run that the next listing will find.
+        for _ in range(2):
+            paths = await list_runs(self.filesystem, term_shard)
+            runs = await asyncio.gather(*(read_run_postings(self.filesystem, path, term) for path in paths))
+
+            if all(postings is not None for postings in runs):
+                break
+
+        postings = {}
+        for run in runs:
+            postings.update(run or {})
+
+        return postings
@@ -0,0 +1,276 @@
+import asyncio
+import json
+import zlib
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from src.common.filesystem import FileSystem
+from src.common.partitioning import get_id_order
+from src.common.runs import make_run_id
+
+AUTHOR_SHARD_COUNT = 32
+TOP_AUTHOR_COUNT = 100
+
+SUMMARY_PATH = "_stats/summary.json"
+BASE_PATH = "_stats/base.json"
+DELTA_PATH = "_stats/deltas"
+
+# Writers never update statistics in place: every flush writes an immutable delta of its own, so that any number of
+# metadata generator workers, updaters and refreshes can count submissions concurrently. A single compaction job folds
+# the deltas into the base statistics and writes out the objects that the API reads, so that each statistic can be
+# served by reading a single object.
+
+
+def get_delta_path(run_id: str):
+    return f"{DELTA_PATH}/{run_id}.delta"
+
+
+def get_author_shard(author: str):
+    return zlib.crc32(author.encode("utf-8")) % AUTHOR_SHARD_COUNT
+
+
+def get_author_shard_path(author_shard: int):
+    return f"_stats/authors/{author_shard:02d}.json"
+
+
+def get_date(created_utc):
+    return datetime.fromtimestamp(int(created_utc), tz=timezone.utc).strftime("%Y-%m-%d")
+
+
+def get_score_bucket(score):
+    # Scores are bucketed by their order of magnitude in base 2, which keeps the distribution small whatever the range
+    # of scores, while still being precise enough to estimate percentiles. Bucket 0 holds scores of zero or less.
+    score = int(score)
+    return score.bit_length() if score > 0 else 0
+
+
+def get_score_bucket_range(bucket: int):
+    if bucket == 0:
+        return None, 0
+
+    return 2 ** (bucket - 1), 2 ** bucket - 1
+
+
+class Statistics:
+    def __init__(self, through=None, applied=None, daily=None, authors=None, scores=None):
+        # The last submission counted from each segment; the submissions of a segment are added in id order, so
+        # anything up to it has already been counted.
+        self.through = dict(through or {})
+        # The deltas that have already been counted, in case the compaction failed before deleting them.
+        self.applied = list(applied or [])
+        self.daily = defaultdict(lambda: defaultdict(int), {
+            date: defaultdict(int, counts) for date, counts in (daily or {}).items()
+        })
+        self.authors = defaultdict(lambda: [0, 0], {author: list(totals) for author, totals in (authors or {}).items()})
+        self.scores = defaultdict(int, {int(bucket): count for bucket, count in (scores or {}).items()})
+
+    def add(self, segment: str, metadata: dict):
+        # Ids are compared in the order they are listed in, as a longer id always comes after a shorter one.
+        if get_id_order(metadata["submission_id"]) <= get_id_order(self.through.get(segment, "")):
+            return
+
+        self.through[segment] = metadata["submission_id"]
+        self.count(metadata, 1)
+
+    def update(self, old_metadata, new_metadata: dict):
+        # Submissions can be archived again, so whatever was counted for the old metadata is replaced.
+        if old_metadata is not None:
+            self.count(old_metadata, -1)
+
+        self.count(new_metadata, 1)
+
+    def count(self, metadata: dict, sign: int):
+        self.daily[get_date(metadata["created_utc"])][metadata["post_type"]] += sign
+
+        totals = self.authors[metadata["author"]]
+        totals[0] += sign
+        totals[1] += sign * int(metadata["score"])
+
+        self.scores[get_score_bucket(metadata["score"])] += sign
+
+    def compact(self):
+        # Updates can leave counts that cancel each other out.
+        for date in list(self.daily.keys()):
+            self.daily[date] = defaultdict(int, {
+                post_type: count for post_type, count in self.daily[date].items() if count != 0
+            })
+
+            if len(self.daily[date]) == 0:
+                del self.daily[date]
+
+        for author in [author for author, totals in self.authors.items() if totals == [0, 0]]:
+            del self.authors[author]
+
+        for bucket in [bucket for bucket, count in self.scores.items() if count == 0]:
+            del self.scores[bucket]
+
+    def to_json(self):
+        return json.dumps({
+            "through": self.through,
+            "applied": self.applied,
+            "daily": self.daily,
+            "authors": self.authors,
+            "scores": self.scores,
+        }, separators=(",", ":"))
+
+    @staticmethod
+    def from_json(data):
+        return Statistics(**json.loads(data))
+
+
+def get_top_authors(authors: dict, index: int):
+    top_authors = sorted(authors.items(), key=lambda author: (-author[1][index], author[0]))[:TOP_AUTHOR_COUNT]
+
+    return [
+        {"author": author, "count": count, "score_total": score_total}
+        for author, (count, score_total) in top_authors
+    ]
+
+
+def create_summary(statistics: Statistics):
+    post_types = defaultdict(int)
+    for counts in statistics.daily.values():
+        for post_type, count in counts.items():
+            post_types[post_type] += count
+
+    return {
+        "submission_count": sum(post_types.values()),
+        "author_count": len(statistics.authors),
+        "post_types": dict(sorted(post_types.items())),
+        "daily": {date: dict(sorted(counts.items())) for date, counts in sorted(statistics.daily.items())},
+        "top_authors_by_score": get_top_authors(statistics.authors, 1),
+        "top_authors_by_count": get_top_authors(statistics.authors, 0),
+        "scores": [
+            {"min": low, "max": high, "count": statistics.scores[bucket]}
+            for bucket in sorted(statistics.scores.keys())
+            for low, high in [get_score_bucket_range(bucket)]
+        ],
+        "last_updated": int(datetime.utcnow().timestamp()),
+    }
+
+
+def get_counted_fields(metadata):
+    if metadata is None:
+        return None
+
+    return {key: metadata[key] for key in ["submission_id", "created_utc", "post_type", "author", "score"]}
+
+
+class StatisticsWriter:
+    def __init__(self, filesystem: FileSystem):
+        self.filesystem = filesystem
+        self.pending = defaultdict(list)
+        self.pending_updates = []
+
+    def add(self, segment: str, metadata: dict):
+        self.pending[segment].append(metadata)
+
+    def update(self, old_metadata, new_metadata: dict):
+        self.pending_updates.append((old_metadata, new_metadata))
+
+    async def flush(self):
+        pending = self.pending
+        pending_updates = self.pending_updates
+        self.pending = defaultdict(list)
+        self.pending_updates = []
+
+        if len(pending) == 0 and len(pending_updates) == 0:
+            return
+
+        await self.write_delta({
+            "adds": {
+                segment: [
+                    get_counted_fields(metadata)
+                    for metadata in sorted(items, key=lambda item: get_id_order(item["submission_id"]))
+                ]
+                for segment, items in pending.items()
+            },
+            "updates": [[get_counted_fields(old), get_counted_fields(new)] for old, new in pending_updates],
+        })
+
+    async def reset(self):
+        # Everything counted before the reset is discarded when the reset is compacted, including deltas that haven't
+        # been compacted yet.
+        self.pending = defaultdict(list)
+        self.pending_updates = []
+
+        await self.write_delta({"reset": True})
+
+    async def write_delta(self, delta: dict):
+        await self.filesystem.write(get_delta_path(make_run_id()), json.dumps(delta, separators=(",", ":")))
+
+
+async def compact_statistics(filesystem: FileSystem):
+    """Counts every delta written since the last compaction into the base statistics, and writes the summary along
+    with the author shards of the authors that were counted.
+
+    Deltas are only deleted once the base counting them has been written, so a compaction that fails part way is simply
+    run again. It must never run concurrently with itself.
+    """
+
+    base = await read_base(filesystem)
+    paths = sorted([path async for path in filesystem.list_files(DELTA_PATH) if path.endswith(".delta")])
+    applied = set(base.applied)
+    new_paths = [path for path in paths if path not in applied]
+
+    author_shards_to_write = set()
+    for path, data in zip(new_paths, await asyncio.gather(*(filesystem.read(path) for path in new_paths))):
+        if data is None:
+            continue
+
+        delta = json.loads(data)
+
+        if delta.get("reset", False):
+            base = Statistics()
+            author_shards_to_write = set(range(AUTHOR_SHARD_COUNT))
+
+        for segment, items in delta.get("adds", {}).items():
+            for metadata in items:
+                base.add(segment, metadata)
+                author_shards_to_write.add(get_author_shard(metadata["author"]))
+
+        for old_metadata, new_metadata in delta.get("updates", []):
+            base.update(old_metadata, new_metadata)
+            author_shards_to_write.update(
+                get_author_shard(metadata["author"]) for metadata in [old_metadata, new_metadata] if metadata is not None
+            )
+
+    if len(new_paths) > 0:
+        base.compact()
+        base.applied = paths
+        await filesystem.write(BASE_PATH, base.to_json())
+
+        author_shards = defaultdict(dict)
+        for author, (count, score_total) in base.authors.items():
+            author_shard = get_author_shard(author)
+
+            if author_shard in author_shards_to_write:
+                author_shards[author_shard][author] = {"count": count, "score_total": score_total}
+
+        await asyncio.gather(
+            filesystem.write(SUMMARY_PATH, json.dumps(create_summary(base))),
+            *(
+                filesystem.write(get_author_shard_path(author_shard), json.dumps(author_shards[author_shard]))
+                for author_shard in sorted(author_shards_to_write)
+            )
+        )
+
+    await asyncio.gather(*(filesystem.delete(path) for path in paths))
+
+
+async def read_base(filesystem: FileSystem):
+    data = await filesystem.read(BASE_PATH)
+
+    return Statistics.from_json(data) if data is not None else Statistics()
+
+
+async def read_summary(filesystem: FileSystem):
+    data = await filesystem.read(SUMMARY_PATH)
+
+    return json.loads(data) if data is not None else None
+
+
+async def read_author_statistics(filesystem: FileSystem, author: str):
+    data = await filesystem.read(get_author_shard_path(get_author_shard(author)))
+
+    return json.loads(data).get(author) if data is not None else None
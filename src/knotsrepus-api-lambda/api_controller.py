@@ -1,93 +1,344 @@
+import asyncio
 import base64
 import json
 import mimetypes
 import os
+import re
 
 from boto3.dynamodb.conditions import Key, Attr
 
 import rest
+from src.common import comment_index
+from src.common.cursor import InvalidCursor
 from src.common.filesystem import FileSystem
-from src.common.metadata import MetadataService
-from src.common.syncio import run_synchronously, iterate_synchronously
+from src.common.manifest import read_manifest
+from src.common.metadata import MetadataService, PUBLIC_FIELDS
+from src.common.search_index import SearchIndex
+from src.common.statistics import read_summary, read_author_statistics
+
+# Archived submissions rarely change once archived, and can be revalidated using their ETag when they do. Listings and
+# statistics change as new submissions are archived.
+ARCHIVE_CACHE_CONTROL = "public, max-age=86400"
+LISTING_CACHE_CONTROL = "public, max-age=60"
+STATS_CACHE_CONTROL = "public, max-age=300"
+
+# The most submissions that can be requested from /submission/batch at once.
+BATCH_LIMIT = 100
+
+BATCH_INCLUDES = ["comment_count", "manifest"]
+
+# The most comments that can be requested in one page.
+COMMENT_PAGE_LIMIT = 1000
+
+# Reddit ids are base 36, so anything else can't have been archived and is never read.
+SUBMISSION_ID_PATTERN = re.compile(r"[0-9a-z]+")
 
 
 class ApiController:
-    def __init__(self, filesystem: FileSystem, metadata_service: MetadataService):
+    def __init__(self, filesystem: FileSystem, metadata_service: MetadataService, author_post_type_indexes=True):
         self.filesystem = filesystem
         self.metadata_service = metadata_service
 
-    @rest.route(path="/submission")
-    def get_submissions(self, author=None, post_type=None, sort="created_utc", sort_order="asc", after_id=None, count=100, **kwargs):
+        # Items written before the indexes of listings by author and post type existed aren't in them until the metadata
+        # is rebuilt, so until then those listings filter the author's listing instead.
+        self.author_post_type_indexes = author_post_type_indexes
+
+    @rest.route(
+        path="/submission",
+        cache_control=LISTING_CACHE_CONTROL,
+        sort=rest.Param(default="created_utc", choices=["created_utc", "score"]),
+        sort_order=rest.Param(default="asc", choices=["asc", "desc"]),
+        count=rest.Param(int, default=100, minimum=1),
+        fields=rest.Param(default="")
+    )
+    async def get_submissions(self, author=None, post_type=None, sort="created_utc", sort_order="asc", after_id=None,
+                              count=100, cursor=None, fields="", **kwargs):
         count = min(count, 100)
 
+        # Attributes that only exist to index items are never returned.
+        fields = [field for field in fields.split(",") if field != ""] or PUBLIC_FIELDS
+        for field in fields:
+            if field not in PUBLIC_FIELDS:
+                choices = ", ".join(f"'{choice}'" for choice in PUBLIC_FIELDS)
+                return rest.bad_request(f"The fields parameter must only list {choices}.")
+
         sort_key = Key(sort).gte(0)
         if author is None and post_type is None:
             coroutine = self.metadata_service.query(
                 Key("dummy").eq("dummy") & sort_key,
                 after_id=after_id,
+                cursor=cursor,
                 limit=count,
                 sort=sort,
-                sort_order=sort_order
+                sort_order=sort_order,
+                fields=fields
+            )
+        elif author is not None and post_type is None:
+            coroutine = self.metadata_service.query(
+                Key("author").eq(author) & sort_key,
+                after_id=after_id,
+                cursor=cursor,
+                limit=count,
+                sort=sort,
+                sort_order=sort_order,
+                fields=fields
+            )
+        elif author is not None and not self.author_post_type_indexes:
+            coroutine = self.metadata_service.query(
+                Key("author").eq(author) & sort_key,
+                Attr("post_type").eq(post_type),
+                after_id=after_id,
+                cursor=cursor,
+                limit=count,
+                sort=sort,
+                sort_order=sort_order,
+                fields=fields
             )
         elif author is not None:
-            key_condition = Key("author").eq(author) & sort_key
-            if post_type is None:
-                coroutine = self.metadata_service.query(
-                    key_condition,
-                    after_id=after_id,
-                    limit=count,
-                    sort=sort,
-                    sort_order=sort_order
-                )
-            else:
-                coroutine = self.metadata_service.query(
-                    key_condition,
-                    Attr("post_type").eq(post_type),
-                    after_id=after_id,
-                    limit=count,
-                    sort=sort,
-                    sort_order=sort_order
-                )
+            coroutine = self.metadata_service.query(
+                Key("author_post_type").eq(f"{author}#{post_type}") & sort_key,
+                after_id=after_id,
+                cursor=cursor,
+                limit=count,
+                sort=sort,
+                sort_order=sort_order,
+                fields=fields
+            )
         else:
             coroutine = self.metadata_service.query(
                 Key("post_type").eq(post_type) & sort_key,
                 after_id=after_id,
+                cursor=cursor,
                 limit=count,
                 sort=sort,
-                sort_order=sort_order
+                sort_order=sort_order,
+                fields=fields
             )
 
-        data = run_synchronously(coroutine)
+        try:
+            data, next_cursor = await coroutine
+        except InvalidCursor as e:
+            return rest.bad_request(str(e))
 
         if data is not None:
-            return rest.ok(data)
+            # The cursor is returned in a header so that the body stays a plain list of items.
+            return rest.ok(data, headers={"X-Next-Cursor": next_cursor} if next_cursor is not None else None)
 
         return rest.not_found()
 
-    @rest.route(path="/submission/{submission_id}")
-    def get_submission(self, submission_id, **kwargs):
-        data = run_synchronously(self.filesystem.read(f"{submission_id}/post.json"))
+    @rest.route(
+        path="/search",
+        cache_control=LISTING_CACHE_CONTROL,
+        q=rest.Param(default=""),
+        count=rest.Param(int, default=100, minimum=1)
+    )
+    async def search(self, q="", count=100, **kwargs):
+        count = min(count, 100)
 
-        if data is not None:
-            return rest.ok(json.loads(data))
+        results = await SearchIndex(self.filesystem).search(q, limit=count)
+
+        return rest.ok(results)
+
+    @rest.route(path="/stats/summary", cache_control=STATS_CACHE_CONTROL)
+    async def get_stats_summary(self, **kwargs):
+        summary = await read_summary(self.filesystem)
+
+        if summary is not None:
+            return rest.ok({
+                key: summary[key] for key in ["submission_count", "author_count", "post_types", "last_updated"]
+            })
+
+        return rest.not_found()
+
+    @rest.route(path="/stats/daily", cache_control=STATS_CACHE_CONTROL)
+    async def get_daily_stats(self, post_type=None, start=None, end=None, **kwargs):
+        summary = await read_summary(self.filesystem)
+
+        if summary is None:
+            return rest.not_found()
+
+        days = [
+            {"date": date, "counts": counts}
+            for date, counts in summary["daily"].items()
+            if (start is None or date >= start) and (end is None or date <= end)
+        ]
+
+        if post_type is not None:
+            days = [{"date": day["date"], "count": day["counts"].get(post_type, 0)} for day in days]
+
+        return rest.ok(days)
+
+    @rest.route(
+        path="/stats/authors",
+        cache_control=STATS_CACHE_CONTROL,
+        sort=rest.Param(default="score", choices=["score", "count"]),
+        count=rest.Param(int, default=100, minimum=1)
+    )
+    async def get_top_authors(self, sort="score", count=100, **kwargs):
+        summary = await read_summary(self.filesystem)
+
+        if summary is not None:
+            return rest.ok(summary[f"top_authors_by_{sort}"][:count])
+
+        return rest.not_found()
+
+    @rest.route(path="/stats/authors/{author}", cache_control=STATS_CACHE_CONTROL)
+    async def get_author_stats(self, author, **kwargs):
+        statistics = await read_author_statistics(self.filesystem, author)
+
+        if statistics is not None:
+            return rest.ok({"author": author, **statistics})
+
+        return rest.not_found()
+
+    @rest.route(path="/stats/scores", cache_control=STATS_CACHE_CONTROL)
+    async def get_score_stats(self, **kwargs):
+        summary = await read_summary(self.filesystem)
+
+        if summary is not None:
+            return rest.ok(summary["scores"])
 
         return rest.not_found()
 
-    @rest.route(path="/submission/{submission_id}/comments")
-    def get_comments(self, submission_id, **kwargs):
-        data = run_synchronously(self.filesystem.read(f"{submission_id}/comments.json"))
+    @rest.route(path="/submission/{submission_id}", cache_control=ARCHIVE_CACHE_CONTROL)
+    async def get_submission(self, submission_id, **kwargs):
+        return await self.read_archived_json(f"{submission_id}/post.json")
+
+    @rest.route(
+        path="/submission/batch",
+        cache_control=LISTING_CACHE_CONTROL,
+        ids=rest.Param(default=""),
+        include=rest.Param(default="")
+    )
+    async def get_submission_batch(self, ids="", include="", **kwargs):
+        submission_ids = [submission_id for submission_id in ids.split(",") if submission_id != ""]
+        includes = [name for name in include.split(",") if name != ""]
+
+        if len(submission_ids) == 0:
+            return rest.bad_request("The ids parameter must list at least one submission id.")
+
+        if len(submission_ids) > BATCH_LIMIT:
+            return rest.bad_request(f"At most {BATCH_LIMIT} submissions can be requested at once.")
+
+        for name in includes:
+            if name not in BATCH_INCLUDES:
+                choices = ", ".join(f"'{choice}'" for choice in BATCH_INCLUDES)
+                return rest.bad_request(f"The include parameter must only list {choices}.")
+
+        # Each submission is only read once, however many times it was requested.
+        unique_ids = list(dict.fromkeys(submission_ids))
+        results = await asyncio.gather(*(self.read_batch_item(submission_id, includes) for submission_id in unique_ids))
+        items = dict(zip(unique_ids, results))
+
+        return rest.ok([items[submission_id] for submission_id in submission_ids])
+
+    async def read_batch_item(self, submission_id, includes):
+        # Errors are reported for each submission, so that one missing submission doesn't fail the whole batch.
+        if SUBMISSION_ID_PATTERN.fullmatch(submission_id) is None:
+            return {"submission_id": submission_id, "error": "Invalid submission id"}
+
+        reads = [self.filesystem.read(f"{submission_id}/post.json")]
+        if "comment_count" in includes:
+            reads.append(self.read_comment_count(submission_id))
+        if "manifest" in includes:
+            reads.append(read_manifest(self.filesystem, submission_id))
+
+        try:
+            post, *included = await asyncio.gather(*reads)
+        except Exception:
+            return {"submission_id": submission_id, "error": "The submission could not be read"}
+
+        if post is None:
+            return {"submission_id": submission_id, "error": "Not Found"}
+
+        item = {"submission_id": submission_id, "post": json.loads(post)}
+
+        if "comment_count" in includes:
+            item["comment_count"] = included.pop(0)
+        if "manifest" in includes:
+            item["manifest"] = included.pop(0)
+
+        return item
+
+    async def read_comment_count(self, submission_id):
+        count = await comment_index.read_comment_count(self.filesystem, submission_id)
+
+        if count is not None:
+            return count
+
+        # Comments archived before the comment index existed can only be counted by reading all of them.
+        comments = await self.filesystem.read(f"{submission_id}/comments.json")
+        return len(json.loads(comments)) if comments is not None else None
+
+    @rest.route(
+        path="/submission/{submission_id}/comments",
+        cache_control=ARCHIVE_CACHE_CONTROL,
+        sort=rest.Param(default="created_utc", choices=comment_index.SORTS),
+        sort_order=rest.Param(default="asc", choices=comment_index.SORT_ORDERS),
+        offset=rest.Param(int, default=0, minimum=0),
+        limit=rest.Param(int, minimum=1, maximum=COMMENT_PAGE_LIMIT)
+    )
+    async def get_comments(self, submission_id, sort="created_utc", sort_order="asc", offset=0, limit=None, **kwargs):
+        # The whole thread is returned unless a page of it is asked for.
+        if limit is None:
+            return await self.read_archived_json(f"{submission_id}/comments.json")
+
+        lines = await comment_index.read_comment_page(self.filesystem, submission_id, sort, sort_order, offset, limit)
+
+        if lines is None:
+            # Comments archived before they were indexed have to be read in full to be paged.
+            data = await self.filesystem.read(f"{submission_id}/comments.json")
+
+            if data is None:
+                return rest.not_found()
+
+            comments = comment_index.sort_comments(json.loads(data), sort, sort_order)[offset:offset + limit]
+            lines = [json.dumps(comment).encode("utf-8") for comment in comments]
+
+        headers = {"X-Next-Offset": str(offset + limit)} if len(lines) == limit else None
+
+        return rest.raw(b"[" + b",".join(lines) + b"]", headers=headers)
+
+    async def read_archived_json(self, path):
+        # A client that already has the current version only needs to be told so, which doesn't need the file itself.
+        if_none_match = rest.get_request_header("If-None-Match")
+        if if_none_match is not None:
+            etag = await self.filesystem.get_etag(path)
+
+            if etag is None:
+                return rest.not_found()
+
+            if rest.etag_matches(if_none_match, etag):
+                return rest.not_modified(etag)
+
+        data, etag = await self.filesystem.read_with_etag(path)
 
         if data is not None:
-            return rest.ok(json.loads(data))
+            # The stored JSON is sent as it is, rather than being parsed and serialized again.
+            return rest.raw(data, headers={"ETag": etag})
 
         return rest.not_found()
 
-    @rest.route(path="/submission/{submission_id}/media")
-    def get_media_list(self, submission_id, **kwargs):
-        media = iterate_synchronously(self.filesystem.list_files(submission_id))
+    # Media is listed as soon as the submission is archived, and more is added as it is archived.
+    @rest.route(
+        path="/submission/{submission_id}/media",
+        cache_control=LISTING_CACHE_CONTROL,
+        details=rest.Param(bool, default=False)
+    )
+    async def get_media_list(self, submission_id, details=False, **kwargs):
+        manifest = await read_manifest(self.filesystem, submission_id)
+
+        if manifest is not None:
+            files = manifest["files"]
+        else:
+            # Submissions archived before manifests were introduced have to fall back to listing the prefix.
+            files = [{"name": os.path.basename(item)} async for item in self.filesystem.list_files(submission_id)]
+
+        if details is True:
+            return rest.ok(files)
 
-        return rest.ok(list(os.path.basename(item) for item in media))
+        return rest.ok([file["name"] for file in files])
 
-    @rest.route(path="/submission/{submission_id}/media/{filename}")
-    def get_media_object(self, submission_id, filename, **kwargs):
+    @rest.route(path="/submission/{submission_id}/media/{filename}", cache_control=ARCHIVE_CACHE_CONTROL)
+    async def get_media_object(self, submission_id, filename, **kwargs):
         return rest.redirect(f"https://media.knotsrepus.net/{submission_id}/{filename}")
@@ -0,0 +1,50 @@
+"""Serves the API over HTTP from a local copy of the archive and an SQLite metadata store.
+
+Requests are turned into the events API Gateway would send, and handled by the same code as the Lambda function:
+
+    cd src/knotsrepus-api-lambda
+    ARCHIVE_DATA_PATH=/path/to/archive METADATA_SQLITE_PATH=metadata.db PYTHONPATH=../../ python local_server.py
+"""
+import base64
+import os
+
+from aiohttp import web
+
+import api_controller
+import main
+from src.common.filesystem import LocalFileSystem
+from src.common.metadata import SQLiteMetadataService
+
+
+def create_app(api: api_controller.ApiController):
+    async def handle(request: web.Request):
+        event = {
+            "path": request.path,
+            "httpMethod": request.method,
+            "headers": dict(request.headers),
+            "queryStringParameters": dict(request.query) or None,
+        }
+
+        response = await main.dispatch_event(event, api)
+
+        body = response["body"] or ""
+        body = base64.b64decode(body) if response["isBase64Encoded"] else body.encode("utf-8")
+
+        # aiohttp sets the content type from its own argument, so it is taken out of the other headers.
+        headers = dict(response["headers"])
+        content_type = headers.pop("Content-Type", None)
+
+        return web.Response(status=response["statusCode"], headers=headers, body=body, content_type=content_type)
+
+    app = web.Application()
+    app.router.add_get("/{tail:.*}", handle)
+
+    return app
+
+
+if __name__ == "__main__":
+    filesystem = LocalFileSystem(os.environ.get("ARCHIVE_DATA_PATH", "."))
+    metadata_service = SQLiteMetadataService(os.environ.get("METADATA_SQLITE_PATH", ":memory:"))
+
+    web.run_app(create_app(api_controller.ApiController(filesystem, metadata_service)),
+                host=os.environ.get("HOST", "127.0.0.1"), port=int(os.environ.get("PORT", 8080)))
@@ -1,70 +1,179 @@
+import asyncio
+import base64
+import gzip
 import simplejson as json
 import os
 
-import aioboto3
-
-from src.common.filesystem import StubFileSystem, S3FileSystem
+from src.common.archiver_config import DynamoDBConfigSource
+from src.common.aws_clients import PersistentSession
+from src.common.filesystem import StubFileSystem, S3FileSystem, make_etag
 from src.common.lambda_context import local_lambda_invocation
 
 import api_controller
 import rest
 from src.common.metadata import StubMetadataService, DynamoDBMetadataService
+from src.common.metadata_cache import CachingMetadataService
+
+
+# Smaller bodies aren't worth the time to compress them.
+COMPRESSION_THRESHOLD = 1024
+
+# Everything used to handle a request is created when first needed and then reused by every invocation handled by this
+# instance, so that warm invocations don't pay for credential resolution, client creation and new connections again.
+# The query cache is also only useful if it outlives a single invocation.
+session = None
+cached_metadata_service = None
+controller = None
+
+
+def get_session():
+    global session
+
+    if session is None:
+        session = PersistentSession()
+
+    return session
+
+
+async def get_cursor_secret(session: PersistentSession):
+    # The secret is read when the instance starts rather than being set in the function's environment, where anyone
+    # allowed to read the function's configuration could see it.
+    async with session.client("secretsmanager") as secretsmanager:
+        response = await secretsmanager.get_secret_value(SecretId=os.environ.get("CURSOR_SECRET_ARN"))
 
+    return response["SecretString"].encode("utf-8")
+
+
+async def get_metadata_service(session: PersistentSession):
+    global cached_metadata_service
+
+    if cached_metadata_service is None:
+        metadata_table_name = os.environ.get("METADATA_TABLE_NAME")
+        config_table_name = os.environ.get("CONFIG_TABLE_NAME")
+        cursor_secret = await get_cursor_secret(session)
+
+        cached_metadata_service = CachingMetadataService(
+            DynamoDBMetadataService(session, metadata_table_name, cursor_secret),
+            ttl=int(os.environ.get("QUERY_CACHE_TTL", 300)),
+            max_entries=int(os.environ.get("QUERY_CACHE_MAX_ENTRIES", 1000)),
+            config_source=DynamoDBConfigSource(session, config_table_name) if config_table_name is not None else None
+        )
+
+    return cached_metadata_service
+
+
+async def get_api_controller(context):
+    global controller
 
-def get_api_controller(context):
     if context is local_lambda_invocation:
-        filesystem = StubFileSystem()
-        metadata_service = StubMetadataService()
-    else:
-        session = aioboto3.Session()
+        return api_controller.ApiController(StubFileSystem(), StubMetadataService())
 
+    if controller is None:
         bucket_name = os.environ.get("ARCHIVE_DATA_BUCKET")
-        metadata_table_name = os.environ.get("METADATA_TABLE_NAME")
 
-        filesystem = S3FileSystem(bucket_name)
-        metadata_service = DynamoDBMetadataService(session, metadata_table_name)
+        filesystem = S3FileSystem(bucket_name, get_session())
+        metadata_service = await get_metadata_service(get_session())
 
-    return api_controller.ApiController(filesystem, metadata_service)
+        author_post_type_indexes = os.environ.get("AUTHOR_POST_TYPE_INDEXES", "true") == "true"
 
+        controller = api_controller.ApiController(filesystem, metadata_service, author_post_type_indexes)
 
-def format_response(status_code, headers, content_type, body):
+    return controller
+
+
+def format_response(status_code, headers, content_type, body, request_headers=None):
+    request_headers = request_headers or {}
     is_binary = any(prefix in content_type for prefix in ["image", "video", "audio"])
 
-    return {
-        "statusCode": status_code,
-        "headers": {
-            "Content-Type": content_type,
-            "Access-Control-Allow-Headers": "*",
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "GET, HEAD, OPTIONS",
-            **headers
-        },
-        "isBase64Encoded": is_binary,
-        "body": body if is_binary else json.dumps(body)
+    headers = {
+        "Content-Type": content_type,
+        "Access-Control-Allow-Headers": "*",
+        "Access-Control-Allow-Origin": "*",
+        "Access-Control-Allow-Methods": "GET, HEAD, OPTIONS",
+        "Access-Control-Expose-Headers": "X-Next-Cursor, X-Next-Offset, ETag",
+        **headers
     }
 
+    if status_code == 304:
+        return {"statusCode": 304, "headers": headers, "isBase64Encoded": False, "body": ""}
+
+    if is_binary:
+        return {"statusCode": status_code, "headers": headers, "isBase64Encoded": True, "body": body}
+
+    if isinstance(body, rest.RawBody):
+        data, encoding = body.data, body.encoding
+
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+    else:
+        data, encoding = json.dumps(body).encode("utf-8"), None
+
+    accepts_gzip = "gzip" in request_headers.get("accept-encoding", "")
+
+    # Bodies are only compressed or decompressed when the client needs it, so stored data is otherwise sent unchanged.
+    compress = encoding is None and accepts_gzip and len(data) >= COMPRESSION_THRESHOLD
+    decompress = encoding == "gzip" and not accepts_gzip
+
+    # Responses without an entity tag from their source are tagged by their content, which still saves sending the body
+    # again to a client that already has it.
+    if status_code == 200:
+        headers.setdefault("ETag", make_etag(data))
+
+        # A body that is compressed or decompressed on the way out isn't byte for byte what the tag was made for, so
+        # the tag is only a weak one.
+        if (compress or decompress) and not headers["ETag"].startswith("W/"):
+            headers["ETag"] = f"W/{headers['ETag']}"
+
+        if rest.etag_matches(request_headers.get("if-none-match"), headers["ETag"]):
+            return {"statusCode": 304, "headers": headers, "isBase64Encoded": False, "body": ""}
+
+    headers["Vary"] = "Accept-Encoding"
+
+    if compress:
+        data, encoding = gzip.compress(data, compresslevel=6), "gzip"
+    elif decompress:
+        data, encoding = gzip.decompress(data), None
+
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+
+        return {
+            "statusCode": status_code,
+            "headers": headers,
+            "isBase64Encoded": True,
+            "body": base64.b64encode(data).decode("ascii")
+        }
+
+    return {"statusCode": status_code, "headers": headers, "isBase64Encoded": False, "body": data.decode("utf-8")}
+
+
+async def dispatch_event_to_api_controller(event, context):
+    return await dispatch_event(event, await get_api_controller(context))
+
 
-def dispatch_event_to_api_controller(event, context):
+async def dispatch_event(event, api: api_controller.ApiController):
     path = event.get("path")
+    request_headers = {name.lower(): value for name, value in (event.get("headers") or dict()).items()}
 
     if path.endswith("/"):
         path = path[:-1]
 
     if not rest.route_is_defined(path):
         return format_response(400,
+                               {},
                                "application/json",
                                {"message": f"No controller function defined to handle path '{path}'"})
 
-    api = get_api_controller(context)
     query_params = event.get("queryStringParameters") or dict()
 
-    (status, headers, content_type, body) = rest.dispatch(path, api, **query_params)
+    rest.request_headers.set(request_headers)
+    (status, headers, content_type, body) = await rest.dispatch(path, api, **query_params)
 
-    return format_response(status, headers, content_type, body)
+    return format_response(status, headers, content_type, body, request_headers)
 
 
 def handler(event, context):
-    return dispatch_event_to_api_controller(event, context)
+    return asyncio.get_event_loop().run_until_complete(dispatch_event_to_api_controller(event, context))
 
 
 if __name__ == "__main__":
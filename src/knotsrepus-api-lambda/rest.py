@@ -1,73 +1,200 @@
-import json
-import re
+import contextvars
 
-__ROUTES = dict()
+# The headers of the request being handled, with lowercase names.
+request_headers = contextvars.ContextVar("request_headers", default={})
 
 
-def route(path):
+class RawBody:
+    """A response body that is already encoded, such as JSON read from the archive, and is sent as it is.
+
+    `encoding` is the content coding the data is stored with, if any, such as "gzip".
+    """
+
+    def __init__(self, data: bytes, encoding: str = None):
+        self.data = data
+        self.encoding = encoding
+
+
+class InvalidParameter(Exception):
+    pass
+
+
+class Param:
+    """Declares the type, default, and allowed values of a path or query parameter of a route.
+
+    Parameters are parsed from their string values before the route's function is called, and requests with values
+    that can't be parsed or aren't allowed are rejected with a 400 response.
+    """
+
+    def __init__(self, type=str, default=None, choices=None, minimum=None, maximum=None):
+        if type not in [str, int, float, bool]:
+            raise ValueError(f"Parameters can't be of type {type.__name__}.")
+
+        self.type = type
+        self.default = default
+        self.choices = choices
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def parse(self, name, value: str):
+        if self.type is bool:
+            if value.lower() not in ["true", "false"]:
+                raise InvalidParameter(f"The {name} parameter must be either 'true' or 'false'.")
+
+            parsed = value.lower() == "true"
+        else:
+            try:
+                parsed = self.type(value)
+            except ValueError:
+                raise InvalidParameter(f"The {name} parameter must be a valid {self.type.__name__}.")
+
+        if self.choices is not None and parsed not in self.choices:
+            choices = ", ".join(f"'{choice}'" for choice in self.choices)
+            raise InvalidParameter(f"The {name} parameter must be one of {choices}.")
+
+        if self.minimum is not None and parsed < self.minimum:
+            raise InvalidParameter(f"The {name} parameter must be at least {self.minimum}.")
+
+        if self.maximum is not None and parsed > self.maximum:
+            raise InvalidParameter(f"The {name} parameter must be at most {self.maximum}.")
+
+        return parsed
+
+
+class Route:
+    def __init__(self, path, fn, params: dict, cache_control: str = None):
+        self.path = path
+        self.fn = fn
+        self.params = params
+        self.cache_control = cache_control
+
+    def parse_params(self, params: dict):
+        # Parameters that the route doesn't declare are passed through as strings.
+        parsed = dict(params)
+
+        for name, param in self.params.items():
+            if name in params:
+                parsed[name] = param.parse(name, params[name])
+            elif param.default is not None:
+                parsed[name] = param.default
+
+        return parsed
+
+
+class RouteNode:
+    """A node of the radix tree of routes, keyed by path segment.
+
+    Static segments are matched before parameters, so "/submission/batch" takes precedence over
+    "/submission/{submission_id}" without depending on the order that routes were declared in.
+    """
+
+    def __init__(self):
+        self.children = dict()
+        self.param_name = None
+        self.param_child = None
+        self.route = None
+
+    def insert(self, segments, route: Route):
+        node = self
+
+        for segment in segments:
+            if segment.startswith("{") and segment.endswith("}"):
+                name = segment[1:-1]
+
+                if node.param_child is None:
+                    node.param_name = name
+                    node.param_child = RouteNode()
+                elif node.param_name != name:
+                    raise ValueError(f"Route '{route.path}' names parameter '{name}', but a route with the same prefix "
+                                     f"names it '{node.param_name}'.")
+
+                node = node.param_child
+            else:
+                node = node.children.setdefault(segment, RouteNode())
+
+        if node.route is not None:
+            raise ValueError(f"Route '{route.path}' is defined more than once.")
+
+        node.route = route
+
+    def match(self, segments, index, path_params: dict):
+        if index == len(segments):
+            return self.route
+
+        segment = segments[index]
+
+        child = self.children.get(segment)
+        if child is not None:
+            route = child.match(segments, index + 1, path_params)
+            if route is not None:
+                return route
+
+        if self.param_child is not None and segment != "":
+            route = self.param_child.match(segments, index + 1, path_params)
+            if route is not None:
+                path_params[self.param_name] = segment
+                return route
+
+        return None
+
+
+__ROOT = RouteNode()
+
+
+def route(path, cache_control=None, **params: Param):
     def decorator(fn):
-        __ROUTES[path] = fn
+        __ROOT.insert(path.split("/")[1:], Route(path, fn, params, cache_control))
         return fn
     return decorator
 
 
 def route_is_defined(path):
-    fn, _ = match_route(path)
-    return fn is not None
+    route, _ = match_route(path)
+    return route is not None
+
+
+def match_route(path):
+    path_params = dict()
+    route = __ROOT.match(path.split("/")[1:], 0, path_params)
 
+    if route is None:
+        return None, None
 
-def dispatch(path, *args, **kwargs):
-    fn, path_params = match_route(path)
+    return route, path_params
+
+
+async def dispatch(path, *args, **kwargs):
+    route, path_params = match_route(path)
     kwargs.update(path_params)
-    kwargs = coerce_param_types(kwargs)
-    return fn(*args, **kwargs)
-
-
-def coerce_param_types(params: dict):
-    for key, value in params.items():
-        try:
-            value = int(value)
-            params[key] = value
-            continue
-        except ValueError:
-            # Okay as an attempt will be made to parse as a float or bool before continuing as a string.
-            pass
-
-        try:
-            value = float(value)
-            params[key] = value
-            continue
-        except ValueError:
-            # Okay as an attempt will be made to parse as a bool before continuing as a string.
-            pass
-
-        if value.lower() == "true":
-            params[key] = True
-        elif value.lower() == "false":
-            params[key] = False
-        else:
-            # Keep value as a string.
-            pass
 
-    return params
+    try:
+        kwargs = route.parse_params(kwargs)
+    except InvalidParameter as e:
+        return bad_request(str(e))
 
+    status, headers, content_type, body = await route.fn(*args, **kwargs)
 
-def match_route(path):
-    if path in __ROUTES:
-        return __ROUTES[path], {}
+    # Only successful responses may be cached, as errors can be temporary.
+    if route.cache_control is not None and status in [200, 301, 304]:
+        headers.setdefault("Cache-Control", route.cache_control)
 
-    def make_pattern(route):
-        return "^" + re.sub(r"{(\w+)}", r"(?P<\1>[^/]+)", route) + "$"
+    return status, headers, content_type, body
 
-    for key, value in __ROUTES.items():
-        match = re.match(make_pattern(key), path)
 
-        if match is None:
-            continue
+def get_request_header(name):
+    return request_headers.get().get(name.lower())
 
-        return value, match.groupdict()
 
-    return None, None
+def etag_matches(if_none_match, etag):
+    if if_none_match is None or etag is None:
+        return False
+
+    def strip_weakness(tag):
+        return tag[2:] if tag.startswith("W/") else tag
+
+    # Weak comparison is used for If-None-Match, so a weak tag matches a strong tag with the same value.
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or strip_weakness(etag) in [strip_weakness(tag) for tag in tags]
 
 
 def ok(body, content_type="application/json", headers=None):
@@ -76,9 +203,23 @@ def ok(body, content_type="application/json", headers=None):
     return 200, headers, content_type, body
 
 
+def not_modified(etag):
+    return 304, {"ETag": etag}, "application/json", None
+
+
+def raw(data: bytes, content_type="application/json", headers=None, encoding=None):
+    if headers is None:
+        headers = {}
+    return 200, headers, content_type, RawBody(data, encoding)
+
+
 def redirect(location):
     return 301, {"Location": location}, "application/json", None
 
 
+def bad_request(message):
+    return 400, {}, "application/json", {"error": message}
+
+
 def not_found():
-    return 404, {}, "application/json", json.dumps({"error": "Not Found"})
+    return 404, {}, "application/json", {"error": "Not Found"}
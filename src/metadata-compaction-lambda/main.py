@@ -0,0 +1,41 @@
+import asyncio
+import json
+import os
+
+from src.common import log_utils
+from src.common.filesystem import S3FileSystem, StubFileSystem
+from src.common.lambda_context import local_lambda_invocation
+from src.common.search_index import compact_search_index
+from src.common.statistics import compact_statistics, read_summary
+
+
+def handler(event, context):
+    logger = log_utils.get_logger("metadata-compaction-lambda")
+
+    if context is local_lambda_invocation:
+        filesystem = StubFileSystem()
+    else:
+        filesystem = S3FileSystem(os.environ.get("ARCHIVE_DATA_BUCKET"))
+
+    return asyncio.get_event_loop().run_until_complete(handle(filesystem, logger))
+
+
+async def handle(filesystem, logger):
+    logger.info("Compacting statistics and the search index...")
+
+    await asyncio.gather(compact_statistics(filesystem), compact_search_index(filesystem))
+    summary = await read_summary(filesystem)
+
+    return {
+        "statusCode": 200,
+        "body": json.dumps({
+            "submission_count": summary["submission_count"] if summary is not None else 0,
+        })
+    }
+
+
+if __name__ == "__main__":
+    with open("event.json", "r") as file:
+        event = json.load(file)
+
+    handler(event, local_lambda_invocation)
@@ -1,94 +1,249 @@
 import asyncio
 import json
 import os
-from datetime import datetime
 
 import aioboto3
 
 from src.common import log_utils
-from src.common.archiver_config import DynamoDBConfigSource, StubConfigSource, ArchiverConfigSource
-from src.common.filesystem import S3FileSystem, StubFileSystem, FileSystem
-from src.common.metadata import DynamoDBMetadataService, StubMetadataService, MetadataService
-
-
-def derive_post_type(flair_text: str):
-    flair_keywords = {
-        "dd": "dd",
-        "discussion": "discussion",
-        "opinion": "discussion",
-        "shitpost": "shitpost",
-        "meme": "shitpost",
-        "social media": "social_media",
-        "data": "data",
-        "hodl": "fluff",
-        "fluff": "fluff",
-        "news": "news",
-        "daily": "daily",
+from src.common.archiver_config import DynamoDBConfigSource, StubConfigSource, ArchiverConfigSource, \
+    MemoryConfigSource, CachedConfigSource
+from src.common.checkpoint import Checkpointer
+from src.common.filesystem import S3FileSystem, StubFileSystem, FileSystem, LocalFileSystem
+from src.common.metadata import DynamoDBMetadataService, StubMetadataService, MetadataService, SQLiteMetadataService, \
+    create_metadata
+from src.common.metadata_cache import CACHE_EPOCH_KEY, get_cache_epoch
+from src.common.partitioning import PARTITION_COUNT, get_id_order, get_listing_partition, get_listing_prefixes, \
+    get_worker_partitions
+from src.common.search_index import SearchIndexWriter
+from src.common.statistics import StatisticsWriter, compact_statistics
+
+BATCH_SIZE = 100
+CHECKPOINT_EVERY_ITEMS = 1000
+CHECKPOINT_EVERY_SECONDS = 30
+
+# How often workers check whether the first worker has finished resetting progress for a rebuild.
+REBUILD_POLL_SECONDS = 10
+
+# Bumped by every reset of progress, so that workers still running from before a reset can tell that the checkpoints
+# they read are out of date, and never save progress over the reset.
+CHECKPOINT_GENERATION_KEY = "metadata_checkpoint_generation"
+
+
+async def read_submission(filesystem: FileSystem, submission_id: str, logger):
+    data = await filesystem.read(f"{submission_id}/post.json")
+
+    if data is None:
+        logger.warning(f"No post.json found for '{submission_id}', skipping.")
+        return None
+
+    return json.loads(data)
+
+
+async def generate_batch(filesystem: FileSystem, metadata_service: MetadataService, index_writer: SearchIndexWriter,
+                         statistics_writer: StatisticsWriter, submission_ids, logger):
+    logger.info(f"Creating metadata for {len(submission_ids)} submissions from '{submission_ids[0]}'...")
+
+    # Reading the submissions concurrently is what makes rebuilds fast; the writes are then batched into as few
+    # requests as possible.
+    submissions = await asyncio.gather(
+        *(read_submission(filesystem, submission_id, logger) for submission_id in submission_ids)
+    )
+
+    items = [
+        create_metadata(submission_id, data)
+        for submission_id, data in zip(submission_ids, submissions)
+        if data is not None
+    ]
+
+    await metadata_service.put_many(items)
+
+    for submission_id, data in zip(submission_ids, submissions):
+        if data is not None:
+            index_writer.add(submission_id, data["created_utc"], data.get("title"), data.get("selftext"))
+
+    for item in items:
+        statistics_writer.add(str(get_listing_partition(item["submission_id"])), item)
+
+    return len(items)
+
+
+def get_checkpoint_key(partition: int):
+    return f"last_generated_metadata_{partition}"
+
+
+async def get_checkpoints(config_source: ArchiverConfigSource, partitions):
+    # Checkpoints written before generation was partitioned are stored under a single key, which is still a valid
+    # starting point for any partition that hasn't saved its own checkpoint yet.
+    legacy_checkpoint = await config_source.get_config("last_generated_metadata") or ""
+
+    return {
+        partition: await config_source.get_config(get_checkpoint_key(partition)) or legacy_checkpoint
+        for partition in partitions
     }
 
-    if flair_text is None:
-        return "unknown"
 
-    flair_text = flair_text.lower()
+async def list_prefixes(filesystem: FileSystem, prefixes, start_after="", end_at=None):
+    # Lists the submissions under the given prefixes whose ids sort lexicographically after `start_after`, and up to and
+    # including `end_at`.
+    for prefix in prefixes:
+        # Prefixes sorting entirely outside of the range have nothing to list.
+        if prefix < start_after[:len(prefix)] or (end_at is not None and prefix > end_at[:len(prefix)]):
+            continue
+
+        async for dir in filesystem.list_dirs(Prefix=prefix, StartAfter=f"{start_after}/" if start_after != "" else ""):
+            submission_id = dir.replace("/", "")
+
+            if end_at is not None and dir > f"{end_at}/":
+                break
+
+            # Prefixes starting with an underscore hold data derived from the archive, such as the search index.
+            if not submission_id.startswith("_"):
+                yield submission_id
+
+
+async def list_submissions(filesystem: FileSystem, prefixes, start_after: str):
+    # Submissions are processed in id order, so that a checkpoint covers every submission up to it. Ids are ordered by
+    # their length before their characters, but are listed in lexicographic order, so each length is listed in a pass
+    # of its own. Ids shorter than the checkpoint have all been processed already, and those of the same length sort
+    # lexicographically after it, so they are listed straight from it, finding the lengths of longer ids on the way.
+    lengths = set()
 
-    for keyword, post_type in flair_keywords.items():
-        if keyword in flair_text:
-            return post_type
+    async for submission_id in list_prefixes(filesystem, prefixes, start_after=start_after):
+        if len(submission_id) == len(start_after):
+            yield submission_id
+        elif len(submission_id) > len(start_after):
+            lengths.add(len(submission_id))
 
-    return "unknown"
+    # Longer ids can also sort lexicographically before the checkpoint, where only their lengths are needed.
+    if start_after != "":
+        async for submission_id in list_prefixes(filesystem, prefixes, end_at=start_after):
+            if len(submission_id) > len(start_after):
+                lengths.add(len(submission_id))
 
+    for length in sorted(lengths):
+        async for submission_id in list_prefixes(filesystem, prefixes):
+            if len(submission_id) == length:
+                yield submission_id
 
-async def main(config_source: ArchiverConfigSource, filesystem: FileSystem, metadata_service: MetadataService):
+
+async def get_checkpoint_generation(config_source: ArchiverConfigSource):
+    return int(await config_source.get_config(CHECKPOINT_GENERATION_KEY) or 0)
+
+
+async def reset_progress(config_source: ArchiverConfigSource, filesystem: FileSystem):
+    await config_source.put_config(
+        last_generated_metadata="",
+        **{get_checkpoint_key(partition): "" for partition in range(PARTITION_COUNT)},
+        **{CHECKPOINT_GENERATION_KEY: await get_checkpoint_generation(config_source) + 1}
+    )
+    await StatisticsWriter(filesystem).reset()
+
+
+async def main(config_source: ArchiverConfigSource, filesystem: FileSystem, metadata_service: MetadataService,
+               worker_index=0, worker_count=1):
     logger = log_utils.get_logger("metadata-generator")
-    logger.info("Building KNOTSREPUS archive metadata...")
+    logger.info(f"Building KNOTSREPUS archive metadata as worker {worker_index + 1} of {worker_count}...")
+
+    partitions = get_worker_partitions(worker_index, worker_count)
 
     command = await config_source.get_config("metadata_control_command")
-    if command == "rebuild":
+    if command == "rebuild" and worker_index == 0:
         logger.info("Metadata store rebuild was requested.")
-        last_generated_metadata = ""
+        # Only the first worker resets progress, for every partition, so that a worker never resets progress that
+        # another worker has already made.
+        await reset_progress(config_source, filesystem)
         await config_source.put_config(metadata_control_command="resume")
+    elif command == "rebuild":
+        logger.info("Metadata store rebuild was requested, waiting for worker 1 to reset progress...")
+
+        # Checkpoints can only be read once they have been reset, which the first worker does before resuming.
+        while await config_source.get_config("metadata_control_command") == "rebuild":
+            await asyncio.sleep(REBUILD_POLL_SECONDS)
+
+    generation = await get_checkpoint_generation(config_source)
+    checkpoints = await get_checkpoints(config_source, partitions)
+    start_after = min(checkpoints.values(), key=get_id_order)
+
+    if start_after == "":
+        logger.info(f"Metadata generation for partitions {partitions} starting from the beginning.")
     else:
-        last_generated_metadata = await config_source.get_config("last_generated_metadata") or ""
-        if last_generated_metadata == "":
-            logger.info("Metadata generation starting from the beginning.")
-        else:
-            logger.info(f"Metadata generation resuming from after submission '{last_generated_metadata}'.")
+        logger.info(f"Metadata generation for partitions {partitions} resuming from after submission '{start_after}'.")
+
+    # The search index and statistics are written to the archive before each checkpoint, so that resuming from a
+    # checkpoint never skips submissions that haven't been indexed or counted.
+    index_writer = SearchIndexWriter(filesystem)
+    statistics_writer = StatisticsWriter(filesystem)
 
+    async def flush_derived_data():
+        await asyncio.gather(index_writer.flush(), statistics_writer.flush())
+
+    async def is_current():
+        # Progress can be reset by another worker at any time, after which the checkpoints read above no longer apply.
+        return await get_checkpoint_generation(config_source) == generation
+
+    checkpointer = Checkpointer(config_source, CHECKPOINT_EVERY_ITEMS, CHECKPOINT_EVERY_SECONDS,
+                                before_flush=flush_derived_data, is_current=is_current)
     metadata_count = 0
+    batch = []
+    last_listed = None
+
+    async def save_progress(count):
+        # Every partition owned by this worker has been processed up to the last listed submission, including those
+        # that had no submissions in the batch. Query caches are invalidated along with each checkpoint, as the new
+        # metadata may change any listing.
+        await checkpointer.update(
+            count,
+            **{
+                get_checkpoint_key(partition): max(checkpoint, last_listed, key=get_id_order)
+                for partition, checkpoint in checkpoints.items()
+            },
+            **({CACHE_EPOCH_KEY: get_cache_epoch()} if count > 0 else {})
+        )
 
-    async for dir in filesystem.list_dirs(StartAfter=last_generated_metadata):
-        submission_id = dir.replace("/", "")
+    async def flush_batch():
+        nonlocal metadata_count
 
-        logger.info(f"Creating metadata for '{submission_id}'...")
+        metadata_count += await generate_batch(filesystem, metadata_service, index_writer, statistics_writer, batch,
+                                               logger)
 
-        data = json.loads(await filesystem.read(f"{submission_id}/post.json"))
+        # Only report progress once the batch has been written, so that the checkpoint never gets ahead of the
+        # metadata store.
+        await save_progress(len(batch))
+        batch.clear()
 
-        link_flair_text = data.get("link_flair_text")
-        post_type = derive_post_type(link_flair_text)
+    # A worker that owns every partition lists the whole archive in one go, rather than one prefix at a time.
+    prefixes = [""] if len(partitions) == PARTITION_COUNT else get_listing_prefixes(partitions)
 
-        metadata = {
-            "submission_id": submission_id,
-            "created_utc": data["created_utc"],
-            "author": data["author"],
-            "title": data["title"],
-            "score": data["score"],
-            "post_type": post_type,
-            "subreddit": data["subreddit"],
-            "last_updated": int(datetime.utcnow().timestamp()),
+    submissions = list_submissions(filesystem, prefixes, start_after)
 
-            # All metadata items need to have a column with a constant value that can be used as a partition key in a
-            # secondary index, to enable queries that order by score or creation time in reverse order without resorting
-            # to an expensive table scan.
-            "dummy": "dummy",
-        }
+    try:
+        async for submission_id in submissions:
+            last_listed = submission_id
 
-        await metadata_service.put(submission_id, metadata)
+            partition = get_listing_partition(submission_id)
+            if get_id_order(submission_id) <= get_id_order(checkpoints[partition]):
+                continue
 
-        last_generated_metadata = submission_id
+            batch.append(submission_id)
 
-        await config_source.put_config(last_generated_metadata=last_generated_metadata)
+            if len(batch) >= BATCH_SIZE:
+                await flush_batch()
 
-        metadata_count += 1
+            if checkpointer.is_stale:
+                break
+    finally:
+        await submissions.aclose()
+
+    if len(batch) > 0 and not checkpointer.is_stale:
+        await flush_batch()
+
+    if last_listed is not None:
+        await save_progress(0)
+
+    await checkpointer.flush()
+
+    if checkpointer.is_stale:
+        logger.warning("Progress was reset by another worker, stopping so that the rebuild can start over.")
 
     logger.info(f"Metadata generated for {metadata_count} submissions.")
 
@@ -97,21 +252,48 @@ if __name__ == "__main__":
     session = aioboto3.Session()
 
     config_table_name = os.environ.get("CONFIG_TABLE_NAME")
+    metadata_table_name = os.environ.get("METADATA_TABLE_NAME")
+    metadata_sqlite_path = os.environ.get("METADATA_SQLITE_PATH")
+
     if config_table_name is not None:
         config_source = DynamoDBConfigSource(session, config_table_name)
+    elif metadata_sqlite_path is not None:
+        # Bulk loading into SQLite always starts from the beginning of the archive; the writes are idempotent.
+        config_source = MemoryConfigSource()
     else:
         config_source = StubConfigSource()
 
-    metadata_table_name = os.environ.get("METADATA_TABLE_NAME")
+    # Checkpoints are already coalesced, so writes go straight through; old checkpoint versions are compacted on exit.
+    config_source = CachedConfigSource(config_source, flush_interval=0, uncached_keys=[CHECKPOINT_GENERATION_KEY])
+
     if metadata_table_name is not None:
         metadata_service = DynamoDBMetadataService(session, metadata_table_name)
+    elif metadata_sqlite_path is not None:
+        metadata_service = SQLiteMetadataService(metadata_sqlite_path)
     else:
         metadata_service = StubMetadataService()
 
     archive_data_bucket = os.environ.get("ARCHIVE_DATA_BUCKET")
+    archive_data_path = os.environ.get("ARCHIVE_DATA_PATH")
+
     if archive_data_bucket is not None:
         filesystem = S3FileSystem(archive_data_bucket)
+    elif archive_data_path is not None:
+        filesystem = LocalFileSystem(archive_data_path)
     else:
         filesystem = StubFileSystem()
 
-    asyncio.get_event_loop().run_until_complete(main(config_source, filesystem, metadata_service))
+    worker_index = int(os.environ.get("METADATA_WORKER_INDEX", 0))
+    worker_count = int(os.environ.get("METADATA_WORKER_COUNT", 1))
+
+    async def run():
+        try:
+            await main(config_source, filesystem, metadata_service, worker_index, worker_count)
+
+            # Archives on S3 have their statistics compacted by a scheduled job, which local archives don't have.
+            if archive_data_path is not None and archive_data_bucket is None:
+                await compact_statistics(filesystem)
+        finally:
+            await config_source.close()
+
+    asyncio.get_event_loop().run_until_complete(run())
@@ -0,0 +1,199 @@
+import asyncio
+import json
+import os
+from datetime import datetime
+
+import aioboto3
+from boto3.dynamodb.conditions import Key
+
+from src.common import log_utils, pushshift
+from src.common.archiver_config import DynamoDBConfigSource, StubConfigSource
+from src.common.filesystem import S3FileSystem, StubFileSystem
+from src.common.lambda_context import local_lambda_invocation
+from src.common.metadata import DynamoDBMetadataService, StubMetadataService, MetadataService, derive_post_type
+from src.common.metadata_cache import invalidate_query_caches
+from src.common.statistics import StatisticsWriter
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+WEEK = 7 * DAY
+
+# How often the refresh is scheduled to run.
+RUN_INTERVAL = HOUR
+
+# Submissions are refreshed more often while they are young, as that is when their scores change the most. Each tier is
+# a maximum age and how often submissions up to that age are refreshed; older submissions are no longer refreshed.
+REFRESH_TIERS = [
+    (DAY, HOUR),
+    (WEEK, DAY),
+    (4 * WEEK, WEEK),
+]
+
+# Pushshift returns at most 100 submissions per request.
+BATCH_SIZE = 100
+
+DEFAULT_REQUEST_BUDGET = 30
+
+
+def handler(event, context):
+    logger = log_utils.get_logger("metadata-refresh-lambda")
+
+    if context is local_lambda_invocation:
+        config_source = StubConfigSource()
+        filesystem = StubFileSystem()
+        metadata_service = StubMetadataService()
+    else:
+        session = aioboto3.Session()
+
+        config_source = DynamoDBConfigSource(session, os.environ.get("CONFIG_TABLE_NAME"))
+        filesystem = S3FileSystem(os.environ.get("ARCHIVE_DATA_BUCKET"))
+        metadata_service = DynamoDBMetadataService(session, os.environ.get("METADATA_TABLE_NAME"))
+
+    request_budget = int(os.environ.get("REFRESH_REQUEST_BUDGET", DEFAULT_REQUEST_BUDGET))
+    now = int(datetime.utcnow().timestamp())
+
+    return asyncio.get_event_loop().run_until_complete(
+        handle(config_source, filesystem, metadata_service, request_budget, now, logger)
+    )
+
+
+def get_due_windows(now: int):
+    # Rather than keeping track of when each submission was last refreshed, each tier is split into windows of creation
+    # time one run interval long, and every run refreshes the windows whose turn it is. Over one refresh interval every
+    # window in the tier gets a turn, and only submissions that are due ever need to be read.
+    run = now // RUN_INTERVAL
+    windows = []
+    min_age = 0
+
+    for max_age, interval in REFRESH_TIERS:
+        turns = interval // RUN_INTERVAL
+        start, end = now - max_age, now - min_age
+
+        for window in range(start // RUN_INTERVAL, end // RUN_INTERVAL + 1):
+            if window % turns != run % turns:
+                continue
+
+            window_start = max(window * RUN_INTERVAL, start)
+            window_end = min((window + 1) * RUN_INTERVAL, end)
+
+            if window_start >= window_end:
+                continue
+
+            # Adjacent windows are merged, so that a tier refreshed on every run is read with a single query.
+            if len(windows) > 0 and windows[-1][1] == window_start:
+                windows[-1] = (windows[-1][0], window_end)
+            else:
+                windows.append((window_start, window_end))
+
+        min_age = max_age
+
+    # The youngest submissions are refreshed first, in case the request budget runs out.
+    return sorted(windows, reverse=True)
+
+
+async def get_due_submissions(metadata_service: MetadataService, now: int, limit: int, logger):
+    items = []
+
+    for window_start, window_end in get_due_windows(now):
+        cursor = None
+
+        while True:
+            page, cursor = await metadata_service.query(
+                Key("dummy").eq("dummy") & Key("created_utc").between(window_start, window_end - 1),
+                sort="created_utc",
+                sort_order="desc",
+                cursor=cursor
+            )
+            items.extend(page)
+
+            if len(items) >= limit:
+                logger.warning(f"More than {limit} submissions are due to be refreshed, refreshing the youngest only.")
+                return items[:limit]
+
+            if cursor is None:
+                break
+
+    return items
+
+
+def get_changes(item: dict, submission: dict):
+    post_type = derive_post_type(submission.get("link_flair_text"))
+
+    changes = {
+        "score": submission["score"],
+        "post_type": post_type,
+        "author_post_type": f"{item['author']}#{post_type}",
+    }
+
+    return {key: value for key, value in changes.items() if item.get(key) != value}
+
+
+async def handle(config_source, filesystem, metadata_service, request_budget: int, now: int, logger):
+    items = await get_due_submissions(metadata_service, now, request_budget * BATCH_SIZE, logger)
+
+    logger.info(f"Refreshing {len(items)} submissions...")
+
+    batches = [items[i:i + BATCH_SIZE] for i in range(0, len(items), BATCH_SIZE)]
+    responses = await asyncio.gather(*(
+        pushshift.request("submission/search", ids=",".join(item["submission_id"] for item in batch))
+        for batch in batches
+    ), return_exceptions=True)
+
+    # A batch that fails is left for a later run, rather than losing the changes found by the rest.
+    refreshed_items = []
+    submissions = {}
+    failed_batches = 0
+
+    for batch, response in zip(batches, responses):
+        if isinstance(response, Exception):
+            logger.warning(f"Refreshing a batch of {len(batch)} submissions failed, skipping it.", exc_info=response)
+            failed_batches += 1
+            continue
+
+        refreshed_items.extend(batch)
+        submissions.update((submission["id"], submission) for submission in response)
+
+    statistics_writer = StatisticsWriter(filesystem)
+    updated_items = []
+
+    for item in refreshed_items:
+        submission = submissions.get(item["submission_id"])
+
+        # Submissions can disappear from Pushshift, in which case the archived metadata is kept as it is.
+        if submission is None:
+            continue
+
+        changes = get_changes(item, submission)
+        if len(changes) == 0:
+            continue
+
+        updated_item = {**item, **changes, "last_updated": now}
+        updated_items.append(updated_item)
+        statistics_writer.update(item, updated_item)
+
+    # Only the submissions that have changed are written.
+    await metadata_service.put_many(updated_items)
+    await statistics_writer.flush()
+
+    if len(updated_items) > 0:
+        await invalidate_query_caches(config_source)
+
+    logger.info(f"Refreshed {len(refreshed_items)} submissions using {len(batches)} requests, {failed_batches} of "
+                f"which failed, {len(updated_items)} changed.")
+
+    return {
+        "statusCode": 200,
+        "body": json.dumps({
+            "refreshed": len(refreshed_items),
+            "changed": len(updated_items),
+            "requests": len(batches),
+            "failed_requests": failed_batches,
+        })
+    }
+
+
+if __name__ == "__main__":
+    with open("event.json", "r") as file:
+        event = json.load(file)
+
+    handler(event, local_lambda_invocation)
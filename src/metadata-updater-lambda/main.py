@@ -0,0 +1,98 @@
+import asyncio
+import json
+import os
+from datetime import datetime
+
+import aioboto3
+
+from src.common import log_utils
+from src.common.archiver_config import DynamoDBConfigSource, StubConfigSource
+from src.common.filesystem import S3FileSystem, StubFileSystem
+from src.common.lambda_context import local_lambda_invocation
+from src.common.metadata import DynamoDBMetadataService, StubMetadataService, create_metadata
+from src.common.metadata_cache import invalidate_query_caches
+from src.common.search_index import SearchIndexWriter
+from src.common.statistics import StatisticsWriter
+
+
+def handler(event, context):
+    logger = log_utils.get_logger("metadata-updater-lambda")
+    submission_ids = [record["body"] for record in event["Records"]]
+
+    if context is local_lambda_invocation:
+        config_source = StubConfigSource()
+        filesystem = StubFileSystem()
+        metadata_service = StubMetadataService()
+    else:
+        session = aioboto3.Session()
+
+        config_source = DynamoDBConfigSource(session, os.environ.get("CONFIG_TABLE_NAME"))
+        filesystem = S3FileSystem(os.environ.get("ARCHIVE_DATA_BUCKET"))
+        metadata_service = DynamoDBMetadataService(session, os.environ.get("METADATA_TABLE_NAME"))
+
+    return asyncio.get_event_loop().run_until_complete(
+        handle(submission_ids, config_source, filesystem, metadata_service, logger)
+    )
+
+
+async def read_submission(filesystem, submission_id, logger):
+    data = await filesystem.read(f"{submission_id}/post.json")
+
+    if data is None:
+        logger.warning(f"No post.json found for '{submission_id}', skipping.")
+        return None
+
+    return json.loads(data)
+
+
+async def handle(submission_ids, config_source, filesystem, metadata_service, logger):
+    # The same submission can be archived more than once in quick succession, and only needs updating once.
+    submission_ids = list(dict.fromkeys(submission_ids))
+
+    logger.info(f"Updating metadata for {len(submission_ids)} submissions...")
+
+    submissions = await asyncio.gather(
+        *(read_submission(filesystem, submission_id, logger) for submission_id in submission_ids)
+    )
+
+    items = [
+        create_metadata(submission_id, data)
+        for submission_id, data in zip(submission_ids, submissions)
+        if data is not None
+    ]
+
+    # The existing metadata is needed to replace whatever was counted for it in the statistics.
+    old_items = await asyncio.gather(*(metadata_service.get(item["submission_id"]) for item in items))
+
+    await metadata_service.put_many(items)
+
+    # Each batch only writes new search index runs and a statistics delta, which are compacted by a scheduled job, so
+    # batches never read back what other batches have written and can be processed concurrently.
+    index_writer = SearchIndexWriter(filesystem, compact=False)
+    statistics_writer = StatisticsWriter(filesystem)
+
+    for item, data in zip(items, [data for data in submissions if data is not None]):
+        index_writer.add(item["submission_id"], item["created_utc"], data.get("title"), data.get("selftext"))
+
+    for old_item, item in zip(old_items, items):
+        statistics_writer.update(old_item, item)
+
+    await asyncio.gather(index_writer.flush(), statistics_writer.flush())
+
+    if len(items) > 0:
+        await invalidate_query_caches(config_source)
+
+    return {
+        "statusCode": 200,
+        "body": json.dumps({
+            "submission_ids": [item["submission_id"] for item in items],
+            "last_updated": datetime.utcnow().timestamp()
+        })
+    }
+
+
+if __name__ == "__main__":
+    with open("event.json", "r") as file:
+        event = json.load(file)
+
+    handler(event, local_lambda_invocation)
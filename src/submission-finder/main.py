@@ -1,20 +1,116 @@
 import asyncio
 import os
+import signal
+import time
 from datetime import datetime
 
 import aioboto3
 
-from src.common import log_utils, pushshift
-from src.common.archiver_config import DynamoDBConfigSource, StubConfigSource, ArchiverConfigSource
+from src.common import log_utils, metrics, pushshift
+from src.common.archiver_config import DynamoDBConfigSource, StubConfigSource, ArchiverConfigSource, \
+    CachedConfigSource
+from src.common.bloom_filter import ArchivedSubmissionFilter, DEFAULT_CAPACITY, DEFAULT_FALSE_POSITIVE_RATE
+from src.common.filesystem import FileSystem, S3FileSystem
 from src.common.messaging import SNSMessagingService, StubMessagingService, MessagingService
+from src.common.metadata import MetadataService, DynamoDBMetadataService
 
 
-async def main(config_source: ArchiverConfigSource, messaging_service: MessagingService):
+async def get_archive_filter(config_source: ArchiverConfigSource, filesystem: FileSystem,
+                             metadata_service: MetadataService, logger):
+    archive_filter = ArchivedSubmissionFilter(
+        filesystem,
+        int(await config_source.get_config("archive_filter_capacity") or DEFAULT_CAPACITY),
+        float(await config_source.get_config("archive_filter_false_positive_rate") or DEFAULT_FALSE_POSITIVE_RATE)
+    )
+
+    await archive_filter.load_unarchived()
+
+    command = await config_source.get_config("archive_filter_command")
+    if command == "rebuild":
+        logger.info("Archived submission filter rebuild was requested.")
+    elif await archive_filter.load():
+        return archive_filter
+
+    await archive_filter.rebuild(metadata_service)
+    await config_source.put_config(archive_filter_command="resume")
+
+    return archive_filter
+
+
+class AdaptivePollInterval:
+    """Decides how long to wait between polls for new submissions when streaming.
+
+    The arrival rate of submissions is tracked as an exponentially weighted average over recent polls, and the interval
+    is chosen so that each poll finds about `target_per_poll` new submissions: polls are frequent during bursts, and
+    back off towards `max_interval` when it is quiet.
+    """
+
+    def __init__(self, min_interval=5.0, max_interval=120.0, target_per_poll=5, smoothing=0.3, clock=time.monotonic):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target_per_poll = target_per_poll
+        self.smoothing = smoothing
+        self.clock = clock
+
+        self.rate = 0.0
+        self.last_polled = None
+
+    def update(self, submission_count: int):
+        now = self.clock()
+
+        if self.last_polled is not None and now > self.last_polled:
+            observed_rate = submission_count / (now - self.last_polled)
+            self.rate = self.smoothing * observed_rate + (1 - self.smoothing) * self.rate
+
+        self.last_polled = now
+
+    @property
+    def interval(self):
+        if self.rate <= 0:
+            return self.max_interval
+
+        return min(self.max_interval, max(self.min_interval, self.target_per_poll / self.rate))
+
+
+async def wait(stopping: asyncio.Event, timeout: float):
+    # Returns as soon as shutdown is requested, rather than finishing the wait.
+    try:
+        await asyncio.wait_for(stopping.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def main(config_source: ArchiverConfigSource, messaging_service: MessagingService, filesystem: FileSystem = None,
+               metadata_service: MetadataService = None, stopping: asyncio.Event = None,
+               poll_interval: AdaptivePollInterval = None):
+    """Publishes every submission created since the last run.
+
+    If `stopping` is given, the finder keeps polling for new submissions until it is set, rather than returning once it
+    has caught up.
+    """
+
     logger = log_utils.get_logger("submission-finder")
     logger.info("Retrieving /r/superstonk submissions...")
 
     after_utc = int(await config_source.get_config("after_utc") or 0)
     submission_count = 0
+    skipped_count = 0
+
+    # Submissions that have already been archived are skipped, as archiving them again wastes the work of every
+    # archiver. The filter can be bypassed to archive everything again.
+    archive_filter = None
+    if filesystem is not None:
+        archive_filter = await get_archive_filter(config_source, filesystem, metadata_service, logger)
+
+        # Submissions published on earlier runs may have been archived since.
+        await archive_filter.add_archived(metadata_service)
+
+    force = str(await config_source.get_config("archive_filter_force")).lower() == "true"
+    if force:
+        logger.info("Publishing every submission, including those already archived.")
+
+    if stopping is not None and poll_interval is None:
+        poll_interval = AdaptivePollInterval()
 
     while True:
         logger.info("Requesting submissions after %s...",
@@ -27,19 +123,59 @@ async def main(config_source: ArchiverConfigSource, messaging_service: Messaging
         )
 
         if len(chunk) == 0:
-            logger.info(f"{submission_count} submissions retrieved.")
-            break
+            logger.info(f"{submission_count} submissions retrieved, {skipped_count} already archived.")
+
+            # By the time the finder has caught up, the archivers have had time to archive what it published before.
+            if archive_filter is not None:
+                await archive_filter.add_archived(metadata_service)
+
+            if stopping is None or stopping.is_set():
+                break
+
+            # Every submission found since the last time the finder caught up counts towards the arrival rate.
+            poll_interval.update(submission_count)
+            submission_count = 0
+            skipped_count = 0
+
+            await wait(stopping, poll_interval.interval)
+
+            if stopping.is_set():
+                break
+
+            continue
 
         last = chunk[-1]
         after_utc = last["created_utc"]
 
         submission_count += len(chunk)
 
-        for submission in chunk:
-            await messaging_service.send_message(submission["id"])
+        submissions = chunk
+        if archive_filter is not None and not force:
+            submissions = [submission for submission in chunk if not archive_filter.contains(submission["id"])]
+            skipped_count += len(chunk) - len(submissions)
+
+        submission_ids = [submission["id"] for submission in submissions]
+        await messaging_service.send_messages(submission_ids)
+
+        # Discovery lag is how long a submission existed before it was sent for archival.
+        if len(submissions) > 0:
+            published_utc = time.time()
+            metrics.put_metric("DiscoveryLag",
+                               [published_utc - submission["created_utc"] for submission in submissions],
+                               unit="Seconds", dimensions={"Service": "submission-finder"})
+
+        if archive_filter is not None:
+            archive_filter.add_published(submission_ids)
 
         await config_source.put_config(after_utc=after_utc)
 
+        if stopping is not None and stopping.is_set():
+            logger.info("Stopping after the current chunk.")
+            break
+
+    if archive_filter is not None:
+        await archive_filter.save()
+
 
 if __name__ == "__main__":
     session = aioboto3.Session()
@@ -50,10 +186,44 @@ if __name__ == "__main__":
     else:
         config_source = StubConfigSource()
 
+    # Progress is saved after every chunk, which only needs to be persisted every so often. Anything not yet persisted
+    # if the task dies is requested again on the next run, and archiving a submission again is harmless.
+    config_source = CachedConfigSource(config_source)
+
     topic_arn = os.environ.get("ARCHIVAL_REQUESTED_TOPIC_ARN")
     if topic_arn is not None:
         messaging_service = SNSMessagingService(session, topic_arn)
     else:
         messaging_service = StubMessagingService()
 
-    asyncio.get_event_loop().run_until_complete(main(config_source, messaging_service))
+    bucket_name = os.environ.get("ARCHIVE_DATA_BUCKET")
+    metadata_table_name = os.environ.get("METADATA_TABLE_NAME")
+
+    # Without access to the archive, there is nothing to check submissions against, so every submission is published.
+    if bucket_name is not None and metadata_table_name is not None:
+        filesystem = S3FileSystem(bucket_name)
+        metadata_service = DynamoDBMetadataService(session, metadata_table_name)
+    else:
+        filesystem = None
+        metadata_service = None
+
+    # In streaming mode, the finder runs until the task is stopped instead of exiting once it has caught up. ECS sends
+    # SIGTERM to stop the task, after which progress is saved before exiting.
+    streaming = os.environ.get("SUBMISSION_FINDER_MODE") == "stream"
+
+    async def run():
+        stopping = None
+
+        if streaming:
+            stopping = asyncio.Event()
+
+            loop = asyncio.get_event_loop()
+            for signal_number in (signal.SIGTERM, signal.SIGINT):
+                loop.add_signal_handler(signal_number, stopping.set)
+
+        try:
+            await main(config_source, messaging_service, filesystem, metadata_service, stopping)
+        finally:
+            await config_source.close()
+
+    asyncio.get_event_loop().run_until_complete(run())
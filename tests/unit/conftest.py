@@ -0,0 +1,123 @@
+import asyncio
+import importlib.util
+import os
+import sys
+from contextlib import asynccontextmanager
+
+import pytest
+
+from src.common.archiver_config import MemoryConfigSource
+
+SRC_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "src")
+
+
+def load_lambda(name: str, directory: str):
+    # Every Lambda's handler is a main.py in a directory whose name can't be imported, so each one is loaded under a
+    # name of its own. It is registered under that name so that functions from it can be pickled by worker processes.
+    if name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(SRC_PATH, directory, "main.py"))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+
+    return sys.modules[name]
+
+
+@pytest.fixture(scope="session")
+def submission_finder():
+    return load_lambda("submission_finder", "submission-finder")
+
+
+@pytest.fixture(scope="session")
+def metadata_generator():
+    return load_lambda("metadata_generator", "metadata-generator")
+
+
+@pytest.fixture(scope="session")
+def metadata_updater():
+    return load_lambda("metadata_updater", "metadata-updater-lambda")
+
+
+@pytest.fixture(scope="session")
+def metadata_refresh():
+    return load_lambda("metadata_refresh", "metadata-refresh-lambda")
+
+
+@pytest.fixture(scope="session")
+def metadata_compaction():
+    return load_lambda("metadata_compaction", "metadata-compaction-lambda")
+
+
+@pytest.fixture
+def run():
+    # Every coroutine of a test runs on the same loop, which is closed along with anything left running on it once the
+    # test is done.
+    loop = asyncio.new_event_loop()
+
+    yield loop.run_until_complete
+
+    loop.run_until_complete(loop.shutdown_asyncgens())
+    loop.close()
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+class RecordingConfigSource(MemoryConfigSource):
+    def __init__(self, **config):
+        super().__init__(**config)
+        self.gets = 0
+        self.puts = []
+        self.compacted = None
+
+    async def get_config(self, key: str):
+        self.gets += 1
+        return await super().get_config(key)
+
+    async def put_config(self, **kwargs):
+        self.puts.append(kwargs)
+        await super().put_config(**kwargs)
+
+    async def compact(self, keys, keep: int):
+        self.compacted = (sorted(keys), keep)
+
+
+@pytest.fixture
+def config_source():
+    return RecordingConfigSource()
+
+
+class FakeDynamoDB:
+    def __init__(self, table):
+        self.table = table
+
+    async def Table(self, name):
+        return self.table
+
+
+class FakeDynamoDBSession:
+    # Serves the same table whatever it is asked for, which is set by the test.
+    def __init__(self):
+        self.table = None
+
+    @asynccontextmanager
+    async def resource(self, service_name):
+        yield FakeDynamoDB(self.table)
+
+
+@pytest.fixture
+def dynamodb_session():
+    return FakeDynamoDBSession()
@@ -0,0 +1,220 @@
+import asyncio
+import base64
+import gzip
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "src", "knotsrepus-api-lambda"))
+
+import api_controller  # noqa: E402
+import main  # noqa: E402
+import rest  # noqa: E402
+from src.common import comment_index  # noqa: E402
+from src.common.filesystem import LocalFileSystem  # noqa: E402
+from src.common.metadata import SQLiteMetadataService, PUBLIC_FIELDS, create_metadata  # noqa: E402
+
+
+class SlowFileSystem(LocalFileSystem):
+    def __init__(self, root):
+        super().__init__(root)
+        self.reads = []
+        self.active = 0
+        self.max_active = 0
+
+    async def read(self, path):
+        self.reads.append(path)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+
+        await asyncio.sleep(0.01)
+        self.active -= 1
+
+        return await super().read(path)
+
+
+def request(run, api, path, **query_params):
+    return run(rest.dispatch(path, api, **query_params))
+
+
+def archive(root, submission_id, comment_count=None):
+    (root / submission_id).mkdir()
+    (root / submission_id / "post.json").write_text(json.dumps({"id": submission_id}))
+
+    if comment_count is not None:
+        (root / submission_id / "comments.json").write_text(json.dumps([{}] * comment_count))
+
+
+def test_batch_returns_submissions_in_request_order_with_errors(tmp_path, run):
+    archive(tmp_path, "aaa", comment_count=3)
+    archive(tmp_path, "bbb")
+    filesystem = SlowFileSystem(str(tmp_path))
+    api = api_controller.ApiController(filesystem, SQLiteMetadataService())
+
+    status, _, _, body = request(run, api, "/submission/batch", ids="bbb,missing,aaa,../x,aaa", include="comment_count")
+
+    assert status == 200
+    assert body == [
+        {"submission_id": "bbb", "post": {"id": "bbb"}, "comment_count": None},
+        {"submission_id": "missing", "error": "Not Found"},
+        {"submission_id": "aaa", "post": {"id": "aaa"}, "comment_count": 3},
+        {"submission_id": "../x", "error": "Invalid submission id"},
+        {"submission_id": "aaa", "post": {"id": "aaa"}, "comment_count": 3},
+    ]
+
+    # Every submission is read once, and all of them are read at the same time.
+    assert len([path for path in filesystem.reads if path.endswith("/comments/version") is False]) == 6
+    assert filesystem.max_active == 6
+
+
+def test_batch_counts_indexed_comments_without_reading_them(tmp_path, run):
+    archive(tmp_path, "aaa", comment_count=3)
+    filesystem = SlowFileSystem(str(tmp_path))
+    run(comment_index.write_comment_index(filesystem, "aaa", [{"id": f"c{i}", "created_utc": i} for i in range(5)]))
+    api = api_controller.ApiController(filesystem, SQLiteMetadataService())
+
+    status, _, _, body = request(run, api, "/submission/batch", ids="aaa", include="comment_count")
+
+    assert status == 200
+    assert body == [{"submission_id": "aaa", "post": {"id": "aaa"}, "comment_count": 5}]
+    assert [path for path in filesystem.reads if path.endswith("/comments/version") is False] == ["aaa/post.json"]
+
+
+def test_batch_rejects_invalid_requests(tmp_path, run):
+    api = api_controller.ApiController(LocalFileSystem(str(tmp_path)), SQLiteMetadataService())
+
+    assert request(run, api, "/submission/batch")[0] == 400
+    assert request(run, api, "/submission/batch", ids=",".join(f"s{i}" for i in range(101)))[0] == 400
+    assert request(run, api, "/submission/batch", ids="aaa", include="comments")[0] == 400
+
+
+class TaggedFileSystem(LocalFileSystem):
+    # Stands in for S3, which can return an object's ETag without reading the object.
+    def __init__(self, root):
+        super().__init__(root)
+        self.reads = 0
+
+    async def read_with_etag(self, path):
+        self.reads += 1
+        data = await self.read(path)
+        return (data, '"v1"') if data is not None else (None, None)
+
+    async def get_etag(self, path):
+        return '"v1"' if await self.read(path) is not None else None
+
+
+def test_unchanged_submissions_are_not_read_again(tmp_path, run):
+    archive(tmp_path, "aaa")
+    filesystem = TaggedFileSystem(str(tmp_path))
+    api = api_controller.ApiController(filesystem, SQLiteMetadataService())
+
+    status, headers, _, body = request(run, api, "/submission/aaa")
+    assert status == 200
+    assert json.loads(body.data) == {"id": "aaa"}
+    assert headers == {"ETag": '"v1"', "Cache-Control": api_controller.ARCHIVE_CACHE_CONTROL}
+
+    async def request_if_none_match(etag):
+        rest.request_headers.set({"if-none-match": etag})
+        return await rest.dispatch("/submission/aaa", api)
+
+    status, headers, _, body = run(request_if_none_match('"v1"'))
+    assert (status, headers["ETag"], body) == (304, '"v1"', None)
+    assert filesystem.reads == 1
+
+    status, _, _, _ = run(request_if_none_match('"v0"'))
+    assert status == 200
+    assert filesystem.reads == 2
+
+
+def test_large_responses_are_compressed_when_accepted():
+    body = [{"id": f"s{i}", "title": "A submission"} for i in range(100)]
+
+    response = main.format_response(200, {}, "application/json", body, {"accept-encoding": "gzip, deflate"})
+    assert response["headers"]["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(base64.b64decode(response["body"]))) == body
+
+    # The tag is made for the uncompressed body, so a compressed one only carries a weak version of it.
+    compressed_etag = response["headers"]["ETag"]
+    response = main.format_response(200, {}, "application/json", body, {})
+    assert compressed_etag == f"W/{response['headers']['ETag']}"
+
+    response = main.format_response(200, {}, "application/json", body, {"accept-encoding": "gzip",
+                                                                          "if-none-match": compressed_etag})
+    assert (response["statusCode"], response["headers"]["ETag"]) == (304, compressed_etag)
+
+    response = main.format_response(200, {}, "application/json", body[:1], {"accept-encoding": "gzip"})
+    assert "Content-Encoding" not in response["headers"]
+    assert not response["headers"]["ETag"].startswith("W/")
+
+    # Responses are tagged by their content when their source has no tag of its own.
+    etag = response["headers"]["ETag"]
+    response = main.format_response(200, {}, "application/json", body[:1], {"if-none-match": etag})
+    assert (response["statusCode"], response["body"]) == (304, "")
+
+
+def test_stored_json_is_sent_unchanged():
+    stored = b'{"id":  "aaa", "title": "\\u00e9"}'
+
+    response = main.format_response(*rest.raw(stored), {})
+    assert response["body"] == stored.decode("utf-8")
+
+    # Data stored compressed is only decompressed for clients that can't accept it as it is.
+    compressed = gzip.compress(stored)
+    response = main.format_response(*rest.raw(compressed, encoding="gzip"), {"accept-encoding": "gzip"})
+    assert base64.b64decode(response["body"]) == compressed
+
+    response = main.format_response(*rest.raw(compressed, encoding="gzip", headers={"ETag": '"v1"'}), {})
+    assert response["body"] == stored.decode("utf-8")
+    assert "Content-Encoding" not in response["headers"]
+    assert response["headers"]["ETag"] == 'W/"v1"'
+
+
+def test_listings_only_return_public_fields(tmp_path, run):
+    metadata_service = SQLiteMetadataService()
+    run(metadata_service.put_many([
+        create_metadata(f"p{i:03d}", {
+            "created_utc": 1630450800 + i,
+            "author": "VoxUmbra",
+            "title": f"Submission {i}",
+            "score": i,
+            "subreddit": "Superstonk",
+        })
+        for i in range(3)
+    ]))
+    api = api_controller.ApiController(LocalFileSystem(str(tmp_path)), metadata_service)
+
+    _, _, _, body = request(run, api, "/submission")
+    assert [set(item.keys()) for item in body] == [set(PUBLIC_FIELDS)] * 3
+
+    _, _, _, body = request(run, api, "/submission", fields="submission_id,score", sort="score", sort_order="desc")
+    assert body == [{"submission_id": f"p{i:03d}", "score": i} for i in [2, 1, 0]]
+
+    assert request(run, api, "/submission", fields="dummy")[0] == 400
+
+
+def test_author_post_type_listings_filter_until_items_are_backfilled(tmp_path, run):
+    # Items written before the author and post type indexes existed don't have the attribute they are keyed on.
+    items = [
+        create_metadata(f"p{i:03d}", {
+            "created_utc": 1630450800 + i,
+            "author": "VoxUmbra",
+            "title": f"Submission {i}",
+            "score": i,
+            "subreddit": "Superstonk",
+            "link_flair_text": "DD" if i % 2 == 0 else "Discussion",
+        })
+        for i in range(6)
+    ]
+    for item in items:
+        del item["author_post_type"]
+
+    metadata_service = SQLiteMetadataService()
+    run(metadata_service.put_many(items))
+
+    api = api_controller.ApiController(LocalFileSystem(str(tmp_path)), metadata_service, author_post_type_indexes=False)
+    _, _, _, body = request(run, api, "/submission", author="VoxUmbra", post_type="dd")
+    assert [item["submission_id"] for item in body] == ["p000", "p002", "p004"]
+
+    api = api_controller.ApiController(LocalFileSystem(str(tmp_path)), metadata_service)
+    _, _, _, body = request(run, api, "/submission", author="VoxUmbra", post_type="dd")
+    assert body == []
@@ -0,0 +1,66 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "src", "knotsrepus-api-lambda"))
+
+import api_controller  # noqa: E402
+import main  # noqa: E402
+import rest  # noqa: E402
+from src.common.filesystem import LocalFileSystem  # noqa: E402
+from src.common.lambda_context import local_lambda_invocation  # noqa: E402
+from src.common.metadata import SQLiteMetadataService  # noqa: E402
+
+
+def request(path, **query_params):
+    return main.handler({"path": path, "queryStringParameters": query_params}, local_lambda_invocation)
+
+
+def test_routes_match_static_segments_before_parameters():
+    route, path_params = rest.match_route("/submission/abc123/media/image.png")
+    assert route.fn.__name__ == "get_media_object"
+    assert path_params == {"submission_id": "abc123", "filename": "image.png"}
+
+    route, path_params = rest.match_route("/stats/authors")
+    assert route.fn.__name__ == "get_top_authors"
+    assert path_params == {}
+
+    assert not rest.route_is_defined("/submission/abc123/unknown")
+    assert not rest.route_is_defined("/submission//media")
+
+
+def test_parameters_are_parsed_by_their_declared_type():
+    param = rest.Param(int, default=100, minimum=1)
+    assert param.parse("count", "5") == 5
+
+    # Path parameters are strings unless declared otherwise, so numeric usernames aren't coerced.
+    response = request("/stats/authors/123")
+    assert response["statusCode"] == 404
+    assert json.loads(response["body"]) == {"error": "Not Found"}
+
+
+def test_invalid_parameters_are_rejected():
+    for query_params in [{"count": "many"}, {"count": "0"}, {"sort": "title"}]:
+        response = request("/stats/authors", **query_params)
+
+        assert response["statusCode"] == 400
+        assert "parameter" in json.loads(response["body"])["error"]
+
+    response = request("/submission/abc123/media", details="maybe")
+    assert response["statusCode"] == 400
+
+    response = request("/unknown")
+    assert response["statusCode"] == 400
+    assert response["headers"]["Content-Type"] == "application/json"
+
+
+def test_media_without_a_manifest_is_listed_from_the_archive(tmp_path, run):
+    for name in ["post.json", "image.png", "video.mp4"]:
+        (tmp_path / "abc123").mkdir(exist_ok=True)
+        (tmp_path / "abc123" / name).write_text("data")
+
+    api = api_controller.ApiController(LocalFileSystem(str(tmp_path)), SQLiteMetadataService())
+    status, _, _, body = run(rest.dispatch("/submission/abc123/media", api, details="false"))
+
+    assert status == 200
+    assert body == ["image.png", "video.mp4"]
@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+from botocore.exceptions import EndpointConnectionError
+
+from src.common.aws_clients import PersistentSession
+
+
+class FakeClient:
+    def __init__(self):
+        self.closed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.closed = True
+
+
+class FakeSession:
+    def __init__(self):
+        self.clients = []
+
+    def client(self, service_name, **kwargs):
+        self.clients.append(FakeClient())
+        return self.clients[-1]
+
+
+def test_clients_are_reused_until_they_fail_or_the_loop_changes(run):
+    session = FakeSession()
+    persistent_session = PersistentSession(session)
+
+    async def use_client(fail=False):
+        async with persistent_session.client("s3") as s3:
+            if fail:
+                raise EndpointConnectionError(endpoint_url="http://localhost")
+            return s3
+
+    async def use_clients():
+        return await asyncio.gather(*(use_client() for _ in range(10)))
+
+    clients = run(use_clients())
+    assert len(session.clients) == 1
+    assert all(client is session.clients[0] for client in clients)
+
+    with pytest.raises(EndpointConnectionError):
+        run(use_client(fail=True))
+    assert session.clients[0].closed
+
+    assert run(use_client()) is session.clients[1]
+
+    # A client opened on one event loop can't be used from another.
+    other_loop = asyncio.new_event_loop()
+    try:
+        assert other_loop.run_until_complete(use_client()) is session.clients[2]
+    finally:
+        other_loop.close()
+    assert len(session.clients) == 3
+
+
+def test_clients_that_fail_are_only_closed_once_calls_using_them_finish(run):
+    session = FakeSession()
+    persistent_session = PersistentSession(session)
+    release = asyncio.Event()
+
+    async def slow_call():
+        async with persistent_session.client("s3") as s3:
+            await release.wait()
+            assert not s3.closed
+            return s3
+
+    async def failing_call():
+        async with persistent_session.client("s3"):
+            raise EndpointConnectionError(endpoint_url="http://localhost")
+
+    async def calls():
+        slow = asyncio.ensure_future(slow_call())
+        await asyncio.sleep(0)
+
+        with pytest.raises(EndpointConnectionError):
+            await failing_call()
+
+        # The slow call carries on with the failed client, while new calls are given a new one.
+        assert not session.clients[0].closed
+        async with persistent_session.client("s3") as s3:
+            assert s3 is session.clients[1]
+
+        release.set()
+        assert await slow is session.clients[0]
+
+    run(calls())
+
+    assert session.clients[0].closed
+    assert not session.clients[1].closed
@@ -0,0 +1,86 @@
+import json
+
+from src.common.archiver_config import MemoryConfigSource
+from src.common.bloom_filter import BloomFilter, ArchivedSubmissionFilter
+from src.common.filesystem import LocalFileSystem
+from src.common.messaging import RecordingMessagingService
+from src.common.metadata import SQLiteMetadataService, create_metadata
+
+
+def test_false_positive_rate_is_close_to_configured():
+    bloom_filter = BloomFilter(10000, 0.01)
+
+    for i in range(10000):
+        bloom_filter.add(f"a{i}")
+
+    assert all(f"a{i}" in bloom_filter for i in range(10000))
+
+    false_positives = sum(f"b{i}" in bloom_filter for i in range(10000))
+    assert false_positives < 200
+
+    restored = BloomFilter.from_bytes(bloom_filter.to_bytes())
+    assert restored.count == 10000
+    assert all(f"a{i}" in restored for i in range(10000))
+
+
+def create_items(start, stop):
+    return [
+        create_metadata(f"s{i:03d}", {
+            "created_utc": 1000 + i,
+            "author": "VoxUmbra",
+            "title": f"Submission {i}",
+            "score": 1,
+            "subreddit": "Superstonk",
+        })
+        for i in range(start, stop)
+    ]
+
+
+def test_finder_skips_archived_submissions(tmp_path, monkeypatch, capsys, run, submission_finder):
+    metadata_service = SQLiteMetadataService()
+    run(metadata_service.put_many(create_items(0, 150)))
+
+    async def request(endpoint, subreddit, after):
+        return [{"id": f"s{i:03d}", "created_utc": 1000 + i} for i in range(after - 999, min(after - 899, 200))]
+
+    monkeypatch.setattr(submission_finder.pushshift, "request", request)
+
+    filesystem = LocalFileSystem(str(tmp_path))
+
+    def find(**config):
+        config_source = MemoryConfigSource(after_utc=999, **config)
+        messaging_service = RecordingMessagingService()
+        run(submission_finder.main(config_source, messaging_service, filesystem, metadata_service))
+        return config_source, messaging_service.messages
+
+    # The filter doesn't exist yet, so it is built from the metadata store.
+    config_source, messages = find()
+    assert messages == [f"s{i:03d}" for i in range(150, 200)]
+    assert config_source.config["after_utc"] == 1199
+
+    # Chunks that were skipped entirely don't record any discovery lag.
+    events = [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith("{")]
+    assert [len(event["DiscoveryLag"]) for event in events] == [50]
+
+    # Submissions that were published are only remembered once they have been archived.
+    archive_filter = ArchivedSubmissionFilter(filesystem)
+    assert run(archive_filter.load())
+    assert not archive_filter.contains("s199")
+
+    # Submissions published on the previous run are checked again on the next, and those that failed to archive are
+    # published again.
+    run(metadata_service.put_many(create_items(150, 190)))
+
+    _, messages = find()
+    assert messages == [f"s{i:03d}" for i in range(190, 200)]
+
+    assert run(archive_filter.load())
+    assert archive_filter.contains("s189")
+    assert not archive_filter.contains("s199")
+
+    _, messages = find(archive_filter_force="true")
+    assert len(messages) == 200
+
+    config_source, messages = find(archive_filter_command="rebuild")
+    assert messages == [f"s{i:03d}" for i in range(190, 200)]
+    assert config_source.config["archive_filter_command"] == "resume"
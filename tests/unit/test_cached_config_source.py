@@ -0,0 +1,35 @@
+from src.common.archiver_config import CachedConfigSource
+
+
+def test_reads_are_cached_until_the_ttl_expires(run, clock, config_source):
+    config_source.config["after_utc"] = 100
+    cached_config_source = CachedConfigSource(config_source, ttl=30, clock=clock)
+
+    assert run(cached_config_source.get_config("after_utc")) == 100
+    assert run(cached_config_source.get_config("after_utc")) == 100
+    assert config_source.gets == 1
+
+    clock.now = 30
+    run(cached_config_source.get_config("after_utc"))
+    assert config_source.gets == 2
+
+
+def test_writes_are_coalesced_and_flushed_on_close(run, clock, config_source):
+    cached_config_source = CachedConfigSource(config_source, flush_interval=30, keep_versions=3, clock=clock)
+
+    for after_utc in range(100):
+        run(cached_config_source.put_config(after_utc=after_utc))
+
+    # Pending values are visible to readers before they are persisted.
+    assert run(cached_config_source.get_config("after_utc")) == 99
+    assert config_source.puts == []
+
+    clock.now = 30
+    run(cached_config_source.put_config(after_utc=100))
+    assert config_source.puts == [{"after_utc": 100}]
+
+    run(cached_config_source.put_config(after_utc=101, other=1))
+    run(cached_config_source.close())
+
+    assert config_source.puts == [{"after_utc": 100}, {"after_utc": 101, "other": 1}]
+    assert config_source.compacted == (["after_utc", "other"], 3)
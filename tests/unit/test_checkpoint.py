@@ -0,0 +1,108 @@
+from aioboto3.dynamodb.table import BatchWriter
+
+from src.common import checkpoint
+from src.common.checkpoint import Checkpointer
+from src.common.metadata import DynamoDBMetadataService
+
+
+def test_checkpoints_are_flushed_every_n_items(run, config_source):
+    checkpointer = Checkpointer(config_source, every_items=100, every_seconds=3600)
+
+    for i in range(250):
+        run(checkpointer.update(last_generated_metadata=f"p{i:03d}"))
+
+    assert config_source.puts == [{"last_generated_metadata": "p099"}, {"last_generated_metadata": "p199"}]
+
+    run(checkpointer.flush())
+    assert config_source.puts[-1] == {"last_generated_metadata": "p249"}
+
+    # Flushing again with nothing new to save doesn't write anything.
+    run(checkpointer.flush())
+    assert len(config_source.puts) == 3
+
+
+def test_checkpoints_are_dropped_once_progress_is_reset(run, config_source):
+    current = [True]
+    flushed = []
+
+    async def is_current():
+        return current[0]
+
+    async def before_flush():
+        flushed.append(True)
+
+    checkpointer = Checkpointer(config_source, every_items=10, every_seconds=3600, before_flush=before_flush,
+                                is_current=is_current)
+
+    run(checkpointer.update(10, last_generated_metadata="p009"))
+    current[0] = False
+    run(checkpointer.update(10, last_generated_metadata="p019"))
+
+    # Neither the checkpoint nor the state it depends on are saved, even if the progress looks current again.
+    current[0] = True
+    run(checkpointer.update(10, last_generated_metadata="p029"))
+
+    assert config_source.puts == [{"last_generated_metadata": "p009"}]
+    assert flushed == [True]
+    assert checkpointer.is_stale
+
+
+def test_checkpoints_are_flushed_after_an_interval(monkeypatch, run, clock, config_source):
+    monkeypatch.setattr(checkpoint.time, "monotonic", clock.monotonic)
+
+    flushed = []
+
+    async def before_flush():
+        # Derived state must be durable before the checkpoint that depends on it is written.
+        flushed.append(len(config_source.puts))
+
+    checkpointer = Checkpointer(config_source, every_items=1000, every_seconds=30, before_flush=before_flush)
+
+    run(checkpointer.update(10, last_generated_metadata="p010"))
+    clock.now = 29
+    run(checkpointer.update(10, last_generated_metadata="p020"))
+    assert config_source.puts == []
+
+    clock.now = 30
+    run(checkpointer.update(10, last_generated_metadata="p030"))
+    assert config_source.puts == [{"last_generated_metadata": "p030"}]
+    assert flushed == [0]
+
+    # The interval is measured from the last flush.
+    clock.now = 59
+    run(checkpointer.update(10, last_generated_metadata="p040"))
+    assert len(config_source.puts) == 1
+
+
+class FakeClient:
+    def __init__(self):
+        self.batches = []
+
+    async def batch_write_item(self, RequestItems):
+        self.batches.append(RequestItems["metadata"])
+        return {"UnprocessedItems": {}}
+
+
+class FakeTable:
+    def __init__(self):
+        self.client = FakeClient()
+
+    def batch_writer(self, overwrite_by_pkeys=None):
+        return BatchWriter("metadata", self.client, overwrite_by_pkeys=overwrite_by_pkeys)
+
+
+def test_put_many_batches_writes_and_keeps_the_latest_duplicate(run, dynamodb_session):
+    table = FakeTable()
+    dynamodb_session.table = table
+    metadata_service = DynamoDBMetadataService(dynamodb_session, "metadata")
+
+    items = [{"submission_id": f"p{i:02d}", "score": 0} for i in range(30)]
+    items.insert(10, {"submission_id": "p03", "score": 1})
+
+    run(metadata_service.put_many(items))
+
+    assert [len(batch) for batch in table.client.batches] == [25, 5]
+
+    written = [request["PutRequest"]["Item"] for batch in table.client.batches for request in batch]
+    assert sorted(item["submission_id"] for item in written) == [f"p{i:02d}" for i in range(30)]
+    assert {"submission_id": "p03", "score": 1} in written
@@ -0,0 +1,136 @@
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "src", "knotsrepus-api-lambda"))
+
+import api_controller  # noqa: E402
+import rest  # noqa: E402
+from src.common import comment_index  # noqa: E402
+from src.common.filesystem import LocalFileSystem  # noqa: E402
+from src.common.metadata import SQLiteMetadataService  # noqa: E402
+
+
+class RangeRecordingFileSystem(LocalFileSystem):
+    def __init__(self, root):
+        super().__init__(root)
+        self.ranges = []
+
+    async def read(self, path):
+        self.ranges.append((path, None))
+        return await super().read(path)
+
+    async def read_range(self, path, start, end):
+        self.ranges.append((path, end - start))
+        return await super().read_range(path, start, end)
+
+
+def make_comments(count):
+    rng = random.Random(42)
+
+    return [
+        {"id": f"c{i:05d}", "body": "x" * rng.randint(0, 200), "created_utc": rng.randint(0, 1000),
+         "score": rng.randint(-5, 50)}
+        for i in range(count)
+    ]
+
+
+def test_pages_match_the_sorted_thread(tmp_path, run):
+    comments = make_comments(500)
+    filesystem = RangeRecordingFileSystem(str(tmp_path))
+    run(comment_index.write_comment_index(filesystem, "abc123", comments))
+
+    for sort in comment_index.SORTS:
+        for sort_order in comment_index.SORT_ORDERS:
+            expected = comment_index.sort_comments(comments, sort, sort_order)
+
+            for offset in [0, 37, 480]:
+                lines = run(comment_index.read_comment_page(filesystem, "abc123", sort, sort_order, offset, 25))
+                assert [json.loads(line) for line in lines] == expected[offset:offset + 25]
+
+    assert run(comment_index.read_comment_page(filesystem, "abc123", "score", "desc", 600, 25)) == []
+    assert run(comment_index.read_comment_page(filesystem, "other", "score", "desc", 0, 25)) is None
+
+    # Only the page is read, never the whole thread.
+    assert all(length is not None for path, length in filesystem.ranges if path.endswith("/version") is False)
+
+
+def test_scattered_pages_are_read_with_capped_requests(tmp_path, monkeypatch, run):
+    monkeypatch.setattr(comment_index, "MAX_RUN_SIZE", 4096)
+
+    comments = make_comments(2000)
+    filesystem = RangeRecordingFileSystem(str(tmp_path))
+    run(comment_index.write_comment_index(filesystem, "abc123", comments))
+    filesystem.ranges.clear()
+
+    lines = run(comment_index.read_comment_page(filesystem, "abc123", "score", "desc", 100, 50))
+    assert [json.loads(line) for line in lines] == comment_index.sort_comments(comments, "score", "desc")[100:150]
+
+    # The lines of the page lie within the gap of each other, but are still split into several requests.
+    comment_ranges = [length for path, length in filesystem.ranges if path.endswith(".ndjson")]
+    assert len(comment_ranges) > 1
+    assert all(length <= 4096 for length in comment_ranges)
+
+
+def test_rewritten_threads_are_only_served_once_fully_written(tmp_path, run):
+    class FailingFileSystem(LocalFileSystem):
+        fail = False
+
+        async def write(self, path, data):
+            if self.fail and path == comment_index.get_version_path("abc123"):
+                raise IOError("Write failed")
+            await super().write(path, data)
+
+    old_comments = make_comments(100)
+    new_comments = make_comments(150)
+    filesystem = FailingFileSystem(str(tmp_path))
+    run(comment_index.write_comment_index(filesystem, "abc123", old_comments))
+
+    # Until the pointer to a new version is written, pages keep coming from the old one as a whole.
+    filesystem.fail = True
+    try:
+        run(comment_index.write_comment_index(filesystem, "abc123", new_comments))
+    except IOError:
+        pass
+
+    lines = run(comment_index.read_comment_page(filesystem, "abc123", "score", "desc", 90, 25))
+    assert [json.loads(line) for line in lines] == comment_index.sort_comments(old_comments, "score", "desc")[90:]
+    assert run(comment_index.read_comment_count(filesystem, "abc123")) == 100
+
+    filesystem.fail = False
+    run(comment_index.write_comment_index(filesystem, "abc123", new_comments))
+
+    lines = run(comment_index.read_comment_page(filesystem, "abc123", "score", "desc", 90, 25))
+    assert [json.loads(line) for line in lines] == comment_index.sort_comments(new_comments, "score", "desc")[90:115]
+    assert run(comment_index.read_comment_count(filesystem, "abc123")) == 150
+
+    # The replaced version is removed once the new one is served.
+    assert len([path for path in (tmp_path / "abc123" / "comments").rglob("*") if path.is_file()]) == 6
+
+
+def test_comments_are_paged_through_the_api(tmp_path, run):
+    comments = make_comments(30)
+    filesystem = RangeRecordingFileSystem(str(tmp_path))
+    run(comment_index.write_comment_index(filesystem, "indexed", comments))
+
+    os.makedirs(tmp_path / "legacy")
+    (tmp_path / "legacy" / "comments.json").write_text(json.dumps(comments, indent=4))
+
+    api = api_controller.ApiController(filesystem, SQLiteMetadataService())
+    expected = comment_index.sort_comments(comments, "score", "desc")
+
+    # Comments archived before they were indexed are paged in the same way.
+    for submission_id in ["indexed", "legacy"]:
+        status, headers, _, body = run(rest.dispatch(f"/submission/{submission_id}/comments", api, sort="score",
+                                                     sort_order="desc", offset="10", limit="10"))
+        assert status == 200
+        assert json.loads(body.data) == expected[10:20]
+        assert headers["X-Next-Offset"] == "20"
+
+        status, headers, _, body = run(rest.dispatch(f"/submission/{submission_id}/comments", api, offset="20",
+                                                     limit="20"))
+        assert json.loads(body.data) == comment_index.sort_comments(comments, "created_utc", "asc")[20:]
+        assert "X-Next-Offset" not in headers
+
+    assert run(rest.dispatch("/submission/indexed/comments", api, limit="5000"))[0] == 400
@@ -0,0 +1,247 @@
+from boto3.dynamodb.conditions import Key, Attr
+
+from src.common.metadata import DynamoDBMetadataService, create_metadata
+
+
+class FakeTable:
+    def __init__(self, items):
+        self.items = items
+        self.requests = []
+
+    async def query(self, **kwargs):
+        self.requests.append(kwargs)
+
+        attributes = None
+        if "ProjectionExpression" in kwargs:
+            names = kwargs["ExpressionAttributeNames"]
+            attributes = [names[name.strip()] for name in kwargs["ProjectionExpression"].split(",")]
+
+        items = [
+            {key: value for key, value in item.items() if attributes is None or key in attributes}
+            for item in self.items
+        ]
+
+        return {"Items": items[:kwargs["Limit"]], "ScannedCount": min(len(items), kwargs["Limit"])}
+
+
+def test_query_projects_requested_fields(run, dynamodb_session):
+    table = FakeTable([
+        create_metadata(f"p{i:03d}", {
+            "created_utc": 1630450800 + i,
+            "author": "VoxUmbra",
+            "title": "A long title " * 20,
+            "score": i,
+            "subreddit": "Superstonk",
+        })
+        for i in range(5)
+    ])
+    dynamodb_session.table = table
+    metadata_service = DynamoDBMetadataService(dynamodb_session, "metadata")
+
+    items, _ = run(
+        metadata_service.query(Key("author").eq("VoxUmbra") & Key("score").gte(0), sort="score", fields=["score"])
+    )
+
+    # The attributes needed to page through the index are read, but only the requested fields are returned.
+    request = table.requests[0]
+    assert sorted(request["ExpressionAttributeNames"].values()) == ["author", "score", "submission_id"]
+    assert items == [{"score": i} for i in range(5)]
+
+
+def evaluate(condition, item):
+    expression = condition.get_expression()
+    operator = expression["operator"]
+    values = expression["values"]
+
+    if operator == "AND":
+        return evaluate(values[0], item) and evaluate(values[1], item)
+
+    value = item.get(values[0].name)
+
+    if operator == "=":
+        return value == values[1]
+
+    if operator == ">=":
+        return value is not None and value >= values[1]
+
+    raise Exception(f"The condition operator '{operator}' is not supported.")
+
+
+class FakeIndexTable:
+    """Queries items like a secondary index does: Limit caps the items evaluated, before the filter is applied."""
+
+    def __init__(self, items, key_name: str, sort: str, max_page_size=None):
+        self.items = items
+        self.key_name = key_name
+        self.sort = sort
+        self.max_page_size = max_page_size
+        self.requests = []
+
+    async def get_item(self, Key):
+        return {"Item": next(item for item in self.items if item["submission_id"] == Key["submission_id"])}
+
+    async def query(self, **kwargs):
+        self.requests.append(kwargs)
+
+        def position(item):
+            return item[self.sort], item["submission_id"]
+
+        descending = not kwargs["ScanIndexForward"]
+        items = sorted(
+            (item for item in self.items if evaluate(kwargs["KeyConditionExpression"], item)),
+            key=position,
+            reverse=descending
+        )
+
+        start_key = kwargs.get("ExclusiveStartKey")
+        if start_key is not None:
+            start = (start_key[self.sort], start_key["submission_id"])
+            items = [item for item in items if (position(item) < start if descending else position(item) > start)]
+
+        # Responses are also cut short by their size, which the page size stands in for.
+        scanned = items[:min(kwargs["Limit"], self.max_page_size or kwargs["Limit"])]
+
+        response = {
+            "Items": [
+                item for item in scanned
+                if "FilterExpression" not in kwargs or evaluate(kwargs["FilterExpression"], item)
+            ],
+            "ScannedCount": len(scanned),
+        }
+
+        if len(scanned) < len(items):
+            response["LastEvaluatedKey"] = {
+                "submission_id": scanned[-1]["submission_id"],
+                self.key_name: scanned[-1][self.key_name],
+                self.sort: scanned[-1][self.sort],
+            }
+
+        return response
+
+
+def create_items(count):
+    return [
+        create_metadata(f"p{i:03d}", {
+            "created_utc": 1630450800 + i,
+            "author": "VoxUmbra",
+            "title": f"Submission {i}",
+            "score": i,
+            "subreddit": "Superstonk",
+            "link_flair_text": "DD" if i % 10 == 0 else "Discussion",
+        })
+        for i in range(count)
+    ]
+
+
+def read_pages(run, metadata_service, key_condition, filter_condition=None, limit=5, sort="created_utc"):
+    pages = []
+    cursor = None
+
+    while True:
+        items, cursor = run(
+            metadata_service.query(key_condition, filter_condition, limit=limit, sort=sort, cursor=cursor)
+        )
+        pages.append([item["submission_id"] for item in items])
+
+        if cursor is None:
+            return pages
+
+
+def test_filtered_pages_are_filled_across_responses(run, dynamodb_session):
+    table = FakeIndexTable(create_items(100), "author", "created_utc")
+    dynamodb_session.table = table
+    metadata_service = DynamoDBMetadataService(dynamodb_session, "metadata")
+
+    pages = read_pages(run, metadata_service, Key("author").eq("VoxUmbra") & Key("created_utc").gte(0),
+                       Attr("post_type").eq("dd"))
+
+    # A response holding more matches than fit in the page resumes from the last match taken, so none are skipped.
+    assert pages == [[f"p{i:03d}" for i in range(0, 50, 10)], [f"p{i:03d}" for i in range(50, 100, 10)]]
+
+    # Filtered reads ask for the rest of the read budget, rather than a page's worth of items.
+    assert table.requests[0]["Limit"] == 1000
+
+
+def test_filtered_pages_stop_at_the_read_budget(run, dynamodb_session):
+    table = FakeIndexTable(create_items(100), "author", "created_utc")
+    dynamodb_session.table = table
+    metadata_service = DynamoDBMetadataService(dynamodb_session, "metadata", read_budget=25)
+
+    pages = read_pages(run, metadata_service, Key("author").eq("VoxUmbra") & Key("created_utc").gte(0),
+                       Attr("post_type").eq("dd"))
+
+    # Each page evaluates at most 25 items, so pages are short, and the cursor resumes where reading stopped.
+    assert pages == [["p000", "p010", "p020"], ["p030", "p040"], ["p050", "p060", "p070"], ["p080", "p090"]]
+    assert all(request["Limit"] <= 25 for request in table.requests)
+
+
+def test_unfiltered_pages_are_filled_across_responses(run, dynamodb_session):
+    table = FakeIndexTable(create_items(12), "author", "created_utc", max_page_size=2)
+    dynamodb_session.table = table
+    metadata_service = DynamoDBMetadataService(dynamodb_session, "metadata")
+
+    pages = read_pages(run, metadata_service, Key("author").eq("VoxUmbra") & Key("created_utc").gte(0))
+
+    assert pages == [[f"p{i:03d}" for i in range(start, min(start + 5, 12))] for start in range(0, 12, 5)]
+
+    # Unfiltered reads only ask for what is left of the page.
+    assert [request["Limit"] for request in table.requests[:3]] == [5, 3, 1]
+
+
+def create_sharded_items(count):
+    items = create_items(count)
+
+    # Items written before listings were sharded are still in the original partition.
+    for item in items[:count // 10]:
+        item["dummy"] = "dummy"
+
+    return items
+
+
+def test_sharded_pages_resume_across_shards_with_a_filter(run, dynamodb_session):
+    items = create_sharded_items(300)
+    table = FakeIndexTable(items, "dummy", "created_utc")
+    dynamodb_session.table = table
+    metadata_service = DynamoDBMetadataService(dynamodb_session, "metadata", read_budget=90)
+
+    def read_all(sort_order):
+        submission_ids = []
+        cursor = None
+
+        while True:
+            page, cursor = run(metadata_service.query(
+                Key("dummy").eq("dummy") & Key("created_utc").gte(0), Attr("post_type").eq("dd"), limit=7,
+                sort="created_utc", sort_order=sort_order, cursor=cursor
+            ))
+            assert len(page) <= 7
+            submission_ids.extend(item["submission_id"] for item in page)
+
+            if cursor is None:
+                return submission_ids
+
+    matches = [item["submission_id"] for item in items if item["post_type"] == "dd"]
+
+    # Shards run out of read budget on most pages, and every match is still listed exactly once and in order.
+    assert read_all("asc") == matches
+    assert read_all("desc") == list(reversed(matches))
+
+
+def test_sharded_pages_only_read_a_share_of_the_page_from_each_shard(run, dynamodb_session):
+    table = FakeIndexTable(create_sharded_items(300), "dummy", "created_utc")
+    dynamodb_session.table = table
+    metadata_service = DynamoDBMetadataService(dynamodb_session, "metadata")
+
+    page, cursor = run(metadata_service.query(
+        Key("dummy").eq("dummy") & Key("created_utc").gte(0), limit=18, sort="created_utc"
+    ))
+
+    # The oldest items are all in the original partition, which is the only shard read again once it runs out.
+    assert [item["submission_id"] for item in page] == [f"p{i:03d}" for i in range(18)]
+    assert [request["Limit"] for request in table.requests[:9]] == [3] * 9
+    assert all(evaluate(request["KeyConditionExpression"], {"dummy": "dummy", "created_utc": 0})
+               for request in table.requests[9:])
+
+    page, _ = run(metadata_service.query(
+        Key("dummy").eq("dummy") & Key("created_utc").gte(0), limit=18, sort="created_utc", cursor=cursor
+    ))
+    assert [item["submission_id"] for item in page] == [f"p{i:03d}" for i in range(18, 36)]
@@ -0,0 +1,49 @@
+import gzip
+import json
+import os
+import sys
+
+import aiohttp
+from aiohttp import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "src", "knotsrepus-api-lambda"))
+
+import api_controller  # noqa: E402
+import local_server  # noqa: E402
+from src.common.filesystem import LocalFileSystem  # noqa: E402
+from src.common.metadata import SQLiteMetadataService  # noqa: E402
+
+
+def test_local_server_handles_requests_like_the_lambda_function(tmp_path, run):
+    os.makedirs(tmp_path / "abc123")
+    (tmp_path / "abc123" / "comments.json").write_text(json.dumps([{"id": f"c{i}", "body": "x" * 100}
+                                                                   for i in range(20)]))
+
+    api = api_controller.ApiController(LocalFileSystem(str(tmp_path)), SQLiteMetadataService())
+
+    async def serve():
+        runner = web.AppRunner(local_server.create_app(api))
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 0).start()
+        url = f"http://127.0.0.1:{runner.addresses[0][1]}"
+
+        try:
+            async with aiohttp.ClientSession(auto_decompress=False) as session:
+                async with session.get(f"{url}/submission/abc123/comments",
+                                       headers={"Accept-Encoding": "gzip"}) as response:
+                    assert response.status == 200
+                    assert response.headers["Content-Encoding"] == "gzip"
+                    assert response.content_type == "application/json"
+                    assert len(json.loads(gzip.decompress(await response.read()))) == 20
+
+                    etag = response.headers["ETag"]
+
+                async with session.get(f"{url}/submission/abc123/comments", headers={"If-None-Match": etag}) as response:
+                    assert response.status == 304
+
+                async with session.get(f"{url}/stats/authors", params={"count": "none"}) as response:
+                    assert response.status == 400
+        finally:
+            await runner.cleanup()
+
+    run(serve())
@@ -0,0 +1,74 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "src", "knotsrepus-api-lambda"))
+
+import api_controller  # noqa: E402
+import rest  # noqa: E402
+from src.common.filesystem import LocalFileSystem, S3FileSystem  # noqa: E402
+from src.common.manifest import describe_file, read_manifest, update_manifest  # noqa: E402
+from src.common.metadata import SQLiteMetadataService  # noqa: E402
+
+
+class NoSuchKey(Exception):
+    pass
+
+
+class FakeS3Client:
+    class exceptions:
+        NoSuchKey = NoSuchKey
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    async def get_object(self, Bucket, Key, **kwargs):
+        raise NoSuchKey()
+
+
+class FakeSession:
+    def client(self, service_name, **kwargs):
+        return FakeS3Client()
+
+
+def test_files_are_merged_into_an_existing_manifest(tmp_path, run):
+    filesystem = LocalFileSystem(str(tmp_path))
+
+    run(update_manifest(filesystem, "abc123", [
+        describe_file("b.png", b"first", archived_utc=1),
+        describe_file("a.mp4", b"video", archived_utc=1),
+    ]))
+    manifest = run(update_manifest(filesystem, "abc123", [describe_file("b.png", b"second", archived_utc=2)]))
+
+    assert manifest == run(read_manifest(filesystem, "abc123"))
+    assert [file["name"] for file in manifest["files"]] == ["a.mp4", "b.png"]
+    assert manifest["files"][0]["archived_utc"] == 1
+    assert manifest["files"][1]["archived_utc"] == 2
+    assert manifest["files"][1]["size"] == len(b"second")
+    assert manifest["files"][0]["content_type"] == "video/mp4"
+
+
+def test_media_is_listed_from_the_manifest(tmp_path, run):
+    filesystem = LocalFileSystem(str(tmp_path))
+    run(update_manifest(filesystem, "abc123", [describe_file("image.png", b"data", archived_utc=1)]))
+
+    # Files that aren't in the manifest are not listed, as the archive isn't listed when there is a manifest.
+    (tmp_path / "abc123" / "unlisted.png").write_text("data")
+
+    api = api_controller.ApiController(filesystem, SQLiteMetadataService())
+    _, _, _, names = run(rest.dispatch("/submission/abc123/media", api))
+    _, _, _, details = run(rest.dispatch("/submission/abc123/media", api, details="true"))
+
+    assert names == ["image.png"]
+    assert details == json.loads((tmp_path / "abc123" / "manifest.json").read_text())["files"]
+
+
+def test_missing_s3_objects_are_read_as_none(run):
+    filesystem = S3FileSystem("archive", FakeSession())
+
+    assert run(filesystem.read("abc123/manifest.json")) is None
+    assert run(filesystem.read_with_etag("abc123/manifest.json")) == (None, None)
+    assert run(read_manifest(filesystem, "abc123")) is None
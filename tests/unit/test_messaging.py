@@ -0,0 +1,70 @@
+import contextlib
+import time
+
+import pytest
+
+from src.common.messaging import SNSMessagingService, RecordingMessagingService, PublishFailed
+
+
+class FakeSNS:
+    def __init__(self, failures):
+        # Maps each message to the number of times publishing it fails before it succeeds.
+        self.failures = dict(failures)
+        self.published = []
+        self.calls = 0
+
+    async def publish_batch(self, TopicArn, PublishBatchRequestEntries):
+        self.calls += 1
+        assert len(PublishBatchRequestEntries) <= 10
+
+        failed = []
+        for entry in PublishBatchRequestEntries:
+            if self.failures.get(entry["Message"], 0) > 0:
+                self.failures[entry["Message"]] -= 1
+                failed.append({"Id": entry["Id"], "Code": "InternalError", "SenderFault": entry["Message"] == "bad"})
+            else:
+                self.published.append(entry["Message"])
+
+        return {"Successful": [], "Failed": failed}
+
+
+class FakeSession:
+    def __init__(self, sns):
+        self.sns = sns
+
+    def client(self, name):
+        @contextlib.asynccontextmanager
+        async def client():
+            yield self.sns
+
+        return client()
+
+
+def test_failed_entries_are_retried_on_their_own(run):
+    sns = FakeSNS({"m3": 1, "m17": 2})
+    messaging_service = SNSMessagingService(FakeSession(sns), "arn:aws:sns:eu-west-2:123456789012:Topic")
+
+    run(messaging_service.send_messages([f"m{i}" for i in range(25)]))
+
+    assert sorted(sns.published) == sorted(f"m{i}" for i in range(25))
+    # Three batches, then one retry for m3 and two for m17.
+    assert sns.calls == 3 + 1 + 2
+
+
+def test_rejected_entries_are_not_retried(run):
+    sns = FakeSNS({"bad": 1})
+    messaging_service = SNSMessagingService(FakeSession(sns), "arn:aws:sns:eu-west-2:123456789012:Topic")
+
+    with pytest.raises(PublishFailed):
+        run(messaging_service.send_messages(["good", "bad"]))
+
+
+def test_messages_are_published_in_concurrent_batches(run):
+    messaging_service = RecordingMessagingService(latency=0.05)
+
+    started = time.monotonic()
+    run(messaging_service.send_messages([f"m{i}" for i in range(100)]))
+
+    assert [len(call) for call in messaging_service.calls] == [10] * 10
+    assert sorted(messaging_service.messages) == sorted(f"m{i}" for i in range(100))
+    assert time.monotonic() - started < 0.05 * 5
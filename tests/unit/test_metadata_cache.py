@@ -0,0 +1,120 @@
+from decimal import Decimal
+
+import pytest
+from boto3.dynamodb.conditions import Key, Attr
+
+from src.common.metadata import SQLiteMetadataService
+from src.common.metadata_cache import CachingMetadataService, invalidate_query_caches
+
+
+class CountingMetadataService(SQLiteMetadataService):
+    def __init__(self):
+        super().__init__()
+        self.query_count = 0
+
+    async def query(self, *args, **kwargs):
+        self.query_count += 1
+        return await super().query(*args, **kwargs)
+
+
+def front_page(run, metadata_service, limit=10):
+    return run(metadata_service.query(Key("dummy").eq("dummy") & Key("created_utc").gte(0), limit=limit,
+                                      sort="created_utc", sort_order="desc"))
+
+
+@pytest.fixture
+def backing_service(run):
+    backing_service = CountingMetadataService()
+    run(backing_service.put_many([
+        {"submission_id": f"p{i:03d}", "created_utc": Decimal(i), "score": Decimal(i), "dummy": "dummy",
+         "post_type": "dd"}
+        for i in range(50)
+    ]))
+    return backing_service
+
+
+def test_repeated_queries_are_served_from_the_cache(backing_service, run, clock):
+    metadata_service = CachingMetadataService(backing_service, clock=clock)
+
+    first = front_page(run, metadata_service)
+    second = run(metadata_service.query(Key("dummy").eq("dummy") & Key("created_utc").gte(0), limit=10,
+                                        sort="created_utc", sort_order="desc"))
+
+    assert first == second
+    assert backing_service.query_count == 1
+
+    # Anything that changes the results, such as a filter, the sort order or the limit, is a different entry.
+    run(metadata_service.query(Key("dummy").eq("dummy") & Key("created_utc").gte(0), Attr("score").gt(5), limit=10,
+                               sort="created_utc", sort_order="desc"))
+    front_page(run, metadata_service, limit=20)
+
+    assert backing_service.query_count == 3
+
+
+def test_entries_expire_after_the_ttl(backing_service, run, clock):
+    metadata_service = CachingMetadataService(backing_service, ttl=10, clock=clock)
+
+    front_page(run, metadata_service)
+    clock.now = 9
+    front_page(run, metadata_service)
+    assert backing_service.query_count == 1
+
+    clock.now = 10
+    front_page(run, metadata_service)
+    assert backing_service.query_count == 2
+
+
+def test_least_recently_used_entries_are_evicted(backing_service, run, clock):
+    metadata_service = CachingMetadataService(backing_service, max_entries=2, clock=clock)
+
+    for limit in [1, 2, 1, 3]:
+        front_page(run, metadata_service, limit=limit)
+
+    assert backing_service.query_count == 3
+    assert len(metadata_service.entries) == 2
+
+    front_page(run, metadata_service, limit=1)
+    front_page(run, metadata_service, limit=2)
+    assert backing_service.query_count == 4
+
+
+def test_writes_and_epoch_changes_invalidate_the_cache(backing_service, run, clock, config_source):
+    metadata_service = CachingMetadataService(backing_service, ttl=60, config_source=config_source,
+                                              epoch_check_interval=5, clock=clock)
+
+    front_page(run, metadata_service)
+    run(metadata_service.put("p100", {"created_utc": Decimal(100), "score": Decimal(1), "dummy": "dummy"}))
+    items, _ = front_page(run, metadata_service)
+
+    assert items[0]["submission_id"] == "p100"
+    assert backing_service.query_count == 2
+
+    # A write made elsewhere is only seen once the epoch is next checked.
+    run(backing_service.put("p101", {"created_utc": Decimal(101), "score": Decimal(1), "dummy": "dummy"}))
+    run(invalidate_query_caches(config_source))
+    front_page(run, metadata_service)
+    assert backing_service.query_count == 2
+
+    # Only the latest epoch is kept, however often it changes.
+    assert config_source.compacted == (["metadata_cache_epoch"], 1)
+
+    clock.now = 5
+    items, _ = front_page(run, metadata_service)
+    assert items[0]["submission_id"] == "p101"
+    assert backing_service.query_count == 3
+
+
+def test_callers_are_given_copies_of_cached_results(backing_service, run, clock):
+    metadata_service = CachingMetadataService(backing_service, clock=clock)
+
+    items, _ = front_page(run, metadata_service)
+    items[0]["title"] = "Changed"
+    items.clear()
+
+    items, _ = front_page(run, metadata_service)
+    items[0]["title"] = "Changed"
+
+    items, _ = front_page(run, metadata_service)
+    assert len(items) == 10
+    assert "title" not in items[0]
+    assert backing_service.query_count == 1
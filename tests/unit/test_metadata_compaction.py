@@ -0,0 +1,34 @@
+from src.common import log_utils
+from src.common.filesystem import LocalFileSystem
+from src.common.search_index import SearchIndex, SearchIndexWriter, get_term_shard, list_runs
+from src.common.statistics import StatisticsWriter, read_summary
+
+
+def test_runs_and_deltas_left_by_the_updater_are_compacted(tmp_path, run, metadata_compaction):
+    filesystem = LocalFileSystem(str(tmp_path))
+    index_writer = SearchIndexWriter(filesystem, compact=False)
+    statistics_writer = StatisticsWriter(filesystem)
+
+    for i in range(4):
+        metadata = {
+            "submission_id": f"pa{i:04d}",
+            "created_utc": 1630450800 + i,
+            "author": "VoxUmbra",
+            "score": 10,
+            "post_type": "dd",
+        }
+        index_writer.add(metadata["submission_id"], metadata["created_utc"], "hodl")
+        statistics_writer.update(None, metadata)
+        run(index_writer.flush())
+        run(statistics_writer.flush())
+
+    assert len(run(list_runs(filesystem, get_term_shard("hodl")))) == 4
+    assert run(read_summary(filesystem)) is None
+
+    result = run(metadata_compaction.handle(filesystem, log_utils.get_logger("test")))
+
+    assert len(run(list_runs(filesystem, get_term_shard("hodl")))) == 1
+    assert [result["submission_id"] for result in run(SearchIndex(filesystem).search("hodl", limit=2))] == \
+        ["pa0003", "pa0002"]
+    assert run(read_summary(filesystem))["submission_count"] == 4
+    assert '"submission_count": 4' in result["body"]
@@ -0,0 +1,310 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from src.common.archiver_config import MemoryConfigSource
+from src.common.filesystem import LocalFileSystem
+from src.common.metadata import MetadataService
+from src.common.partitioning import PARTITION_COUNT, ID_ALPHABET, get_listing_partition, get_worker_partitions
+
+
+class RecordingMetadataService(MetadataService):
+    def __init__(self):
+        self.items = []
+
+    async def list(self, after_id=None, limit=100):
+        pass
+
+    async def get(self, submission_id: str):
+        pass
+
+    async def put(self, submission_id: str, metadata):
+        self.items.append(metadata)
+
+    async def put_many(self, items):
+        self.items.extend(items)
+
+    async def query(self, key_condition, filter_condition=None, after_id=None, limit=100, sort=None, sort_order="asc",
+                    cursor=None, fields=None):
+        pass
+
+
+class SlowFileSystem(LocalFileSystem):
+    # Stands in for the round trip to S3, which dominates the cost of generating metadata.
+    def __init__(self, root, latency):
+        super().__init__(root)
+        self.latency = latency
+
+    async def read(self, path):
+        await asyncio.sleep(self.latency)
+        return await super().read(path)
+
+
+class ListingFileSystem(LocalFileSystem):
+    def __init__(self, root):
+        super().__init__(root)
+        self.listed = []
+
+    async def list_dirs(self, **kwargs):
+        async for dir in super().list_dirs(**kwargs):
+            self.listed.append(dir)
+            yield dir
+
+
+def create_archive(root, submission_ids):
+    for submission_id in submission_ids:
+        os.makedirs(os.path.join(root, submission_id), exist_ok=True)
+
+        with open(os.path.join(root, submission_id, "post.json"), "w") as file:
+            json.dump({
+                "created_utc": 1630450800,
+                "author": "VoxUmbra",
+                "title": submission_id,
+                "score": 1,
+                "subreddit": "Superstonk",
+            }, file)
+
+
+def to_base36(value):
+    digits = ""
+    while value > 0:
+        value, digit = divmod(value, 36)
+        digits = ID_ALPHABET[digit] + digits
+
+    return digits
+
+
+def submission_ids(start, stop):
+    # Consecutive ids are spaced out so that they span many listing prefixes, as the ids in a real archive do.
+    return [to_base36(36 ** 5 * 22 + i * 36 ** 3 * 7) for i in range(start, stop)]
+
+
+def run_worker(args):
+    main, root, latency, worker_index, worker_count = args
+
+    metadata_service = RecordingMetadataService()
+    filesystem = SlowFileSystem(root, latency)
+
+    started = time.monotonic()
+    asyncio.run(main(MemoryConfigSource(), filesystem, metadata_service, worker_index, worker_count))
+
+    return [item["submission_id"] for item in metadata_service.items], time.monotonic() - started
+
+
+def run_workers(metadata_generator, root, latency, worker_count):
+    # Functions are sent to the workers by name, and so the generator's own is sent rather than the module.
+    with multiprocessing.get_context("fork").Pool(worker_count) as pool:
+        results = pool.map(run_worker, [
+            (metadata_generator.main, root, latency, index, worker_count) for index in range(worker_count)
+        ])
+
+    # The workers run concurrently, so the slowest one determines how long the rebuild takes. Process start-up is
+    # excluded as it isn't representative of long-running tasks.
+    return [submission_id for ids, _ in results for submission_id in ids], max(elapsed for _, elapsed in results)
+
+
+def test_worker_partitions_are_disjoint_and_complete():
+    for worker_count in range(1, PARTITION_COUNT + 1):
+        partitions = [
+            partition
+            for worker_index in range(worker_count)
+            for partition in get_worker_partitions(worker_index, worker_count)
+        ]
+
+        assert sorted(partitions) == list(range(PARTITION_COUNT))
+
+
+def test_invalid_worker_counts_are_rejected():
+    with pytest.raises(ValueError):
+        get_worker_partitions(0, PARTITION_COUNT + 1)
+
+    with pytest.raises(ValueError):
+        get_worker_partitions(2, 2)
+
+
+def test_resharding_resumes_from_partition_checkpoints(tmp_path, metadata_generator, run):
+    root = str(tmp_path)
+    create_archive(root, submission_ids(0, 300))
+
+    config_source = MemoryConfigSource()
+    metadata_service = RecordingMetadataService()
+
+    for worker_index in range(2):
+        run(metadata_generator.main(config_source, LocalFileSystem(root), metadata_service, worker_index, 2))
+
+    assert sorted(item["submission_id"] for item in metadata_service.items) == submission_ids(0, 300)
+
+    # Adding workers must only pick up new submissions, whichever worker now owns their partition.
+    create_archive(root, submission_ids(300, 400))
+    metadata_service.items.clear()
+
+    for worker_index in range(4):
+        run(metadata_generator.main(config_source, LocalFileSystem(root), metadata_service, worker_index, 4))
+
+    assert sorted(item["submission_id"] for item in metadata_service.items) == submission_ids(300, 400)
+
+
+def test_rebuild_resets_every_partition(tmp_path, metadata_generator, run):
+    root = str(tmp_path)
+    create_archive(root, submission_ids(0, 50))
+
+    config_source = MemoryConfigSource()
+    metadata_service = RecordingMetadataService()
+
+    run(metadata_generator.main(config_source, LocalFileSystem(root), metadata_service))
+    metadata_service.items.clear()
+
+    config_source.config["metadata_control_command"] = "rebuild"
+    run(metadata_generator.main(config_source, LocalFileSystem(root), metadata_service))
+
+    assert len(metadata_service.items) == 50
+    assert config_source.config["metadata_control_command"] == "resume"
+
+
+def test_rebuild_is_reset_by_the_first_worker_only(tmp_path, monkeypatch, metadata_generator, run):
+    monkeypatch.setattr(metadata_generator, "REBUILD_POLL_SECONDS", 0.01)
+
+    root = str(tmp_path)
+    create_archive(root, submission_ids(0, 100))
+
+    config_source = MemoryConfigSource()
+    metadata_service = RecordingMetadataService()
+
+    for worker_index in range(2):
+        run(metadata_generator.main(config_source, LocalFileSystem(root), metadata_service, worker_index, 2))
+    metadata_service.items.clear()
+
+    resets = []
+
+    async def reset_progress(config_source, filesystem):
+        resets.append(len(metadata_service.items))
+        await asyncio.sleep(0.05)
+        await original_reset_progress(config_source, filesystem)
+
+    original_reset_progress = metadata_generator.reset_progress
+    monkeypatch.setattr(metadata_generator, "reset_progress", reset_progress)
+
+    # The second worker starts first, and must wait for the first to reset every partition before reading its own.
+    config_source.config["metadata_control_command"] = "rebuild"
+
+    async def run_workers():
+        await asyncio.gather(*(
+            metadata_generator.main(config_source, LocalFileSystem(root), metadata_service, worker_index, 2)
+            for worker_index in [1, 0]
+        ))
+
+    run(run_workers())
+
+    assert resets == [0]
+    assert sorted(item["submission_id"] for item in metadata_service.items) == submission_ids(0, 100)
+
+
+def test_workers_running_during_a_reset_never_save_over_it(tmp_path, monkeypatch, metadata_generator, run):
+    monkeypatch.setattr(metadata_generator, "CHECKPOINT_EVERY_ITEMS", metadata_generator.BATCH_SIZE)
+
+    root = str(tmp_path)
+    create_archive(root, submission_ids(0, 300))
+
+    config_source = MemoryConfigSource()
+    filesystem = LocalFileSystem(root)
+
+    class ResettingMetadataService(RecordingMetadataService):
+        async def put_many(self, items):
+            # A rebuild is started by another worker while this one is still working through the archive.
+            if len(self.items) == 0:
+                await metadata_generator.reset_progress(config_source, filesystem)
+
+            await super().put_many(items)
+
+    metadata_service = ResettingMetadataService()
+    run(metadata_generator.main(config_source, filesystem, metadata_service))
+
+    # The worker stops at its first checkpoint after the reset, without saving it.
+    assert len(metadata_service.items) == metadata_generator.BATCH_SIZE
+    assert config_source.config[metadata_generator.CHECKPOINT_GENERATION_KEY] == 1
+    assert all(config_source.config[metadata_generator.get_checkpoint_key(partition)] == "" for partition in range(16))
+
+
+def test_workers_only_list_their_own_prefixes(tmp_path, metadata_generator, run):
+    root = str(tmp_path)
+    ids = submission_ids(0, 400)
+    create_archive(root, ids)
+
+    listed = []
+    for worker_index in range(4):
+        filesystem = ListingFileSystem(root)
+        run(metadata_generator.main(MemoryConfigSource(), filesystem, RecordingMetadataService(), worker_index, 4))
+
+        partitions = get_worker_partitions(worker_index, 4)
+        assert all(get_listing_partition(dir[:-1]) in partitions for dir in filesystem.listed)
+        listed.extend(filesystem.listed)
+
+    # Each submission is listed once to find the lengths of ids in the archive, and once more to be processed.
+    assert sorted(listed) == sorted(f"{submission_id}/" for submission_id in ids * 2)
+
+
+def test_resuming_lists_the_archive_once(tmp_path, metadata_generator, run):
+    root = str(tmp_path)
+    create_archive(root, submission_ids(0, 300))
+
+    config_source = MemoryConfigSource()
+    run(metadata_generator.main(config_source, LocalFileSystem(root), RecordingMetadataService()))
+
+    create_archive(root, submission_ids(300, 320))
+    filesystem = ListingFileSystem(root)
+    metadata_service = RecordingMetadataService()
+    run(metadata_generator.main(config_source, filesystem, metadata_service))
+
+    # Ids up to the checkpoint are only listed to find longer ids, and those after it are listed as they are processed.
+    assert [item["submission_id"] for item in metadata_service.items] == submission_ids(300, 320)
+    # The listing up to the checkpoint only goes one past it.
+    listed = [dir for dir in filesystem.listed if not dir.startswith("_")]
+    assert set(listed) == {f"{submission_id}/" for submission_id in submission_ids(0, 320)}
+    assert len(listed) == 321
+
+
+def test_submissions_are_processed_in_id_order_across_id_lengths(tmp_path, metadata_generator, run):
+    root = str(tmp_path)
+    create_archive(root, ["zzzzzy", "zzzzzz", "1000000", "1000001"])
+
+    config_source = MemoryConfigSource(last_generated_metadata="zzzzzy")
+    metadata_service = RecordingMetadataService()
+
+    run(metadata_generator.main(config_source, LocalFileSystem(root), metadata_service))
+
+    # Longer ids come after shorter ones, even though they are listed before them.
+    assert [item["submission_id"] for item in metadata_service.items] == ["zzzzzz", "1000000", "1000001"]
+    assert config_source.config[metadata_generator.get_checkpoint_key(0)] == "1000001"
+
+    create_archive(root, ["1000002"])
+    metadata_service.items.clear()
+    run(metadata_generator.main(config_source, LocalFileSystem(root), metadata_service))
+
+    assert [item["submission_id"] for item in metadata_service.items] == ["1000002"]
+
+
+def test_workers_scale_near_linearly(tmp_path, metadata_generator):
+    root = str(tmp_path)
+    # Prefixes don't split the archive exactly evenly, so it is sized for the largest share of a worker to still fit in
+    # the same number of batches as an even split would.
+    ids = submission_ids(0, 1500)
+    create_archive(root, ids)
+
+    latency = 0.5
+    worker_count = 4
+
+    single_ids, single_elapsed = run_workers(metadata_generator, root, latency, 1)
+    parallel_ids, parallel_elapsed = run_workers(metadata_generator, root, latency, worker_count)
+
+    assert sorted(single_ids) == ids
+    assert sorted(parallel_ids) == ids
+
+    # Each submission must be handled by exactly one worker, the one owning its partition.
+    assert len(parallel_ids) == len(set(parallel_ids))
+
+    speedup = single_elapsed / parallel_elapsed
+    assert speedup > 0.6 * worker_count
@@ -0,0 +1,108 @@
+from src.common import http_utils, log_utils
+from src.common.archiver_config import MemoryConfigSource
+from src.common.filesystem import LocalFileSystem
+from src.common.metadata import SQLiteMetadataService, create_metadata
+from src.common.statistics import compact_statistics, read_summary
+
+NOW = 1630450800
+
+
+class RecordingMetadataService(SQLiteMetadataService):
+    def __init__(self):
+        super().__init__()
+        self.written = []
+
+    async def put_many(self, items):
+        self.written.extend(item["submission_id"] for item in items)
+        await super().put_many(items)
+
+
+def is_due(metadata_refresh, created_utc, now):
+    return any(start <= created_utc < end for start, end in metadata_refresh.get_due_windows(now))
+
+
+def test_each_tier_is_refreshed_once_per_interval(metadata_refresh):
+    for created_utc in range(NOW - metadata_refresh.DAY * 6, NOW - metadata_refresh.DAY * 2, 1237):
+        runs = [NOW + hour * metadata_refresh.HOUR for hour in range(24)]
+
+        assert sum(is_due(metadata_refresh, created_utc, now) for now in runs) == 1
+
+    for created_utc in range(NOW - metadata_refresh.DAY, NOW, 997):
+        assert is_due(metadata_refresh, created_utc, NOW)
+
+    assert not is_due(metadata_refresh, NOW - 5 * metadata_refresh.WEEK, NOW)
+
+
+def test_only_changed_submissions_are_written(tmp_path, monkeypatch, run, metadata_refresh):
+    metadata_service = RecordingMetadataService()
+    run(metadata_service.put_many([
+        create_metadata(f"p{i:03d}", {
+            "created_utc": NOW - (i + 1) * 60,
+            "author": "VoxUmbra",
+            "title": f"Submission {i}",
+            "score": 1,
+            "subreddit": "Superstonk",
+            "link_flair_text": "DD",
+        })
+        for i in range(250)
+    ]))
+    metadata_service.written.clear()
+
+    requests = []
+
+    async def request(endpoint, ids):
+        requests.append(ids.split(","))
+        return [
+            {"id": submission_id, "score": 1 if submission_id != "p007" else 50, "link_flair_text": "DD"}
+            for submission_id in ids.split(",")
+        ]
+
+    monkeypatch.setattr(metadata_refresh.pushshift, "request", request)
+
+    filesystem = LocalFileSystem(str(tmp_path))
+    result = run(metadata_refresh.handle(MemoryConfigSource(), filesystem, metadata_service, 2, NOW,
+                                         log_utils.get_logger("test")))
+
+    # The request budget only covers the 200 youngest submissions.
+    assert [len(ids) for ids in requests] == [100, 100]
+    assert "p199" in requests[1] and "p200" not in requests[1]
+
+    assert metadata_service.written == ["p007"]
+    assert run(metadata_service.get("p007"))["score"] == 50
+
+    run(compact_statistics(filesystem))
+    assert run(read_summary(filesystem))["top_authors_by_score"][0]["score_total"] == 49
+    assert '"changed": 1' in result["body"]
+
+
+def test_failed_batches_are_skipped(tmp_path, monkeypatch, run, metadata_refresh):
+    metadata_service = RecordingMetadataService()
+    run(metadata_service.put_many([
+        create_metadata(f"p{i:03d}", {
+            "created_utc": NOW - (i + 1) * 60,
+            "author": "VoxUmbra",
+            "title": f"Submission {i}",
+            "score": 1,
+            "subreddit": "Superstonk",
+            "link_flair_text": "DD",
+        })
+        for i in range(200)
+    ]))
+    metadata_service.written.clear()
+
+    async def request(endpoint, ids):
+        if "p000" in ids.split(","):
+            raise http_utils.ResponseInvalid("No data returned")
+
+        return [{"id": submission_id, "score": 2, "link_flair_text": "DD"} for submission_id in ids.split(",")]
+
+    monkeypatch.setattr(metadata_refresh.pushshift, "request", request)
+
+    result = run(metadata_refresh.handle(MemoryConfigSource(), LocalFileSystem(str(tmp_path)), metadata_service, 2,
+                                         NOW, log_utils.get_logger("test")))
+
+    # The changes found by the batch that succeeded are still written.
+    assert metadata_service.written == [f"p{i:03d}" for i in range(100, 200)]
+    assert run(metadata_service.get("p000"))["score"] == 1
+    assert '"refreshed": 100' in result["body"]
+    assert '"failed_requests": 1' in result["body"]
@@ -0,0 +1,54 @@
+import json
+import os
+
+from src.common import log_utils
+from src.common.archiver_config import MemoryConfigSource
+from src.common.filesystem import LocalFileSystem
+from src.common.metadata import SQLiteMetadataService
+from src.common.metadata_cache import CACHE_EPOCH_KEY
+from src.common.search_index import SearchIndex
+from src.common.statistics import compact_statistics, read_summary
+
+
+def write_post(root, submission_id, title, score):
+    os.makedirs(os.path.join(root, submission_id), exist_ok=True)
+
+    with open(os.path.join(root, submission_id, "post.json"), "w") as file:
+        json.dump({
+            "created_utc": 1630450800,
+            "author": "VoxUmbra",
+            "title": title,
+            "score": score,
+            "subreddit": "Superstonk",
+            "link_flair_text": "DD",
+        }, file)
+
+
+def test_archived_submissions_are_upserted(tmp_path, run, metadata_updater):
+    root = str(tmp_path)
+    config_source = MemoryConfigSource()
+    filesystem = LocalFileSystem(root)
+    metadata_service = SQLiteMetadataService()
+    logger = log_utils.get_logger("test")
+
+    write_post(root, "pa0001", "Lending rates explained", 10)
+    write_post(root, "pa0002", "Another lending post", 5)
+
+    run(metadata_updater.handle(["pa0001", "pa0002", "pa0001", "missing"], config_source, filesystem,
+                                metadata_service, logger))
+
+    assert run(metadata_service.get("pa0001"))["post_type"] == "dd"
+    assert [result["submission_id"] for result in run(SearchIndex(filesystem).search("lending"))] == \
+        ["pa0002", "pa0001"]
+    assert config_source.config[CACHE_EPOCH_KEY] is not None
+
+    # Archiving a submission again replaces its metadata and whatever was counted for it.
+    write_post(root, "pa0001", "Lending rates explained", 100)
+    run(metadata_updater.handle(["pa0001"], config_source, filesystem, metadata_service, logger))
+
+    run(compact_statistics(filesystem))
+
+    summary = run(read_summary(filesystem))
+    assert run(metadata_service.get("pa0001"))["score"] == 100
+    assert summary["submission_count"] == 2
+    assert summary["top_authors_by_score"][0] == {"author": "VoxUmbra", "count": 2, "score_total": 105}
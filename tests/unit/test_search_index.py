@@ -0,0 +1,133 @@
+from src.common import search_index
+from src.common.filesystem import LocalFileSystem
+from src.common.search_index import SearchIndex, SearchIndexWriter, compact_shard, decode_run, encode_run, \
+    get_run_path, get_run_posting_count, get_term_shard, list_runs, read_run_postings
+
+
+class RangeRecordingFileSystem(LocalFileSystem):
+    def __init__(self, root):
+        super().__init__(root)
+        self.ranges = []
+
+    async def read_range(self, path, start: int, end: int):
+        self.ranges.append((start, end))
+        return await super().read_range(path, start, end)
+
+
+def search(run, filesystem, query, limit=100):
+    return [result["submission_id"] for result in run(SearchIndex(filesystem).search(query, limit=limit))]
+
+
+def test_runs_round_trip():
+    terms = {
+        "hodl": {"pa0001": 1630450800, "pa0002": 1630450860},
+        "drs": {"pa0002": 1630450860},
+        "computershare": {f"pb{i:04d}": 1630450800 + i for i in range(1000)},
+    }
+
+    assert decode_run(encode_run(terms)) == terms
+
+
+def test_terms_are_read_with_range_reads(tmp_path, monkeypatch, run):
+    filesystem = RangeRecordingFileSystem(str(tmp_path))
+    terms = {f"term{i}": {f"pa{j:04d}": 1630450800 + j for j in range(i, i + 100)} for i in range(200)}
+    run(filesystem.write("_search/00/run.idx", encode_run(terms)))
+
+    assert run(read_run_postings(filesystem, "_search/00/run.idx", "term150")) == terms["term150"]
+    assert run(read_run_postings(filesystem, "_search/00/run.idx", "missing")) == {}
+    assert run(read_run_postings(filesystem, "_search/00/missing.idx", "term150")) is None
+
+    # When the directory and postings aren't within the prefetched bytes, they are read with requests of their own.
+    monkeypatch.setattr(search_index, "RUN_PREFETCH_SIZE", 8)
+    filesystem.ranges.clear()
+
+    assert run(read_run_postings(filesystem, "_search/00/run.idx", "term150")) == terms["term150"]
+    assert len(filesystem.ranges) == 3
+
+
+def test_search_intersects_terms_and_applies_the_limit(tmp_path, run):
+    filesystem = LocalFileSystem(str(tmp_path))
+    writer = SearchIndexWriter(filesystem)
+
+    writer.add("pa0001", 1630450800, "Lending rates explained")
+    writer.add("pa0002", 1630450900, "Lending rates, again")
+    run(writer.flush())
+
+    writer.add("pa0003", 1630451000, "More about lending rates")
+    writer.add("pa0004", 1630451100, "Lending is not the same as rates", "unrelated")
+    writer.add("pa0005", 1630451200, "Nothing to see here")
+    run(writer.flush())
+
+    # The newest matches come first, whichever run they were written to.
+    assert search(run, filesystem, "lending rates") == ["pa0004", "pa0003", "pa0002", "pa0001"]
+    assert search(run, filesystem, "lending rates", limit=2) == ["pa0004", "pa0003"]
+    assert search(run, filesystem, "lending unrelated") == ["pa0004"]
+    assert search(run, filesystem, "lending nothing") == []
+    assert search(run, filesystem, "the") == []
+
+
+def test_runs_are_compacted_by_tier(tmp_path, run):
+    filesystem = LocalFileSystem(str(tmp_path))
+    term_shard = get_term_shard("hodl")
+    writer = SearchIndexWriter(filesystem)
+
+    def get_posting_counts():
+        return sorted(get_run_posting_count(path) for path in run(list_runs(filesystem, term_shard)))
+
+    for i in range(15):
+        writer.add(f"pa{i:04d}", 1630450800 + i, "hodl")
+        run(writer.flush())
+
+    # Every four runs of one posting have been merged into a run of four.
+    assert get_posting_counts() == [1, 1, 1, 4, 4, 4]
+    assert search(run, filesystem, "hodl") == [f"pa{i:04d}" for i in reversed(range(15))]
+
+    # Which fills the tier of runs of four, and so they are all merged into a run of sixteen.
+    writer.add("pa0015", 1630450815, "hodl")
+    run(writer.flush())
+
+    assert get_posting_counts() == [16]
+    assert search(run, filesystem, "hodl", limit=1) == ["pa0015"]
+
+
+def test_runs_are_left_for_a_compaction_job(tmp_path, run):
+    filesystem = LocalFileSystem(str(tmp_path))
+    term_shard = get_term_shard("hodl")
+    writer = SearchIndexWriter(filesystem, compact=False)
+
+    for i in range(6):
+        writer.add(f"pa{i:04d}", 1630450800 + i, "hodl")
+        run(writer.flush())
+
+    assert len(run(list_runs(filesystem, term_shard))) == 6
+
+    # Archiving a submission again adds a run holding the same posting, which is only kept once when runs are merged.
+    writer.add("pa0000", 1630450800, "hodl")
+    run(writer.flush())
+    run(compact_shard(filesystem, term_shard))
+
+    assert [get_run_posting_count(path) for path in run(list_runs(filesystem, term_shard))] == [6]
+    assert search(run, filesystem, "hodl", limit=2) == ["pa0005", "pa0004"]
+
+
+def test_searches_retry_when_a_run_is_compacted_away(tmp_path, run):
+    filesystem = LocalFileSystem(str(tmp_path))
+    term_shard = get_term_shard("hodl")
+    stale_path = get_run_path(term_shard, "0000000000000-00000000", 1)
+
+    run(filesystem.write(get_run_path(term_shard, "0000000000001-00000000", 2),
+                         encode_run({"hodl": {"pa0001": 1630450800, "pa0002": 1630450900}})))
+
+    class CompactingFileSystem(LocalFileSystem):
+        listed = False
+
+        async def list_files(self, path, **kwargs):
+            async for file in super().list_files(path, **kwargs):
+                yield file
+
+            # The first listing still finds a run that was merged into another one since.
+            if not self.listed:
+                self.listed = True
+                yield stale_path
+
+    assert search(run, CompactingFileSystem(str(tmp_path)), "hodl") == ["pa0002", "pa0001"]
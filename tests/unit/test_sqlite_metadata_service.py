@@ -0,0 +1,154 @@
+from decimal import Decimal
+
+import pytest
+from boto3.dynamodb.conditions import Key, Attr
+
+from src.common.cursor import InvalidCursor
+from src.common.metadata import SQLiteMetadataService, get_dummy_shard, with_partition_key
+
+
+def create_items():
+    return [
+        {
+            "submission_id": f"p{i:03d}",
+            "created_utc": Decimal(1630450800 + i),
+            "author": "VoxUmbra" if i % 2 == 0 else "Criand",
+            "title": f"Submission {i}",
+            "score": Decimal(i % 10),
+            "post_type": "dd" if i % 3 == 0 else "discussion",
+            "subreddit": "Superstonk",
+            "dummy": "dummy",
+        }
+        for i in range(100)
+    ]
+
+
+@pytest.fixture
+def metadata_service(run):
+    metadata_service = SQLiteMetadataService()
+    run(metadata_service.put_many(create_items()))
+    return metadata_service
+
+
+def test_query_pages_with_cursors(metadata_service, run):
+    key_condition = Key("post_type").eq("dd") & Key("created_utc").gte(0)
+
+    items, cursor = run(metadata_service.query(key_condition, limit=20, sort="created_utc"))
+    pages = [items]
+
+    while cursor is not None:
+        items, cursor = run(metadata_service.query(key_condition, limit=20, sort="created_utc", cursor=cursor))
+        pages.append(items)
+
+    submission_ids = [item["submission_id"] for page in pages for item in page]
+    assert submission_ids == [f"p{i:03d}" for i in range(0, 100, 3)]
+
+
+def test_query_rejects_cursors_from_other_queries(metadata_service, run):
+    _, cursor = run(metadata_service.query(Key("post_type").eq("dd") & Key("created_utc").gte(0), limit=5,
+                                           sort="created_utc"))
+
+    with pytest.raises(InvalidCursor):
+        run(metadata_service.query(Key("post_type").eq("dd") & Key("score").gte(0), limit=5, sort="score",
+                                   cursor=cursor))
+
+    with pytest.raises(InvalidCursor):
+        run(metadata_service.query(Key("post_type").eq("dd") & Key("created_utc").gte(0), limit=5,
+                                   sort="created_utc", cursor=cursor[:-2] + "AA"))
+
+    # Cursors are bound to the partition, sort order and filter as well as the index.
+    with pytest.raises(InvalidCursor):
+        run(metadata_service.query(Key("post_type").eq("discussion") & Key("created_utc").gte(0), limit=5,
+                                   sort="created_utc", cursor=cursor))
+
+    with pytest.raises(InvalidCursor):
+        run(metadata_service.query(Key("post_type").eq("dd") & Key("created_utc").gte(0), limit=5,
+                                   sort="created_utc", sort_order="desc", cursor=cursor))
+
+    with pytest.raises(InvalidCursor):
+        run(metadata_service.query(Key("post_type").eq("dd") & Key("created_utc").gte(0), Attr("author").eq("Criand"),
+                                   limit=5, sort="created_utc", cursor=cursor))
+
+
+def test_get_returns_the_stored_item(metadata_service, run):
+    item = run(metadata_service.get("p042"))
+
+    assert item["author"] == "VoxUmbra"
+    assert item["score"] == 2
+    assert run(metadata_service.get("missing")) is None
+
+
+def test_get_many_returns_only_the_stored_items(metadata_service, run):
+    submission_ids = [f"p{i:03d}" for i in range(0, 100, 7)] + ["missing", "p000"]
+    items = run(metadata_service.get_many(submission_ids, fields=["submission_id"]))
+
+    assert sorted(item["submission_id"] for item in items) == [f"p{i:03d}" for i in range(0, 100, 7)]
+    assert all(list(item.keys()) == ["submission_id"] for item in items)
+
+
+def test_query_orders_by_sort_key_and_pages_from_an_item(metadata_service, run):
+    key_condition = Key("dummy").eq("dummy") & Key("score").gte(0)
+
+    first_page, _ = run(metadata_service.query(key_condition, limit=15, sort="score", sort_order="desc"))
+    second_page, _ = run(metadata_service.query(key_condition, after_id=first_page[-1]["submission_id"], limit=15,
+                                                sort="score", sort_order="desc"))
+
+    scores = [item["score"] for item in first_page + second_page]
+    assert scores == sorted(scores, reverse=True)
+    assert len({item["submission_id"] for item in first_page + second_page}) == 30
+
+
+def test_query_applies_key_and_filter_conditions(metadata_service, run):
+    items, _ = run(metadata_service.query(
+        Key("author").eq("Criand") & Key("created_utc").between(1630450800, 1630450850),
+        Attr("post_type").eq("dd") & Attr("title").begins_with("Submission 1"),
+        sort="created_utc"
+    ))
+
+    assert [item["submission_id"] for item in items] == ["p015"]
+
+
+def test_query_requires_a_matching_index(metadata_service, run):
+    with pytest.raises(KeyError):
+        run(metadata_service.query(Key("subreddit").eq("Superstonk"), sort="created_utc"))
+
+
+def test_query_lists_sharded_items_under_the_constant_partition(metadata_service, run):
+    items = create_items()[:10]
+    for item in items:
+        item["submission_id"] = f"s{item['submission_id']}"
+        item["dummy"] = get_dummy_shard(item["submission_id"])
+
+    run(metadata_service.put_many(items))
+
+    listed, _ = run(metadata_service.query(
+        Key("dummy").eq("dummy") & Key("created_utc").between(1630450800, 1630450809),
+        sort="created_utc"
+    ))
+
+    assert len(listed) == 20
+    assert run(metadata_service.get("sp003"))["dummy"].startswith("dummy#")
+
+
+def test_partition_key_is_replaced_in_key_conditions():
+    key_condition = with_partition_key(Key("dummy").eq("dummy") & Key("score").gte(0), "dummy", "dummy#3")
+    expression = key_condition.get_expression()
+
+    assert expression["values"][0].get_expression()["values"][1] == "dummy#3"
+    assert expression["values"][1].get_expression()["operator"] == ">="
+
+
+def test_query_returns_only_the_requested_fields(metadata_service, run):
+    key_condition = Key("author").eq("Criand") & Key("score").gte(0)
+
+    items, cursor = run(metadata_service.query(key_condition, limit=10, sort="score", fields=["submission_id", "title"]))
+    pages = [items]
+
+    while cursor is not None:
+        items, cursor = run(metadata_service.query(key_condition, limit=10, sort="score", cursor=cursor,
+                                                   fields=["submission_id", "title"]))
+        pages.append(items)
+
+    items = [item for page in pages for item in page]
+    assert len(items) == 50
+    assert all(item.keys() == {"submission_id", "title"} for item in items)
@@ -0,0 +1,127 @@
+import json
+
+from src.common.filesystem import LocalFileSystem
+from src.common.runs import make_run_id
+from src.common.statistics import StatisticsWriter, compact_statistics, read_summary, read_author_statistics, \
+    get_author_shard, get_author_shard_path, get_score_bucket, get_score_bucket_range
+
+
+def create_items():
+    return [
+        {
+            "submission_id": f"p{i:03d}",
+            "created_utc": 1630450800 + (i % 3) * 86400,
+            "author": ["VoxUmbra", "Criand", "dlauer"][i % 3],
+            "score": i,
+            "post_type": "dd" if i % 2 == 0 else "discussion",
+        }
+        for i in range(30)
+    ]
+
+
+def test_aggregates_are_merged_across_segments(tmp_path, run):
+    filesystem = LocalFileSystem(str(tmp_path))
+    writer = StatisticsWriter(filesystem)
+
+    for item in create_items():
+        writer.add(str(int(item["submission_id"][1:]) % 4), item)
+
+    run(writer.flush())
+    assert run(read_summary(filesystem)) is None
+
+    run(compact_statistics(filesystem))
+
+    summary = run(read_summary(filesystem))
+    assert summary["submission_count"] == 30
+    assert summary["author_count"] == 3
+    assert summary["post_types"] == {"dd": 15, "discussion": 15}
+    assert summary["daily"]["2021-09-01"] == {"dd": 5, "discussion": 5}
+    assert summary["top_authors_by_score"][0] == {"author": "dlauer", "count": 10, "score_total": 155}
+    assert sum(bucket["count"] for bucket in summary["scores"]) == 30
+
+    assert run(read_author_statistics(filesystem, "Criand")) == {"count": 10, "score_total": 145}
+    assert run(read_author_statistics(filesystem, "nobody")) is None
+
+
+def test_submissions_already_counted_are_ignored(tmp_path, run):
+    filesystem = LocalFileSystem(str(tmp_path))
+    items = create_items()
+
+    writer = StatisticsWriter(filesystem)
+    for item in items[:20]:
+        writer.add("0", item)
+    run(writer.flush())
+
+    # Resuming from an older checkpoint repeats some submissions, which must not be counted twice.
+    writer = StatisticsWriter(filesystem)
+    for item in items[10:]:
+        writer.add("0", item)
+    run(writer.flush())
+    run(compact_statistics(filesystem))
+
+    assert run(read_summary(filesystem))["submission_count"] == 30
+
+    # Ids are counted in the order they are listed in, where longer ids come after shorter ones.
+    for submission_id in ["zzzzzz", "1000000", "zzzzzz"]:
+        writer.add("1", {**items[0], "submission_id": submission_id})
+        run(writer.flush())
+    run(compact_statistics(filesystem))
+
+    assert run(read_summary(filesystem))["submission_count"] == 32
+
+    run(writer.reset())
+    run(compact_statistics(filesystem))
+
+    summary = json.loads((tmp_path / "_stats" / "summary.json").read_text())
+    assert summary["submission_count"] == 0
+
+
+def test_compaction_only_writes_the_author_shards_counted(tmp_path, run):
+    filesystem = LocalFileSystem(str(tmp_path))
+    items = create_items()
+
+    writer = StatisticsWriter(filesystem)
+    for item in items:
+        writer.add("0", item)
+    run(writer.flush())
+    run(compact_statistics(filesystem))
+
+    class RecordingFileSystem(LocalFileSystem):
+        written = []
+
+        async def write(self, path, data):
+            self.written.append(path)
+            await super().write(path, data)
+
+    filesystem = RecordingFileSystem(str(tmp_path))
+    writer = StatisticsWriter(filesystem)
+    writer.update(items[0], {**items[0], "score": 1000})
+    run(writer.flush())
+    run(compact_statistics(filesystem))
+
+    assert get_author_shard_path(get_author_shard("VoxUmbra")) in filesystem.written
+    assert get_author_shard_path(get_author_shard("Criand")) not in filesystem.written
+    assert run(read_author_statistics(filesystem, "VoxUmbra")) == {"count": 10, "score_total": 1135}
+    assert run(read_author_statistics(filesystem, "Criand")) == {"count": 10, "score_total": 145}
+
+    # Compacted deltas are deleted, and compacting again without any new deltas writes nothing.
+    assert not any((tmp_path / "_stats" / "deltas").iterdir())
+
+    filesystem.written.clear()
+    run(compact_statistics(filesystem))
+    assert filesystem.written == []
+
+
+def test_score_buckets_cover_every_score():
+    for score in [-5, 0, 1, 2, 3, 1000, 4096]:
+        low, high = get_score_bucket_range(get_score_bucket(score))
+
+        assert low is None or low <= score
+        assert score <= high or (low is None and score <= 0)
+
+
+def test_deltas_sort_in_the_order_they_are_written():
+    run_ids = [make_run_id() for _ in range(1000)]
+
+    assert run_ids == sorted(run_ids)
+    assert len(set(run_ids)) == len(run_ids)
@@ -0,0 +1,61 @@
+import asyncio
+import json
+
+from src.common.archiver_config import MemoryConfigSource
+from src.common.messaging import RecordingMessagingService
+
+
+def test_poll_interval_follows_arrival_rate(clock, submission_finder):
+    poll_interval = submission_finder.AdaptivePollInterval(min_interval=5, max_interval=120, target_per_poll=5,
+                                                           clock=clock)
+
+    poll_interval.update(0)
+    assert poll_interval.interval == 120
+
+    # A burst of two submissions a second shortens the interval to the minimum.
+    for _ in range(10):
+        clock.now += 5
+        poll_interval.update(10)
+    assert poll_interval.interval == 5
+
+    # Quiet periods lengthen it again.
+    intervals = []
+    for _ in range(15):
+        clock.now += poll_interval.interval
+        poll_interval.update(0)
+        intervals.append(poll_interval.interval)
+    assert intervals == sorted(intervals)
+    assert intervals[-1] == 120
+
+
+def test_streaming_publishes_new_submissions_until_stopped(monkeypatch, capsys, run, submission_finder):
+    polls = []
+    stopping = asyncio.Event()
+
+    async def request(endpoint, subreddit, after):
+        polls.append(after)
+
+        # A new submission arrives between each time the finder catches up, until the task is stopped.
+        if len(polls) % 2 == 1:
+            return [{"id": f"s{after + 1}", "created_utc": after + 1}]
+
+        if len(polls) == 10:
+            stopping.set()
+
+        return []
+
+    monkeypatch.setattr(submission_finder.pushshift, "request", request)
+
+    config_source = MemoryConfigSource(after_utc=1000)
+    messaging_service = RecordingMessagingService()
+    poll_interval = submission_finder.AdaptivePollInterval(min_interval=0.001, max_interval=0.01)
+
+    run(submission_finder.main(config_source, messaging_service, stopping=stopping, poll_interval=poll_interval))
+
+    assert len(polls) == 10
+    assert messaging_service.messages == [f"s{after_utc}" for after_utc in range(1001, 1006)]
+    assert config_source.config["after_utc"] == 1005
+
+    events = [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith("{")]
+    assert [len(event["DiscoveryLag"]) for event in events] == [1] * 5
+    assert events[0]["_aws"]["CloudWatchMetrics"][0]["Metrics"] == [{"Name": "DiscoveryLag", "Unit": "Seconds"}]